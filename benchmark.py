@@ -0,0 +1,298 @@
+import argparse
+import gc
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import sapp
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000, 10_000_000)
+DEFAULT_EDIT_RATES = (0.0, 0.01, 0.1, 0.5)
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.25
+# Timing changes smaller than this are noise, whatever the ratio
+MIN_REGRESSION_SECONDS = 0.005
+DEFAULT_SEED = 1
+BENCH_URL = "https://bench.example.com/page"
+
+# Views read by the compare_pages_full stage: one from each group that is
+# built together, so every tab's content is included
+FULL_VIEWS = ('code_diff', 'old_iframe', 'text_comparison')
+
+WORDS = ("alpha bravo charlie delta echo foxtrot golf hotel india juliet kilo lima mike "
+         "november oscar papa quebec romeo sierra tango uniform victor whiskey xray yankee "
+         "zulu price release update policy notice version account service support product "
+         "order report market account change status result page section content").split()
+
+
+def _words(rng, low, high):
+    return [rng.choice(WORDS) for _ in range(rng.randint(low, high))]
+
+
+def _new_block(rng, index):
+    """One section of a generated page, as editable parts"""
+    return {
+        'id': f"s{index}",
+        'class': rng.choice(('card', 'panel', 'entry', 'card featured')),
+        'title': _words(rng, 2, 6),
+        'paragraphs': [_words(rng, 20, 80) for _ in range(rng.randint(1, 4))],
+        'items': [_words(rng, 1, 4) for _ in range(rng.randint(0, 6))],
+        'rows': [[rng.randint(0, 10_000) for _ in range(4)] for _ in range(rng.randint(0, 5))],
+    }
+
+
+def _render_block(block):
+    parts = [f'<section id="{block["id"]}" class="{block["class"]}">',
+             f'<h2>{" ".join(block["title"])}</h2>']
+    parts.extend(f'<p>{" ".join(words)}</p>' for words in block['paragraphs'])
+    if block['items']:
+        parts.append('<ul>')
+        parts.extend(f'<li><a href="/{"-".join(words)}">{" ".join(words)}</a></li>'
+                     for words in block['items'])
+        parts.append('</ul>')
+    if block['rows']:
+        parts.append('<table>')
+        parts.extend('<tr>' + ''.join(f'<td>{value}</td>' for value in row) + '</tr>'
+                     for row in block['rows'])
+        parts.append('</table>')
+    parts.append('</section>')
+    return '\n'.join(parts)
+
+
+def _render_page(blocks, token):
+    head = ('<!DOCTYPE html>\n<html><head><title>Benchmark page</title>\n'
+            f'<meta name="csrf-token" content="{token}">\n'
+            '<style>.card { margin: 1em } .featured { color: red }</style>\n'
+            '<script>window.analytics = {id: 42};</script>\n'
+            '</head><body>\n<nav><a href="/">Home</a> <a href="/about">About</a></nav>\n<main>\n')
+    return head + '\n'.join(_render_block(block) for block in blocks) + '\n</main></body></html>\n'
+
+
+def _edit(rng, blocks, next_index):
+    """Apply one random edit to a copy of blocks; returns the new next_index"""
+    position = rng.randrange(len(blocks))
+    kind = rng.choice(('text', 'text', 'attribute', 'insert', 'delete', 'move'))
+    if kind == 'text':
+        block = dict(blocks[position])
+        paragraphs = [list(words) for words in block['paragraphs']]
+        words = rng.choice(paragraphs)
+        for _ in range(rng.randint(1, 5)):
+            words[rng.randrange(len(words))] = rng.choice(WORDS)
+        block['paragraphs'] = paragraphs
+        blocks[position] = block
+    elif kind == 'attribute':
+        blocks[position] = dict(blocks[position], **{'class': rng.choice(('card', 'panel', 'entry', 'hidden'))})
+    elif kind == 'insert':
+        blocks.insert(position, _new_block(rng, next_index))
+        next_index += 1
+    elif kind == 'delete' and len(blocks) > 1:
+        del blocks[position]
+    elif kind == 'move' and len(blocks) > 1:
+        blocks.insert(rng.randrange(len(blocks)), blocks.pop(position))
+    return next_index
+
+
+def generate_pair(size, edit_rate, seed=DEFAULT_SEED):
+    """A deterministic (old_html, new_html) pair.
+
+    old_html is about size bytes of sectioned HTML; new_html has edit_rate
+    of its sections edited (text, attributes, insertions, deletions and
+    moves) and a different CSRF token. The same arguments always give the
+    same pages, on any machine.
+    """
+    rng = random.Random(f"page-{size}-{seed}")
+    blocks = []
+    total = 0
+    while total < size:
+        block = _new_block(rng, len(blocks))
+        blocks.append(block)
+        total += len(_render_block(block)) + 1
+    old_html = _render_page(blocks, 'a' * 32)
+
+    rng = random.Random(f"edits-{size}-{edit_rate}-{seed}")
+    new_blocks = list(blocks)
+    next_index = len(blocks)
+    for _ in range(round(len(blocks) * edit_rate)):
+        next_index = _edit(rng, new_blocks, next_index)
+    return old_html, _render_page(new_blocks, 'b' * 32)
+
+
+def compare_pages_full(old_html, new_html):
+    """compare_pages() with every view built, as when all of the result's tabs are opened"""
+    result = sapp.compare_pages(old_html, new_html, BENCH_URL)
+    if not result['unchanged']:
+        for view in FULL_VIEWS:
+            result[view]
+    return result
+
+
+def stages(old_html, new_html):
+    """(name, callable) for each benchmarked stage; inputs are prepared up front.
+
+    compare_pages times only the change metrics, since views are built when
+    first read; compare_pages_full also builds every view.
+    """
+    old_text = sapp.extract_text_content(old_html)
+    new_text = sapp.extract_text_content(new_html)
+    return [
+        ('compare_pages', lambda: sapp.compare_pages(old_html, new_html, BENCH_URL)),
+        ('compare_pages_full', lambda: compare_pages_full(old_html, new_html)),
+        ('extract_text_content', lambda: sapp.extract_text_content(new_html)),
+        ('highlight_visual_changes', lambda: sapp.highlight_visual_changes(old_html, new_html, BENCH_URL)),
+        ('create_text_comparison_html', lambda: sapp.create_text_comparison_html(old_text, new_text)),
+    ]
+
+
+def measure(func, repeat=DEFAULT_REPEAT):
+    """Median wall time over repeat runs, then peak Python heap in one traced run.
+
+    Memory is traced separately because tracemalloc slows the code it
+    watches. Memory allocated inside C extensions (lxml) is not counted.
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': statistics.median(times), 'peak_bytes': peak}
+
+
+def result_key(stage, size, edit_rate):
+    return f"{stage}/{size}/{edit_rate:g}"
+
+
+def run(sizes=DEFAULT_SIZES, edit_rates=DEFAULT_EDIT_RATES, repeat=DEFAULT_REPEAT,
+        only_stages=None, seed=DEFAULT_SEED, progress=None):
+    """Benchmark every stage over the corpus; returns {result_key: measurement}"""
+    results = {}
+    for size in sizes:
+        for edit_rate in edit_rates:
+            old_html, new_html = generate_pair(size, edit_rate, seed)
+            for stage, func in stages(old_html, new_html):
+                if only_stages and stage not in only_stages:
+                    continue
+                measurement = measure(func, repeat)
+                measurement.update(stage=stage, size=size, edit_rate=edit_rate, bytes=len(new_html))
+                results[result_key(stage, size, edit_rate)] = measurement
+                if progress:
+                    progress(measurement)
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'lxml': sapp.HAVE_LXML,
+        'created': datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+def save_baseline(path, results, seed=DEFAULT_SEED):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'environment': environment(), 'seed': seed, 'results': results}, f, indent=2)
+
+
+def load_baseline(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def regressions(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Measurements more than threshold (a fraction) slower or bigger than the baseline.
+
+    Returns a list of (key, metric, baseline value, new value).
+    """
+    found = []
+    for key, measurement in results.items():
+        reference = baseline['results'].get(key)
+        if reference is None:
+            continue
+        old_seconds, new_seconds = reference['seconds'], measurement['seconds']
+        if (new_seconds > old_seconds * (1 + threshold)
+                and new_seconds - old_seconds > MIN_REGRESSION_SECONDS):
+            found.append((key, 'seconds', old_seconds, new_seconds))
+        if measurement['peak_bytes'] > reference['peak_bytes'] * (1 + threshold):
+            found.append((key, 'peak_bytes', reference['peak_bytes'], measurement['peak_bytes']))
+    return found
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1000 or unit == 'GB':
+            return f"{size:g} {unit}"
+        size /= 1000
+
+
+def print_measurement(measurement):
+    print(f"{measurement['stage']:<28} {format_size(measurement['size']):>8} "
+          f"{measurement['edit_rate']:>6.0%} {measurement['seconds'] * 1000:>11.1f} "
+          f"{measurement['peak_bytes'] / 1e6:>10.1f}", flush=True)
+
+
+def _parse_size(text):
+    text = text.strip().upper()
+    for suffix, factor in (('MB', 1_000_000), ('KB', 1_000), ('M', 1_000_000), ('K', 1_000)):
+        if text.endswith(suffix):
+            return int(float(text[:-len(suffix)]) * factor)
+    return int(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m sapp benchmark",
+                                     description="Time the comparison pipeline on a generated corpus")
+    parser.add_argument("--sizes", default=",".join(format_size(size).replace(' ', '') for size in DEFAULT_SIZES),
+                        help="comma-separated page sizes, e.g. 10KB,1MB (default: %(default)s)")
+    parser.add_argument("--edits", default=",".join(f"{rate:g}" for rate in DEFAULT_EDIT_RATES),
+                        help="comma-separated fractions of sections edited (default: %(default)s)")
+    parser.add_argument("--stages", default=None,
+                        help="comma-separated stages to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help="timed runs per measurement; the median is reported (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED,
+                        help="corpus seed (default: %(default)s)")
+    parser.add_argument("--save-baseline", metavar="PATH",
+                        help="write the results to PATH as the new baseline")
+    parser.add_argument("--baseline", metavar="PATH",
+                        help="compare the results with the baseline in PATH")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="slowdown or memory growth (fraction) counted as a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    sizes = [_parse_size(size) for size in args.sizes.split(',')]
+    edit_rates = [float(rate) for rate in args.edits.split(',')]
+    only_stages = set(args.stages.split(',')) if args.stages else None
+    baseline = load_baseline(args.baseline) if args.baseline else None
+    if baseline and baseline.get('seed', DEFAULT_SEED) != args.seed:
+        print(f"Baseline was recorded with seed {baseline['seed']}, not {args.seed}", file=sys.stderr)
+        return 2
+
+    print(f"{'stage':<28} {'size':>8} {'edits':>6} {'median ms':>11} {'peak MB':>10}")
+    results = run(sizes, edit_rates, args.repeat, only_stages, args.seed, progress=print_measurement)
+
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results, args.seed)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if baseline:
+        found = regressions(results, baseline, args.threshold)
+        for key, metric, old, new in found:
+            print(f"REGRESSION {key} {metric}: {old:.6g} -> {new:.6g} ({new / old - 1:+.0%})")
+        if found:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%}")
+    return 0
@@ -0,0 +1,20 @@
+import sys
+
+
+def main(argv):
+    """Command-line entry point: python -m sapp <command> [args]"""
+    if argv[0] == 'monitor':
+        import monitor
+        return monitor.main(argv[1:])
+    if argv[0] == 'benchmark':
+        import benchmark
+        return benchmark.main(argv[1:])
+    if argv[0] == 'compact':
+        import retention
+        return retention.main(argv[1:])
+    print(f"Unknown command: {argv[0]}. Available commands: monitor, benchmark, compact")
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,462 @@
+import html as html_lib
+import re
+from collections import Counter
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup, Tag
+from bs4.builder import HTMLTreeBuilder
+from bs4.builder._htmlparser import BeautifulSoupHTMLParser
+from bs4.dammit import EntitySubstitution
+
+import instrumentation
+
+try:
+    import lxml.etree
+    HAVE_LXML = True
+except ImportError:
+    HAVE_LXML = False
+
+PARSERS = ('auto', 'html.parser', 'lxml')
+
+# With 'auto', documents at least this large are parsed with lxml when it is installed
+LXML_MIN_SIZE = 1_000_000
+
+# Elements whose contents never count as visible text
+NON_TEXT_TAGS = frozenset(['script', 'style', 'meta', 'link'])
+
+# How visible text is extracted. 'fast' turns parser events straight into
+# text without building a tree; 'tree' walks the BeautifulSoup tree. Both
+# give the same text, so 'tree' is only a fallback.
+TEXT_ENGINE = 'fast'
+
+# BeautifulSoup's own tag tables, which decide how its strings are built
+VOID_TAGS = frozenset(HTMLTreeBuilder.DEFAULT_EMPTY_ELEMENT_TAGS)
+# Strings inside these get their own NavigableString subclass, which get_text() leaves out
+STRING_CONTAINER_TAGS = frozenset(HTMLTreeBuilder.DEFAULT_STRING_CONTAINERS)
+PRESERVE_WHITESPACE_TAGS = frozenset(HTMLTreeBuilder.DEFAULT_PRESERVE_WHITESPACE_TAGS)
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+_COUNTED_TAGS = NON_TEXT_TAGS | STRING_CONTAINER_TAGS | PRESERVE_WHITESPACE_TAGS
+
+# Elements that start and end a line when text is extracted with block_breaks
+BLOCK_TAGS = frozenset([
+    'address', 'article', 'aside', 'blockquote', 'br', 'caption', 'dd', 'details', 'dialog',
+    'div', 'dl', 'dt', 'fieldset', 'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3',
+    'h4', 'h5', 'h6', 'header', 'hgroup', 'hr', 'li', 'main', 'nav', 'ol', 'p', 'pre',
+    'section', 'summary', 'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'title', 'tr', 'ul',
+])
+
+# A start tag, allowing '>' inside quoted attribute values
+START_TAG_RE = re.compile(r'''<[^\s/>]+(?:[^>"']|"[^"]*"|'[^']*')*>''')
+
+# Markup that rough_text() cuts out: script and style elements, comments and tags
+MARKUP_RE = re.compile(r'<(script|style)\b.*?</\1\s*>|<!--.*?-->|<[^>]*>', re.IGNORECASE | re.DOTALL)
+
+
+def choose_parser(html, backend='auto'):
+    """Pick the BeautifulSoup parser for a document"""
+    if backend == 'auto':
+        return 'lxml' if HAVE_LXML and len(html) >= LXML_MIN_SIZE else 'html.parser'
+    if backend == 'lxml' and not HAVE_LXML:
+        raise ValueError("The lxml parser backend needs the lxml package")
+    if backend not in PARSERS:
+        raise ValueError(f"Unknown parser backend: {backend}")
+    return backend
+
+
+def visible_text(soup):
+    """get_text() of the tree as if script/style/meta/link had been decomposed"""
+    types = soup.interesting_string_types or Tag.MAIN_CONTENT_STRING_TYPES
+    parts = []
+    node = soup.contents[0] if soup.contents else None
+    while node is not None:
+        if isinstance(node, Tag):
+            if node.name in NON_TEXT_TAGS:
+                # Skip the whole subtree
+                node = node._last_descendant().next_element
+                continue
+        elif type(node) in types:
+            parts.append(node)
+        node = node.next_element
+    return ''.join(parts)
+
+
+class _TextCollector:
+    """Builds strings from parser events the way BeautifulSoup does, keeping the visible ones.
+
+    The open-element stack, end-tag matching, whitespace collapsing and
+    string classes follow BeautifulSoup's tree builder, so the result is
+    visible_text() of the tree it would have built.
+    """
+
+    def __init__(self, block_breaks=False):
+        self.parts = []
+        self.data = []
+        self.block_breaks = block_breaks
+        self._stack = []
+        self._open = Counter()
+        self._skipped = 0      # open script/style/meta/link elements
+        self._containers = 0   # open elements giving strings their own class
+        self._preserved = 0    # open pre/textarea elements
+
+    def end_data(self, cdata=False):
+        if not self.data:
+            return
+        data = ''.join(self.data)
+        self.data = []
+        if not self._preserved and not data.strip(ASCII_SPACES):
+            data = '\n' if '\n' in data else ' '
+        # CDATA sections keep their class even inside string containers
+        if not self._skipped and (cdata or not self._containers):
+            self.parts.append(data)
+
+    def start(self, name):
+        self.end_data()
+        self._stack.append(name)
+        self._open[name] += 1
+        if name in _COUNTED_TAGS:
+            self._count(name, 1)
+        if self.block_breaks and name in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def end(self, name):
+        self.end_data()
+        if not self._open[name]:
+            return
+        while True:
+            popped = self._stack.pop()
+            self._open[popped] -= 1
+            if popped in _COUNTED_TAGS:
+                self._count(popped, -1)
+            if self.block_breaks and popped in BLOCK_TAGS:
+                self.parts.append('\n')
+            if popped == name:
+                return
+
+    def _count(self, name, step):
+        if name in NON_TEXT_TAGS:
+            self._skipped += step
+        if name in STRING_CONTAINER_TAGS:
+            self._containers += step
+        if name in PRESERVE_WHITESPACE_TAGS:
+            self._preserved += step
+
+    def text(self):
+        self.end_data()
+        return ''.join(self.parts)
+
+
+class _HTMLParserEvents(HTMLParser):
+    """html.parser events handled the way BeautifulSoup's html.parser builder handles them"""
+
+    def __init__(self, collector):
+        super().__init__(convert_charrefs=False)
+        self.collector = collector
+        self._closed_void = []
+
+    def handle_startendtag(self, tag, attrs):
+        self.collector.start(tag)
+        self.collector.end(tag)
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag)
+        if tag in VOID_TAGS:
+            # A later explicit end tag for it is ignored
+            self.collector.end(tag)
+            self._closed_void.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self._closed_void:
+            self._closed_void.remove(tag)
+        else:
+            self.collector.end(tag)
+
+    def handle_data(self, data):
+        self.collector.data.append(data)
+
+    def handle_charref(self, name):
+        character, _, extra = BeautifulSoupHTMLParser._dereference_numeric_character_reference(name)
+        self.collector.data.append(character)
+        self.collector.data.append(extra)
+
+    def handle_entityref(self, name):
+        character = EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name)
+        self.collector.data.append(character if character is not None else f"&{name}")
+
+    def handle_comment(self, data):
+        self.collector.end_data()
+
+    def handle_decl(self, decl):
+        self.collector.end_data()
+
+    def handle_pi(self, data):
+        self.collector.end_data()
+
+    def unknown_decl(self, data):
+        self.collector.end_data()
+        if data.upper().startswith('CDATA['):
+            self.collector.data.append(data[len('CDATA['):])
+            self.collector.end_data(cdata=True)
+
+
+class _LxmlEvents:
+    """lxml parser target handling events the way BeautifulSoup's lxml builder does"""
+
+    def __init__(self, collector):
+        self.collector = collector
+
+    def start(self, tag, attrib):
+        self.collector.start(tag)
+
+    def end(self, tag):
+        self.collector.end(tag)
+
+    def data(self, data):
+        self.collector.data.append(data)
+
+    def comment(self, text):
+        self.collector.end_data()
+
+    def doctype(self, *args):
+        self.collector.end_data()
+
+    def pi(self, target, data=None):
+        self.collector.end_data()
+
+    def close(self):
+        return self.collector.text()
+
+
+def stream_text(html, parser='html.parser', block_breaks=False):
+    """Visible text straight from parser events, without building a tree.
+
+    Gives exactly visible_text() of BeautifulSoup(html, parser). With
+    block_breaks, block-level elements also start and end a line. Returns
+    None for markup the parser rejects, so the caller can fall back to a
+    full parse (which raises BeautifulSoup's own error).
+    """
+    collector = _TextCollector(block_breaks)
+    if parser == 'lxml':
+        if html[:1] == '\N{BYTE ORDER MARK}':
+            html = html[1:]
+        events = lxml.etree.HTMLParser(target=_LxmlEvents(collector), recover=True)
+        try:
+            events.feed(html)
+            return events.close()
+        except (UnicodeDecodeError, LookupError, lxml.etree.ParserError):
+            return None
+
+    events = _HTMLParserEvents(collector)
+    try:
+        events.feed(html)
+        events.close()
+    except AssertionError:
+        return None
+    return collector.text()
+
+
+def clean_text_lines(text):
+    """Strip every line and drop the blank ones"""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    return '\n'.join(lines)
+
+
+def rough_text(html):
+    """Approximate visible text, with the markup cut out by a regular expression.
+
+    Much cheaper than parsing, for estimates that should not wait for a parse.
+    """
+    return clean_text_lines(MARKUP_RE.sub(' ', html))
+
+
+class ParsedPage:
+    """A single parse of an HTML document that every comparison view derives from.
+
+    The tree must be treated as read-only. Views that need a modified
+    document describe their changes through editor() instead of mutating it.
+    """
+
+    __slots__ = ('html', 'parser', '_soup', '_text', '_line_starts')
+
+    def __init__(self, html, backend='auto'):
+        self.html = html
+        self.parser = choose_parser(html, backend)
+        self._soup = None
+        self._text = None
+        self._line_starts = None
+
+    @property
+    def soup(self):
+        """The parsed tree (read-only), built on first use"""
+        if self._soup is None:
+            with instrumentation.span('parse', len(self.html)):
+                self._soup = BeautifulSoup(self.html, self.parser)
+        return self._soup
+
+    @property
+    def text(self):
+        """Visible text, one stripped non-empty line per line"""
+        if self._text is None:
+            with instrumentation.span('extract', len(self.html)):
+                text = None
+                # A tree that is already built is cheaper to walk than a new parse
+                if TEXT_ENGINE == 'fast' and self._soup is None:
+                    text = stream_text(self.html, self.parser)
+                if text is None:
+                    text = visible_text(self.soup)
+                self._text = clean_text_lines(text)
+        return self._text
+
+    def source_offset(self, tag):
+        """Offset of a tag's '<' in the source, or None if the parser did not record it"""
+        if tag.sourceline is None or tag.sourcepos is None:
+            return None
+        if self._line_starts is None:
+            self._line_starts = [0] + [m.end() for m in re.finditer('\n', self.html)]
+        return self._line_starts[tag.sourceline - 1] + tag.sourcepos
+
+    def editor(self):
+        return PageEditor(self)
+
+
+def as_parsed_page(html_or_page, backend='auto'):
+    if isinstance(html_or_page, ParsedPage):
+        return html_or_page
+    return ParsedPage(html_or_page, backend)
+
+
+def _format_attrs(attrs):
+    parts = []
+    for name, value in attrs.items():
+        if value is None:
+            parts.append(f' {name}')
+            continue
+        if isinstance(value, (list, tuple)):
+            value = ' '.join(value)
+        parts.append(f' {name}="{html_lib.escape(value, quote=True)}"')
+    return ''.join(parts)
+
+
+class PageEditor:
+    """Records changes to a ParsedPage and renders the modified HTML without touching the tree.
+
+    When the parser recorded source positions (html.parser) the changes are
+    spliced into the original source. Otherwise the tree is serialized with
+    the changes overlaid, reusing BeautifulSoup's serializer for every
+    subtree that has no changes.
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.soup = page.soup
+        self._attrs = {}      # id(tag) -> (tag, {name: value})
+        self._prepend = {}    # id(tag) -> (tag, [html, ...]) inserted as first children
+        self._append = {}     # id(tag) -> (tag, [html, ...]) inserted as last children
+
+    def get_attr(self, tag, name, default=None):
+        """Attribute value including changes made through this editor"""
+        changed = self._attrs.get(id(tag))
+        if changed and name in changed[1]:
+            return changed[1][name]
+        return tag.get(name, default)
+
+    def set_attr(self, tag, name, value):
+        self._attrs.setdefault(id(tag), (tag, {}))[1][name] = value
+
+    def prepend(self, tag, fragment):
+        """Insert an HTML fragment as the first child of tag"""
+        self._prepend.setdefault(id(tag), (tag, []))[1].insert(0, fragment)
+
+    def append(self, tag, fragment):
+        """Insert an HTML fragment as the last child of tag"""
+        self._append.setdefault(id(tag), (tag, []))[1].append(fragment)
+
+    def _start_tag(self, tag, self_closing=False):
+        attrs = dict(tag.attrs)
+        changed = self._attrs.get(id(tag))
+        if changed:
+            attrs.update(changed[1])
+        return f"<{tag.name}{_format_attrs(attrs)}{'/' if self_closing else ''}>"
+
+    def render(self):
+        """The document with all recorded changes applied"""
+        if not (self._attrs or self._prepend or self._append):
+            return self.page.html
+        spliced = self._render_spliced()
+        if spliced is not None:
+            return spliced
+        return self._render_serialized()
+
+    def _render_spliced(self):
+        html = self.page.html
+        tags = {}
+        for store in (self._attrs, self._prepend, self._append):
+            for key, (tag, _) in store.items():
+                tags[key] = tag
+
+        edits = []  # (start, end, replacement)
+        for key, tag in tags.items():
+            start = self.page.source_offset(tag)
+            if start is None:
+                return None
+            match = START_TAG_RE.match(html, start)
+            if match is None:
+                return None
+            end = match.end()
+            if key in self._attrs:
+                edits.append((start, end, self._start_tag(tag, match.group().endswith('/>'))))
+            if key in self._prepend:
+                edits.append((end, end, ''.join(self._prepend[key][1])))
+            if key in self._append:
+                closing = re.compile(rf'</{re.escape(tag.name)}\s*>', re.IGNORECASE).search(html, end)
+                position = closing.start() if closing else end
+                edits.append((position, position, ''.join(self._append[key][1])))
+
+        # At the same offset, insertions (the end of one start tag) go before a
+        # rewrite of the start tag that follows immediately.
+        edits.sort(key=lambda edit: (edit[0], edit[1] != edit[0]))
+        out = []
+        position = 0
+        for start, end, replacement in edits:
+            if start < position:
+                return None
+            out.append(html[position:start])
+            out.append(replacement)
+            position = end
+        out.append(html[position:])
+        return ''.join(out)
+
+    def _render_serialized(self):
+        # Tags on the path to a change have to be written out by hand
+        dirty = set()
+        for store in (self._attrs, self._prepend, self._append):
+            for tag, _ in store.values():
+                node = tag
+                while node is not None and id(node) not in dirty:
+                    dirty.add(id(node))
+                    node = node.parent
+
+        out = []
+
+        def write(node):
+            if not isinstance(node, Tag):
+                out.append(node.output_ready())
+            elif id(node) not in dirty:
+                out.append(node.decode())
+            else:
+                write_children(node)
+
+        def write_children(tag):
+            is_root = tag is self.soup
+            if not is_root:
+                out.append(self._start_tag(tag, tag.is_empty_element and tag.can_be_empty_element))
+            if id(tag) in self._prepend:
+                out.extend(self._prepend[id(tag)][1])
+            for child in tag.contents:
+                write(child)
+            if id(tag) in self._append:
+                out.extend(self._append[id(tag)][1])
+            if not is_root and not (tag.is_empty_element and tag.can_be_empty_element):
+                out.append(f"</{tag.name}>")
+
+        write(self.soup)
+        return ''.join(out)
@@ -0,0 +1,113 @@
+import codecs
+import hashlib
+from collections import namedtuple
+
+from requests.compat import chardet
+
+CHUNK_SIZE = 64 * 1024
+
+# text is None when the body hashed to the known hash and was not decoded.
+# raw is the body's bytes when they are exactly the UTF-8 encoding of text.
+Body = namedtuple('Body', 'text raw content_hash nbytes truncated')
+
+# Error responses with a body up to this size are read and dropped, so that
+# their keep-alive connection goes back to the pool instead of being closed
+DRAIN_BYTES = 64 * 1024
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+def _incremental_decoder(encoding):
+    """Decoder for a declared encoding, or None when it can be read as UTF-8"""
+    if encoding is None:
+        return None
+    try:
+        info = codecs.lookup(encoding)
+    except LookupError:
+        # Unknown charsets are decoded as UTF-8, like requests does
+        return None
+    if info.name == 'utf-8':
+        return None
+    return info.incrementaldecoder(errors='replace')
+
+
+def _decode_utf8(raw, detect):
+    """Text of a body read as UTF-8, and whether raw is exactly its encoding"""
+    try:
+        return raw.decode('utf-8'), True
+    except UnicodeDecodeError:
+        pass
+    encoding = (chardet.detect(raw)['encoding'] if detect else None) or 'utf-8'
+    try:
+        return str(raw, encoding, errors='replace'), False
+    except LookupError:
+        return str(raw, 'utf-8', errors='replace'), False
+
+
+def read_body(response, max_bytes=None, truncate=False, known_hash=None, chunk_size=CHUNK_SIZE):
+    """Read a streamed (stream=True) response body, hashing it as it arrives.
+
+    The text is what response.text would give, except that a body without a
+    declared charset is taken as UTF-8 when it is valid UTF-8, without
+    running charset detection. content_hash is snapshot_store.content_hash()
+    of the text. When it equals known_hash the body is left undecoded.
+
+    Bodies over max_bytes (counted after Content-Encoding is undone) raise
+    BodyTooLarge, or with truncate are cut off there and reading stops.
+    """
+    length = response.headers.get('Content-Length', '')
+    if max_bytes and not truncate and length.isdigit() and int(length) > max_bytes:
+        raise BodyTooLarge(f"Response is {int(length)} bytes, more than the {max_bytes} allowed")
+
+    decoder = _incremental_decoder(response.encoding)
+    digest = hashlib.sha256()
+    chunks = []
+    nbytes = 0
+    truncated = False
+    for chunk in response.iter_content(chunk_size):
+        if max_bytes and nbytes + len(chunk) > max_bytes:
+            if not truncate:
+                raise BodyTooLarge(f"Response is more than the {max_bytes} bytes allowed")
+            chunk = chunk[:max_bytes - nbytes]
+            truncated = True
+        nbytes += len(chunk)
+        if decoder is None:
+            # UTF-8 bodies are hashed as they are and only decoded at the end
+            digest.update(chunk)
+            chunks.append(chunk)
+        else:
+            text = decoder.decode(chunk)
+            digest.update(text.encode('utf-8'))
+            chunks.append(text)
+        if truncated:
+            break
+
+    if decoder is not None:
+        tail = decoder.decode(b'', final=True)
+        digest.update(tail.encode('utf-8'))
+        chunks.append(tail)
+    hexdigest = digest.hexdigest()
+    if known_hash and hexdigest == known_hash:
+        return Body(None, None, hexdigest, nbytes, truncated)
+    if decoder is not None:
+        return Body(''.join(chunks), None, hexdigest, nbytes, truncated)
+
+    raw = b''.join(chunks)
+    del chunks
+    text, exact = _decode_utf8(raw, detect=response.encoding is None)
+    if exact:
+        return Body(text, raw, hexdigest, nbytes, truncated)
+    # Invalid UTF-8 was replaced or decoded differently, so the hash is of the new text
+    hexdigest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    if known_hash and hexdigest == known_hash:
+        return Body(None, None, hexdigest, nbytes, truncated)
+    return Body(text, None, hexdigest, nbytes, truncated)
+
+
+def drain(response, max_bytes=DRAIN_BYTES):
+    """Read and drop a streamed body of known, small length so its connection can be reused"""
+    length = response.headers.get('Content-Length', '')
+    if length.isdigit() and int(length) <= max_bytes:
+        response.content
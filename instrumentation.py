@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+
+STAGES = ('fetch', 'save', 'parse', 'extract', 'diff', 'similarity', 'highlight', 'render')
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRIC_PREFIX = 'deffcheck'
+
+Timing = namedtuple('Timing', 'stage seconds nbytes')
+
+json_logger = logging.getLogger('deffcheck.timings')
+
+_enabled = False
+_local = threading.local()
+_lock = threading.Lock()
+_histograms = {}  # stage -> [count per bucket..., count above the last bucket]
+_sums = {}        # stage -> total seconds
+_bytes = {}       # stage -> total bytes
+
+
+class _Span:
+    __slots__ = ('stage', 'nbytes', '_started')
+
+    def __init__(self, stage, nbytes):
+        self.stage = stage
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._started
+        observe(self.stage, seconds, self.nbytes)
+        for records in getattr(_local, 'recorders', ()):
+            records.append(Timing(self.stage, seconds, self.nbytes))
+
+
+class _NullSpan:
+    """Stands in for spans and recorders while instrumentation is off"""
+    __slots__ = ()
+    nbytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Recording:
+    __slots__ = ('records',)
+
+    def __init__(self, records):
+        self.records = records
+
+    def __enter__(self):
+        if not hasattr(_local, 'recorders'):
+            _local.recorders = []
+        _local.recorders.append(self.records)
+        return self.records
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.recorders.remove(self.records)
+
+
+def configure(enabled=True, json_log=None):
+    """Turn the hooks on or off, and optionally append one JSON line per span to json_log.
+
+    Safe to call repeatedly (as Streamlit does on every rerun).
+    """
+    global _enabled
+    _enabled = enabled
+    path = str(Path(json_log).resolve()) if json_log else None
+    for handler in list(json_logger.handlers):
+        if getattr(handler, 'baseFilename', None) != path:
+            json_logger.removeHandler(handler)
+            handler.close()
+    if path and not json_logger.handlers:
+        handler = logging.FileHandler(path, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        json_logger.addHandler(handler)
+        json_logger.setLevel(logging.INFO)
+        json_logger.propagate = False
+
+
+def enabled():
+    return _enabled
+
+
+def span(stage, nbytes=0):
+    """Context manager timing one stage. Set .nbytes on it if the size is only known inside.
+
+    Returns a shared no-op object while instrumentation is off.
+    """
+    if not _enabled:
+        return NULL_SPAN
+    return _Span(stage, nbytes)
+
+
+def recording(records):
+    """Context manager appending a Timing to the records list for every span on this thread"""
+    if not _enabled:
+        return NULL_SPAN
+    return _Recording(records)
+
+
+def observe(stage, seconds, nbytes=0):
+    """Add one timing to the metrics (spans do this; also used for timings from worker processes)"""
+    with _lock:
+        counts = _histograms.get(stage)
+        if counts is None:
+            counts = _histograms[stage] = [0] * (len(BUCKETS) + 1)
+            _sums[stage] = 0.0
+            _bytes[stage] = 0
+        index = 0
+        while index < len(BUCKETS) and seconds > BUCKETS[index]:
+            index += 1
+        counts[index] += 1
+        _sums[stage] += seconds
+        _bytes[stage] += nbytes
+    if json_logger.handlers:
+        json_logger.info(json.dumps({
+            'time': datetime.now().isoformat(timespec='milliseconds'),
+            'stage': stage,
+            'ms': round(seconds * 1000, 3),
+            'bytes': nbytes,
+        }))
+
+
+def metrics_text():
+    """All metrics in the Prometheus text exposition format"""
+    with _lock:
+        stages = sorted(_histograms)
+        histograms = {stage: list(_histograms[stage]) for stage in stages}
+        sums = dict(_sums)
+        nbytes = dict(_bytes)
+
+    name = f'{METRIC_PREFIX}_stage_seconds'
+    lines = [f'# HELP {name} Time spent in each pipeline stage.',
+             f'# TYPE {name} histogram']
+    for stage in stages:
+        cumulative = 0
+        for bound, count in zip(BUCKETS, histograms[stage]):
+            cumulative += count
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{bound:g}"}} {cumulative}')
+        total = cumulative + histograms[stage][-1]
+        lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {total}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {sums[stage]:.6f}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {total}')
+
+    name = f'{METRIC_PREFIX}_stage_bytes_total'
+    lines += [f'# HELP {name} Bytes processed by each pipeline stage.',
+              f'# TYPE {name} counter']
+    lines += [f'{name}{{stage="{stage}"}} {nbytes[stage]}' for stage in stages]
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics(path):
+    """Atomically replace path with the current metrics (for a textfile collector)"""
+    path = Path(path)
+    temp = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    temp.write_text(metrics_text(), encoding='utf-8')
+    os.replace(temp, path)
+
+
+def summarize(records):
+    """Total seconds, bytes and calls per stage, in pipeline order"""
+    totals = {}
+    for record in records:
+        seconds, nbytes, calls = totals.get(record.stage, (0.0, 0, 0))
+        totals[record.stage] = (seconds + record.seconds, nbytes + record.nbytes, calls + 1)
+    order = {stage: index for index, stage in enumerate(STAGES)}
+    return [(stage,) + totals[stage] for stage in sorted(totals, key=lambda s: order.get(s, len(order)))]
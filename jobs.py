@@ -0,0 +1,297 @@
+import importlib
+import multiprocessing
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import instrumentation
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+TIMEOUT = 'timeout'
+FINISHED = frozenset([DONE, FAILED, CANCELLED, TIMEOUT])
+
+DEFAULT_WORKERS = 2
+DEFAULT_TIMEOUT = 120
+# Jobs waiting or running at once; more are refused
+MAX_PENDING = 64
+# Finished jobs kept for polling
+MAX_FINISHED = 128
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    """One submitted task, as seen from the submitting process"""
+
+    def __init__(self, key, timeout):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.timeout = timeout
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = 'Queued'
+        self.result = None
+        self.error = None
+        self.timings = []
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.slot = None
+        self.task = None  # (target, args, kwargs), to start it again on a new pool
+        self.future = None
+
+    @property
+    def done(self):
+        return self.status in FINISHED
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+
+# Worker process state, set up by _init_worker
+_progress_queue = None
+_cancel_flags = None
+_current = None  # (job id, slot) of the job this worker is running
+
+
+def _init_worker(progress_queue, cancel_flags):
+    global _progress_queue, _cancel_flags
+    _progress_queue = progress_queue
+    _cancel_flags = cancel_flags
+
+
+def report(message, progress=None):
+    """Report progress from inside a job; raises JobCancelled if the job was cancelled.
+
+    Does nothing outside a job worker, so task functions can be called directly.
+    """
+    if _current is None:
+        return
+    job_id, slot = _current
+    if _cancel_flags[slot]:
+        raise JobCancelled()
+    _progress_queue.put((job_id, message, progress))
+
+
+class _StageCheckpoints(list):
+    """Recorder whose every finished instrumentation span is a progress checkpoint"""
+
+    def append(self, timing):
+        super().append(timing)
+        report(f"Finished {timing.stage}")
+
+
+def _resolve(target):
+    """A callable, or a 'module:function' name imported in the worker"""
+    if callable(target):
+        return target
+    module, _, name = target.partition(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def _run_job(job_id, slot, target, args, kwargs):
+    """Run one task in a worker; returns (result, instrumentation timings)"""
+    global _current
+    _current = (job_id, slot)
+    try:
+        report('Started', 0.0)
+        # Resolved first: importing the target's module may configure instrumentation
+        func = _resolve(target)
+        timings = _StageCheckpoints()
+        with instrumentation.recording(timings):
+            result = func(*args, **kwargs)
+        return result, list(timings)
+    finally:
+        _current = None
+
+
+def _terminate(pool):
+    """Shut a pool down, killing its workers even in the middle of a task"""
+    # ProcessPoolExecutor only gained terminate_workers() in Python 3.14
+    processes = list((getattr(pool, '_processes', None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+class JobQueue:
+    """Runs tasks on a bounded process pool and tracks them as jobs.
+
+    Tasks submitted under the key of a job still in flight join that job
+    instead of running again. Progress and cancellation are cooperative:
+    a task reports through report(), and a cancelled job stops at its next
+    report (or instrumentation span) in the worker. Until then its worker
+    stays busy, but its result is discarded. A job still running past its
+    timeout may never get to a report, so the pool is replaced: its workers
+    are terminated and the other jobs on it start again on the new one.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_pending=MAX_PENDING, max_finished=MAX_FINISHED):
+        self._context = multiprocessing.get_context('spawn')
+        self._workers = workers
+        self._progress = self._context.Queue()
+        self._cancel_flags = self._context.Array('b', max_pending, lock=False)
+        self._free_slots = list(range(max_pending))
+        self._pool = self._new_pool()
+        self._jobs = OrderedDict()   # id -> Job
+        self._in_flight = {}         # key -> Job
+        self._max_finished = max_finished
+        self._lock = threading.RLock()
+        self._closed = False
+        self._watcher = threading.Thread(target=self._watch, name='job-watcher', daemon=True)
+        self._watcher.start()
+
+    def submit(self, key, target, *args, timeout=DEFAULT_TIMEOUT, **kwargs):
+        """Queue target(*args, **kwargs) in a worker, or join the in-flight job with the same key.
+
+        target is a module-level function, or its 'module:function' name
+        for functions of a script the workers cannot import by reference.
+        Raises QueueFull when max_pending jobs are already waiting or running.
+        """
+        with self._lock:
+            job = self._in_flight.get(key)
+            if job is not None:
+                return job
+            if not self._free_slots:
+                raise QueueFull(f"{len(self._in_flight)} jobs are already pending")
+            job = Job(key, timeout)
+            job.slot = self._free_slots.pop()
+            job.task = (target, args, kwargs)
+            self._jobs[job.id] = job
+            self._in_flight[key] = job
+            self._start(job)
+        return job
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self._workers, mp_context=self._context,
+                                   initializer=_init_worker,
+                                   initargs=(self._progress, self._cancel_flags))
+
+    def _start(self, job):
+        # Called with the lock held
+        target, args, kwargs = job.task
+        self._cancel_flags[job.slot] = 0
+        job.future = self._pool.submit(_run_job, job.id, job.slot, target, args, kwargs)
+        job.future.add_done_callback(lambda future: self._finish(job, future))
+
+    def _replace_pool(self):
+        """Terminate every worker and start the jobs in flight again on a new pool"""
+        with self._lock:
+            pool = self._pool
+            self._pool = self._new_pool()
+            for job in self._in_flight.values():
+                job.status = QUEUED
+                job.message = 'Queued'
+                job.progress = 0.0
+                job.started = None
+                self._start(job)
+        _terminate(pool)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a job; returns False if it had already finished"""
+        return self._stop(job_id, CANCELLED, 'Cancelled')
+
+    def _stop(self, job_id, status, message):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                return False
+            self._cancel_flags[job.slot] = 1
+            self._settle(job, status, message)
+            # A job that has not started is dropped right away
+            job.future.cancel()
+        return True
+
+    def _settle(self, job, status, message, result=None, error=None):
+        # Called with the lock held
+        job.status = status
+        job.message = message
+        job.result = result
+        job.error = error
+        job.finished = time.time()
+        if status == DONE:
+            job.progress = 1.0
+        if self._in_flight.get(job.key) is job:
+            del self._in_flight[job.key]
+        finished = [other for other in self._jobs.values() if other.done]
+        for other in finished[:max(0, len(finished) - self._max_finished)]:
+            del self._jobs[other.id]
+
+    def _finish(self, job, future):
+        with self._lock:
+            if future is not job.future:
+                # Started again on a new pool, which has the slot now
+                return
+            # The slot is only reused once the worker is done with it
+            self._free_slots.append(job.slot)
+            if job.done:
+                return
+            if future.cancelled():
+                self._settle(job, CANCELLED, 'Cancelled')
+                return
+            error = future.exception()
+            if error is None:
+                result, job.timings = future.result()
+                self._settle(job, DONE, 'Done', result=result)
+            elif isinstance(error, JobCancelled):
+                self._settle(job, CANCELLED, 'Cancelled')
+            else:
+                self._settle(job, FAILED, str(error) or type(error).__name__, error=error)
+
+    def _watch(self):
+        """Apply progress reports and enforce timeouts"""
+        while not self._closed:
+            try:
+                job_id, message, progress = self._progress.get(timeout=0.2)
+            except queue.Empty:
+                pass
+            except (EOFError, OSError):
+                return
+            else:
+                with self._lock:
+                    job = self._jobs.get(job_id)
+                    if job is not None and not job.done:
+                        if job.status == QUEUED:
+                            job.status = RUNNING
+                            job.started = time.time()
+                        job.message = message
+                        if progress is not None:
+                            job.progress = progress
+            now = time.time()
+            with self._lock:
+                expired = [job for job in self._in_flight.values()
+                           if job.timeout and job.started and now - job.started > job.timeout]
+            for job in expired:
+                self._stop(job.id, TIMEOUT, f"Timed out after {job.timeout:g} s")
+            if expired:
+                # The workers may never get to a report that would stop them
+                self._replace_pool()
+
+    def shutdown(self):
+        self._closed = True
+        with self._lock:
+            jobs = list(self._in_flight.values())
+        for job in jobs:
+            self.cancel(job.id)
+        # Cancelled jobs may never get to a report; nothing waits for their results
+        _terminate(self._pool)
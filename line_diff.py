@@ -0,0 +1,372 @@
+import difflib
+import threading
+import time
+from bisect import bisect_left
+from itertools import islice
+
+ALGORITHMS = ('patience', 'difflib')
+
+# Lines occurring more often than this in a region are never used as anchors
+MAX_ANCHOR_OCCURRENCES = 64
+
+
+def _intern_lines(a_lines, b_lines):
+    """Replace lines with small ints so every comparison is an int compare"""
+    ids = {}
+    a = [ids.setdefault(line, len(ids)) for line in a_lines]
+    b = [ids.setdefault(line, len(ids)) for line in b_lines]
+    return a, b
+
+
+def _find_anchor(a, b, alo, ahi, blo, bhi):
+    """Longest common run around the rarest line shared by both regions, or None"""
+    counts = {}
+    for i in range(alo, ahi):
+        counts[a[i]] = counts.get(a[i], 0) + 1
+
+    best = None
+    best_count = MAX_ANCHOR_OCCURRENCES + 1
+    positions = {}
+    for i in range(alo, ahi):
+        if counts[a[i]] < best_count:
+            positions.setdefault(a[i], []).append(i)
+    j = blo
+    while j < bhi:
+        count = counts.get(b[j])
+        if count is None or count > best_count:
+            j += 1
+            continue
+        # Lines of b inside a run already examined need not be tried again
+        next_j = j + 1
+        for i in positions.get(b[j], ()):
+            # Extend the match in both directions
+            start_a, start_b = i, j
+            while start_a > alo and start_b > blo and a[start_a - 1] == b[start_b - 1]:
+                start_a -= 1
+                start_b -= 1
+            end_a, end_b = i + 1, j + 1
+            while end_a < ahi and end_b < bhi and a[end_a] == b[end_b]:
+                end_a += 1
+                end_b += 1
+            next_j = max(next_j, end_b)
+            if (best is None or count < best_count
+                    or (count == best_count and end_a - start_a > best[1] - best[0])):
+                best = (start_a, end_a, start_b, end_b)
+                best_count = count
+        j = next_j
+    return best
+
+
+def _unique_anchors(a, b, alo, ahi, blo, bhi):
+    """Pairs (i, j) of lines unique in both regions, longest increasing subsequence of them"""
+    a_seen = {}
+    for i in range(alo, ahi):
+        a_seen[a[i]] = -1 if a[i] in a_seen else i
+    b_seen = {}
+    for j in range(blo, bhi):
+        line = b[j]
+        if a_seen.get(line, -1) >= 0:
+            b_seen[line] = -1 if line in b_seen else j
+    pairs = [(a_seen[line], j) for line, j in b_seen.items() if j >= 0]
+    if not pairs:
+        return []
+    pairs.sort()
+
+    # Patience sorting: tails[k] is the pair ending the best run of length k + 1
+    tails = []
+    tail_js = []
+    previous = {}
+    for pair in pairs:
+        k = bisect_left(tail_js, pair[1])
+        previous[pair] = tails[k - 1] if k else None
+        if k == len(tails):
+            tails.append(pair)
+            tail_js.append(pair[1])
+        else:
+            tails[k] = pair
+            tail_js[k] = pair[1]
+    anchors = []
+    pair = tails[-1]
+    while pair is not None:
+        anchors.append(pair)
+        pair = previous[pair]
+    anchors.reverse()
+    return anchors
+
+
+def patience_opcodes(a_lines, b_lines):
+    """Yield difflib-style opcodes lazily and in order, using patience diff.
+
+    Each region is split at the lines that occur exactly once on both sides
+    (or, failing that, around its rarest common line) and the gaps are
+    diffed left to right, so the first opcodes are available long before
+    the whole diff is done.
+    """
+    a, b = _intern_lines(a_lines, b_lines)
+    stack = [('diff', 0, len(a), 0, len(b))]
+    while stack:
+        kind, alo, ahi, blo, bhi = stack.pop()
+        if kind == 'equal':
+            yield ('equal', alo, ahi, blo, bhi)
+            continue
+
+        # Common prefix and suffix are equal runs
+        prefix = 0
+        while alo + prefix < ahi and blo + prefix < bhi and a[alo + prefix] == b[blo + prefix]:
+            prefix += 1
+        suffix = 0
+        while (ahi - suffix > alo + prefix and bhi - suffix > blo + prefix
+               and a[ahi - suffix - 1] == b[bhi - suffix - 1]):
+            suffix += 1
+        if suffix:
+            stack.append(('equal', ahi - suffix, ahi, bhi - suffix, bhi))
+        if prefix:
+            yield ('equal', alo, alo + prefix, blo, blo + prefix)
+        alo, blo = alo + prefix, blo + prefix
+        ahi, bhi = ahi - suffix, bhi - suffix
+
+        if alo == ahi and blo == bhi:
+            continue
+        if alo == ahi:
+            yield ('insert', alo, ahi, blo, bhi)
+            continue
+        if blo == bhi:
+            yield ('delete', alo, ahi, blo, bhi)
+            continue
+
+        anchors = _unique_anchors(a, b, alo, ahi, blo, bhi)
+        if not anchors:
+            anchor = _find_anchor(a, b, alo, ahi, blo, bhi)
+            if anchor is None:
+                yield ('replace', alo, ahi, blo, bhi)
+                continue
+            start_a, end_a, start_b, end_b = anchor
+            stack.append(('diff', end_a, ahi, end_b, bhi))
+            stack.append(('equal', start_a, end_a, start_b, end_b))
+            stack.append(('diff', alo, start_a, blo, start_b))
+            continue
+
+        # Pushed last-first so the gaps come off the stack in order
+        stack.append(('diff', anchors[-1][0] + 1, ahi, anchors[-1][1] + 1, bhi))
+        for index in range(len(anchors) - 1, -1, -1):
+            i, j = anchors[index]
+            stack.append(('equal', i, i + 1, j, j + 1))
+            if index:
+                stack.append(('diff', anchors[index - 1][0] + 1, i, anchors[index - 1][1] + 1, j))
+            else:
+                stack.append(('diff', alo, i, blo, j))
+
+
+def iter_opcodes(a_lines, b_lines, algorithm='patience'):
+    """Opcodes from the chosen algorithm, with adjacent changes merged"""
+    if algorithm == 'patience':
+        opcodes = patience_opcodes(a_lines, b_lines)
+    elif algorithm == 'difflib':
+        opcodes = iter(difflib.SequenceMatcher(None, a_lines, b_lines).get_opcodes())
+    else:
+        raise ValueError(f"Unknown diff algorithm: {algorithm}")
+
+    pending = None
+    for tag, i1, i2, j1, j2 in opcodes:
+        if i1 == i2 and j1 == j2:
+            continue
+        if pending is None:
+            pending = [tag, i1, i2, j1, j2]
+        elif (tag == 'equal') == (pending[0] == 'equal'):
+            # Extend the run; delete + insert next to each other become a replace
+            if tag != pending[0]:
+                pending[0] = 'replace'
+            pending[2], pending[4] = i2, j2
+        else:
+            yield tuple(pending)
+            pending = [tag, i1, i2, j1, j2]
+    if pending is not None:
+        yield tuple(pending)
+
+
+def change_summary(a_lines, b_lines, gap=3, algorithm='patience'):
+    """(lines added, lines removed, regions) between two line lists.
+
+    Regions are [a_start, a_end, b_start, b_end] ranges of changed lines;
+    changes separated by at most gap unchanged lines form one region.
+    """
+    added = removed = 0
+    regions = []
+    for tag, i1, i2, j1, j2 in iter_opcodes(a_lines, b_lines, algorithm):
+        if tag == 'equal':
+            continue
+        removed += i2 - i1
+        added += j2 - j1
+        if regions and i1 - regions[-1][1] <= gap and j1 - regions[-1][3] <= gap:
+            regions[-1][1], regions[-1][3] = i2, j2
+        else:
+            regions.append([i1, i2, j1, j2])
+    return added, removed, regions
+
+
+def grouped_opcodes(opcodes, n):
+    """Streaming equivalent of SequenceMatcher.get_grouped_opcodes()"""
+    group = []
+    first = True
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            if first:
+                # Leading context only
+                i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+            elif i2 - i1 > 2 * n:
+                group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+                yield group
+                group = []
+                i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        first = False
+        group.append((tag, i1, i2, j1, j2))
+
+    if group and group[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = group[-1]
+        group[-1] = (tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+
+def _format_range(start, stop):
+    """Range in unified diff hunk-header format (as difflib does it)"""
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return f'{beginning}'
+    if not length:
+        beginning -= 1
+    return f'{beginning},{length}'
+
+
+def matching_keys(a_lines, b_lines, keys):
+    """keys if they pair up line for line with a_lines and b_lines, else the lines themselves"""
+    if keys is not None and len(keys[0]) == len(a_lines) and len(keys[1]) == len(b_lines):
+        return keys
+    return a_lines, b_lines
+
+
+def iter_unified_diff(a_lines, b_lines, n=3, algorithm='patience', keys=None):
+    """Yield unified diff lines (as difflib.unified_diff with lineterm='') one at a time.
+
+    keys, if given, is a pair of line lists (such as noise-masked copies)
+    that are matched in place of a_lines and b_lines, which are still the
+    lines shown.
+    """
+    started = False
+    a_keys, b_keys = matching_keys(a_lines, b_lines, keys)
+    for group in grouped_opcodes(iter_opcodes(a_keys, b_keys, algorithm), n):
+        if not started:
+            started = True
+            yield '--- '
+            yield '+++ '
+        first, last = group[0], group[-1]
+        yield f'@@ -{_format_range(first[1], last[2])} +{_format_range(first[3], last[4])} @@'
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                for line in a_lines[i1:i2]:
+                    yield ' ' + line
+                continue
+            if tag in ('replace', 'delete'):
+                for line in a_lines[i1:i2]:
+                    yield '-' + line
+            if tag in ('replace', 'insert'):
+                for line in b_lines[j1:j2]:
+                    yield '+' + line
+
+
+def limited(lines, max_lines=None, max_ms=None):
+    """Take diff lines until a line or time limit is hit.
+
+    Returns (lines, reason) where reason is None when the diff is complete,
+    otherwise 'lines' or 'time'. Nothing past the limit is consumed, so the
+    same iterator can be continued later.
+    """
+    if max_lines is not None and max_lines <= 0:
+        return [], 'lines'
+    deadline = None if max_ms is None else time.perf_counter() + max_ms / 1000
+    taken = []
+    for line in lines:
+        taken.append(line)
+        if max_lines is not None and len(taken) >= max_lines:
+            return taken, 'lines'
+        if deadline is not None and time.perf_counter() > deadline:
+            return taken, 'time'
+    return taken, None
+
+
+class DiffPager:
+    """Pages of a unified diff, computed only as far as has been requested.
+
+    Lines already produced are kept, so going back to an earlier page or
+    forward to the next one never recomputes the diff. A page requested
+    with max_ms may come back short; asking for it again resumes the diff
+    where it stopped. Safe to share between threads.
+    """
+
+    def __init__(self, a_lines, b_lines, page_size=500, n=3, algorithm='patience', keys=None):
+        self.page_size = page_size
+        self._args = (a_lines, b_lines, n, algorithm, keys)
+        self._lines = []
+        self._source = None
+        self._exhausted = False
+        self._lock = threading.Lock()
+
+    def _fill(self, count, max_ms=None):
+        """Compute lines up to count; False if max_ms ran out first"""
+        with self._lock:
+            if self._exhausted or len(self._lines) >= count:
+                return True
+            if self._source is None:
+                a_lines, b_lines, n, algorithm, keys = self._args
+                self._source = iter_unified_diff(a_lines, b_lines, n=n, algorithm=algorithm, keys=keys)
+                # After unpickling, skip what was computed before
+                for _ in islice(self._source, len(self._lines)):
+                    pass
+            taken, reason = limited(self._source, count - len(self._lines), max_ms)
+            self._lines.extend(taken)
+            if reason is None:
+                self._exhausted = True
+                self._source = None
+                self._args = None
+            return reason != 'time'
+
+    def page(self, index, max_ms=None):
+        """Lines of page index (0-based) and whether the page is complete"""
+        start = index * self.page_size
+        # One extra line tells has_next() whether another page follows
+        finished = self._fill(start + self.page_size + 1, max_ms)
+        return self._lines[start:start + self.page_size], finished
+
+    def has_next(self, index):
+        """Whether a page follows page index, as far as has been computed"""
+        return len(self._lines) > (index + 1) * self.page_size
+
+    @property
+    def complete(self):
+        return self._exhausted
+
+    @property
+    def lines_computed(self):
+        return len(self._lines)
+
+    def approx_size(self):
+        """Characters held: computed lines plus the inputs while the diff is unfinished"""
+        size = sum(len(line) for line in self._lines)
+        if self._args is not None:
+            a_lines, b_lines, _, _, keys = self._args
+            for lines in (a_lines, b_lines) + (keys or ()):
+                size += sum(len(line) for line in lines)
+        return size
+
+    def __getstate__(self):
+        # The live generator and the lock cannot be pickled; the diff is
+        # restarted from the inputs when more lines are needed
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_source'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
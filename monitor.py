@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from functools import partial
+from urllib.parse import urlsplit
+
+import instrumentation
+import region
+import sapp
+
+DEFAULT_INTERVAL = 3600
+DEFAULT_CONCURRENCY = 50
+DEFAULT_PER_HOST = 4
+DEFAULT_JITTER = 0.1
+DEFAULT_LOG = "changes.jsonl"
+
+
+def parse_targets(lines, default_interval=DEFAULT_INTERVAL):
+    """Parse 'URL [interval_seconds]' lines, skipping blanks and # comments"""
+    targets = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = line.split()
+        interval = float(parts[1]) if len(parts) > 1 else default_interval
+        targets.append({'url': parts[0], 'interval': interval})
+    return targets
+
+
+def compare_summary(old_content, new_content, url, watch_selector=None):
+    """Run compare_pages in a worker process and return only the headline figures.
+
+    The stage timings recorded in the worker come back under 'timings', as
+    (stage, seconds, bytes) lists.
+    """
+    timings = []
+    with instrumentation.recording(timings):
+        if watch_selector:
+            old_content = region.region_document(old_content, watch_selector)
+            new_content = region.region_document(new_content, watch_selector)
+        result = sapp.compare_pages(old_content, new_content, url)
+        if not result['unchanged']:
+            # No one waits on a worker's summary, so large pages get the measured text change
+            result.refine()
+    return {
+        'unchanged': result['unchanged'],
+        'change_percentage': result['change_percentage'],
+        'visual_change_percentage': result['visual_change_percentage'],
+        'change_percentage_exact': result['change_percentage_exact'],
+        'visual_change_percentage_exact': result['visual_change_percentage_exact'],
+        'timings': [list(timing) for timing in timings]
+    }
+
+
+class Monitor:
+    """Checks many URLs concurrently and records changes.
+
+    Network I/O runs on a thread pool bounded by a global and a per-host
+    limit; comparisons run in a process pool so that diffing large pages
+    never blocks the event loop.
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, per_host=DEFAULT_PER_HOST,
+                 jitter=DEFAULT_JITTER, log_path=DEFAULT_LOG, workers=None, once=False,
+                 metrics_file=None):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.jitter = jitter
+        self.log_path = log_path
+        self.workers = workers
+        self.once = once
+        self.metrics_file = metrics_file
+        self.results = []
+        self._global_slots = None
+        self._host_slots = {}
+        self._io_pool = None
+        self._cpu_pool = None
+        self._log_file = None
+
+    def _host_slot(self, url):
+        host = urlsplit(url).netloc.lower()
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(self.per_host)
+        return self._host_slots[host]
+
+    def _log(self, record):
+        self.results.append(record)
+        if self._log_file:
+            self._log_file.write(json.dumps(record) + '\n')
+            self._log_file.flush()
+
+    async def _io(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._io_pool, partial(func, *args, **kwargs))
+
+    async def _save(self, url, fetched):
+        metadata = await self._io(sapp.save_page, url, fetched['content'], validators=fetched,
+                                  digest=fetched['content_hash'])
+        return metadata['version']
+
+    async def _compute(self, func, *args):
+        """Run func in the process pool, replacing the pool if a worker died"""
+        pool = self._cpu_pool
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(pool, func, *args)
+        except BrokenProcessPool:
+            if self._cpu_pool is pool:
+                self._cpu_pool = self._new_cpu_pool()
+                pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    def _new_cpu_pool(self):
+        # spawn keeps worker processes clear of the I/O threads' state
+        return ProcessPoolExecutor(max_workers=self.workers,
+                                   mp_context=multiprocessing.get_context('spawn'))
+
+    async def check(self, url):
+        """Fetch one URL, compare it with its latest snapshot and save it if it changed.
+
+        Any failure is recorded as an 'error' check of this URL, so it never
+        stops the other URLs being watched.
+        """
+        started = time.perf_counter()
+        record = {'url': url, 'checked_at': datetime.now().isoformat(timespec='seconds')}
+        try:
+            await self._check(url, record)
+        except Exception as e:
+            record.update(status='error', error=f"{type(e).__name__}: {e}")
+
+        record['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        self._log(record)
+        if self.metrics_file:
+            try:
+                await self._io(instrumentation.write_metrics, self.metrics_file)
+            except OSError as e:
+                print(f"Could not write {self.metrics_file}: {e}", file=sys.stderr)
+        return record
+
+    async def _check(self, url, record):
+        # Wait for the host's slot first, so URLs queued behind a busy host
+        # do not hold global slots that other hosts could use
+        async with self._host_slot(url), self._global_slots:
+            latest = await self._io(sapp.catalog.latest, url)
+            try:
+                fetched = await self._io(sapp.fetch_page, url, validators=latest, raise_errors=True)
+            except Exception as e:
+                record.update(status='error', error=str(e))
+                fetched = None
+
+        if fetched is None:
+            pass
+        elif latest is None:
+            record.update(status='saved', version=await self._save(url, fetched))
+        elif fetched['unchanged']:
+            # A 304, or a body that hashed the same as the latest snapshot
+            record.update(status='unchanged', not_modified=fetched['status'] == 304)
+        else:
+            old_content = await self._io(sapp.store.read, latest)
+            watch_selector = await self._io(sapp.catalog.watch_selector, url)
+            try:
+                summary = await self._compute(compare_summary, old_content, fetched['content'],
+                                              url, watch_selector)
+            except ValueError as e:
+                # An invalid watch selector, or a page it cannot be applied to
+                record.update(status='error', error=str(e))
+            else:
+                # Timings from the worker process count towards this process's metrics
+                for stage, seconds, nbytes in summary.pop('timings'):
+                    instrumentation.observe(stage, seconds, nbytes)
+                record.update(summary)
+                if summary['unchanged']:
+                    record['status'] = 'unchanged'
+                else:
+                    record.update(status='changed', version=await self._save(url, fetched))
+                    # Stats of the new version against the previous one, for the timeline
+                    await self._compute(sapp.update_timeline, url, watch_selector)
+
+    async def _watch(self, target):
+        """Check one URL forever (or once), on its own jittered schedule"""
+        loop = asyncio.get_running_loop()
+        interval = target['interval']
+        if not self.once:
+            # Spread the first round so that all URLs do not fire at once
+            await asyncio.sleep(random.uniform(0, interval * self.jitter))
+        while True:
+            started = loop.time()
+            await self.check(target['url'])
+            if self.once:
+                return
+            delay = interval * (1 + random.uniform(-self.jitter, self.jitter))
+            await asyncio.sleep(max(0.0, started + delay - loop.time()))
+
+    async def run(self, targets):
+        """Monitor all targets; returns the check records when running once"""
+        self._global_slots = asyncio.Semaphore(self.concurrency)
+        self._io_pool = ThreadPoolExecutor(max_workers=self.concurrency)
+        self._cpu_pool = self._new_cpu_pool()
+        self._log_file = open(self.log_path, 'a', encoding='utf-8') if self.log_path else None
+        try:
+            await asyncio.gather(*(self._watch(target) for target in targets))
+        finally:
+            if self._log_file:
+                self._log_file.close()
+            self._io_pool.shutdown(wait=False)
+            self._cpu_pool.shutdown(wait=True, cancel_futures=True)
+        return self.results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m sapp monitor",
+                                     description="Check many URLs for changes without the UI")
+    parser.add_argument("urls_file", help="file with one 'URL [interval_seconds]' per line")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL,
+                        help="default seconds between checks of a URL (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="maximum requests in flight (default: %(default)s)")
+    parser.add_argument("--per-host", type=int, default=DEFAULT_PER_HOST,
+                        help="maximum requests in flight per host (default: %(default)s)")
+    parser.add_argument("--jitter", type=float, default=DEFAULT_JITTER,
+                        help="random +/- fraction applied to each interval (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes used for comparisons (default: CPU count)")
+    parser.add_argument("--log", default=DEFAULT_LOG,
+                        help="JSON-lines file that check results are appended to (default: %(default)s)")
+    parser.add_argument("--once", action="store_true",
+                        help="check every URL once and exit")
+    parser.add_argument("--metrics-file", default=None,
+                        help="Prometheus text file rewritten with stage timings after every check")
+    parser.add_argument("--timings-log", default=None,
+                        help="JSON-lines file that every timed stage is appended to")
+    args = parser.parse_args(argv)
+
+    if args.metrics_file or args.timings_log:
+        instrumentation.configure(True, args.timings_log)
+
+    with open(args.urls_file, 'r', encoding='utf-8') as f:
+        targets = parse_targets(f, args.interval)
+
+    monitor = Monitor(concurrency=args.concurrency, per_host=args.per_host, jitter=args.jitter,
+                      log_path=args.log, workers=args.workers, once=args.once,
+                      metrics_file=args.metrics_file)
+    try:
+        results = asyncio.run(monitor.run(targets))
+    except KeyboardInterrupt:
+        return 130
+
+    changed = sum(1 for record in results if record['status'] == 'changed')
+    errors = sum(1 for record in results if record['status'] == 'error')
+    print(f"Checked {len(results)} URLs: {changed} changed, {errors} errors")
+    return 0
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import re
+
+# Attributes that carry per-request tokens inside CSRF form fields / meta tags
+TOKEN_ATTR_RE = re.compile(r'''(\b(?:value|content)\s*=\s*)(["'])[^"']*\2''', re.IGNORECASE)
+
+
+def _blank_token_attrs(match):
+    return TOKEN_ATTR_RE.sub(r'\1\2\2', match.group(0))
+
+
+# (name, pattern, replacement, flags). Replacement may be a string or a callable,
+# exactly as accepted by re.sub.
+DEFAULT_RULES = [
+    ('csrf_token',
+     r'''<(?:input|meta)\b[^>]*(?:csrf|xsrf|authenticity_token|requestverificationtoken)[^>]*>''',
+     _blank_token_attrs, re.IGNORECASE),
+    ('nonce', r'''(\bnonce\s*=\s*)(["'])[^"']*\2''', r'\1\2\2', re.IGNORECASE),
+    ('timestamp',
+     r'\b\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?\b',
+     '<timestamp>', 0),
+    ('cache_buster',
+     r'([?&](?:v|ver|version|_|t|ts|cb|cachebust(?:er)?|rev|build)=)[\w.-]+',
+     r'\1', re.IGNORECASE),
+    ('session_id',
+     r'([;?&](?:jsessionid|phpsessid|sid|sessionid|session_id|aspsessionid\w*)=)[\w.-]+',
+     r'\1', re.IGNORECASE),
+]
+
+
+def compile_rules(rules):
+    """Precompile (name, pattern, replacement, flags) rules"""
+    return [(name, re.compile(pattern, flags), replacement)
+            for name, pattern, replacement, flags in rules]
+
+
+def load_rules(path, include_defaults=True):
+    """Load extra rules from a JSON list of {name, pattern, replacement, ignore_case}"""
+    with open(path, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+
+    rules = list(DEFAULT_RULES) if include_defaults else []
+    for rule in spec:
+        flags = re.IGNORECASE if rule.get('ignore_case') else 0
+        rules.append((rule['name'], rule['pattern'], rule.get('replacement', ''), flags))
+    return compile_rules(rules)
+
+
+def normalize(content, rules):
+    """Mask volatile content so that it does not register as a change"""
+    for _, pattern, replacement in rules:
+        content = pattern.sub(replacement, content)
+    return content
+
+
+# Joins the strings normalized together by normalize_many()
+BATCH_SEPARATOR = '\x00'
+
+
+def normalize_many(texts, rules):
+    """normalize() applied to each of many short strings, in one pass per rule.
+
+    Falls back to one string at a time if a rule matched across the
+    boundary between two strings.
+    """
+    if not rules or not texts:
+        return list(texts)
+    joined = normalize(BATCH_SEPARATOR.join(texts), rules)
+    parts = joined.split(BATCH_SEPARATOR)
+    if len(parts) != len(texts):
+        return [normalize(text, rules) for text in texts]
+    return parts
+
+
+def fingerprint(rules):
+    """Stable digest of a compiled rule set, for keying cached results"""
+    digest = hashlib.sha256()
+    for name, pattern, replacement in rules:
+        if callable(replacement):
+            replacement = f'{replacement.__module__}.{replacement.__qualname__}'
+        digest.update(repr((name, pattern.pattern, pattern.flags, replacement)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+DEFAULT_COMPILED_RULES = compile_rules(DEFAULT_RULES)
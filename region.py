@@ -0,0 +1,167 @@
+import re
+
+from bs4 import BeautifulSoup, SoupStrainer
+from soupsieve import SelectorSyntaxError
+
+from dom import HAVE_LXML, choose_parser
+
+if HAVE_LXML:
+    import lxml.etree
+    import lxml.html
+
+# A single compound selector: tag, #id, .class and [attr] / [attr=value] parts
+# with no combinators. These can be applied while parsing.
+SIMPLE_SELECTOR_RE = re.compile(
+    r'''^(?P<name>[a-zA-Z][\w-]*)?'''
+    r'''(?P<rest>(?:[#.][\w-]+|\[[\w-]+(?:[~|^$*]?=(?:"[^"]*"|'[^']*'|[^\]"']*))?\])*)$''')
+PART_RE = re.compile(r'''#([\w-]+)|\.([\w-]+)|\[([\w-]+)(?:([~|^$*]?=)(?:"([^"]*)"|'([^']*)'|([^\]"']*)))?\]''')
+
+# lxml rejects decoded text that still declares an encoding
+XML_DECLARATION_RE = re.compile(r'^\s*<\?xml[^>]*\?>')
+
+# The watched region is rendered on its own, inside this document
+REGION_DOCUMENT = ('<!DOCTYPE html>\n<html><head><meta charset="utf-8"></head><body>\n'
+                   '{}\n</body></html>')
+
+
+def is_xpath(selector):
+    return selector.lstrip().startswith(('/', '(', './'))
+
+
+def _simple_selector(selector):
+    """(tag name or None, [(attribute, operator, value)]) for a simple selector, or None"""
+    match = SIMPLE_SELECTOR_RE.match(selector.strip())
+    if match is None or not (match.group('name') or match.group('rest')):
+        return None
+    conditions = []
+    for id_, class_, attr, operator, *values in PART_RE.findall(match.group('rest')):
+        if id_:
+            conditions.append(('id', '=', id_))
+        elif class_:
+            conditions.append(('class', '~=', class_))
+        else:
+            conditions.append((attr, operator, ''.join(values) if operator else None))
+    return match.group('name'), conditions
+
+
+def _xpath_literal(value):
+    if "'" not in value:
+        return f"'{value}'"
+    if '"' not in value:
+        return f'"{value}"'
+    return None
+
+
+def _to_xpath(simple):
+    """XPath equivalent of a simple selector, or None if it has no exact one here"""
+    name, conditions = simple
+    predicates = []
+    for attr, operator, value in conditions:
+        if not operator:
+            predicates.append(f'[@{attr}]')
+            continue
+        literal = _xpath_literal(value)
+        if literal is None:
+            return None
+        if operator == '=':
+            predicates.append(f'[@{attr}={literal}]')
+        elif operator == '~=':
+            predicates.append(f"[contains(concat(' ', normalize-space(@{attr}), ' '), "
+                              f"concat(' ', {literal}, ' '))]")
+        else:
+            return None
+    return f"//{name or '*'}{''.join(predicates)}"
+
+
+def _strainer(simple):
+    """SoupStrainer keeping the elements that may match a simple selector.
+
+    It only needs to be permissive: select() on the strained tree has the
+    final say.
+    """
+    name, conditions = simple
+    attrs = {}
+    for attr, operator, value in conditions:
+        if operator == '=':
+            attrs.setdefault(attr, value)
+        elif operator == '~=':
+            attrs.setdefault(attr, re.compile(rf'(?:^|\s){re.escape(value)}(?:\s|$)'))
+        else:
+            attrs.setdefault(attr, True)
+    return SoupStrainer(name, attrs)
+
+
+def _outermost(tags):
+    """Drop matches nested inside other matches"""
+    matched = {id(tag) for tag in tags}
+    return [tag for tag in tags
+            if not any(id(parent) in matched for parent in tag.parents)]
+
+
+def _xpath_region(html, xpath):
+    try:
+        find = lxml.etree.XPath(xpath)
+    except lxml.etree.XPathError as e:
+        raise ValueError(f"Invalid XPath {xpath!r}: {e}") from None
+    html = XML_DECLARATION_RE.sub('', html.lstrip('\N{BYTE ORDER MARK}'), count=1)
+    if not html.strip():
+        return None
+    try:
+        document = lxml.html.document_fromstring(html)
+    except lxml.etree.ParserError:
+        # Nothing but comments or the like: no elements to select
+        return None
+    except (lxml.etree.LxmlError, ValueError) as e:
+        raise ValueError(f"Could not parse the page: {e}") from None
+    try:
+        results = find(document)
+    except lxml.etree.XPathError as e:
+        raise ValueError(f"Invalid XPath {xpath!r}: {e}") from None
+    if not isinstance(results, list):
+        results = [results]
+    # Drop elements nested inside other matches
+    elements = {result for result in results if isinstance(result, lxml.html.HtmlElement)}
+    results = [result for result in results
+               if not (result in elements and any(parent in elements for parent in result.iterancestors()))]
+    parts = [lxml.html.tostring(result, encoding='unicode', with_tail=False)
+             if isinstance(result, lxml.html.HtmlElement) else str(result)
+             for result in results]
+    return '\n'.join(parts) if parts else None
+
+
+def select_region(html, selector, backend='auto'):
+    """Outer HTML of the parts of a page matching a CSS selector or XPath, or None.
+
+    Simple CSS selectors (tag, #id, .class, [attr=value]) never build the
+    whole tree: they run as XPath over lxml's C tree when lxml is installed,
+    and otherwise as a parse-time filter, so only matching subtrees are
+    built. Other CSS selectors need a full parse; XPath needs lxml.
+    Raises ValueError for a selector (or page) that cannot be parsed.
+    """
+    if is_xpath(selector):
+        if not HAVE_LXML:
+            raise ValueError("XPath watch selectors need the lxml package")
+        return _xpath_region(html, selector)
+
+    simple = _simple_selector(selector)
+    if simple is not None and HAVE_LXML:
+        xpath = _to_xpath(simple)
+        if xpath is not None:
+            return _xpath_region(html, xpath)
+    if simple is not None:
+        soup = BeautifulSoup(html, 'html.parser', parse_only=_strainer(simple))
+    else:
+        soup = BeautifulSoup(html, choose_parser(html, backend))
+    try:
+        tags = _outermost(soup.select(selector))
+    except SelectorSyntaxError as e:
+        raise ValueError(f"Invalid CSS selector {selector!r}: {e}") from e
+    except NotImplementedError as e:
+        # Pseudo-elements and the like, which soupsieve cannot match
+        raise ValueError(f"Unsupported CSS selector {selector!r}: {e}") from e
+    return '\n'.join(str(tag) for tag in tags) if tags else None
+
+
+def region_document(html, selector, backend='auto'):
+    """A standalone document holding just the watched region (empty if nothing matches)"""
+    return REGION_DOCUMENT.format(select_region(html, selector, backend) or '')
@@ -0,0 +1,161 @@
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+from snapshot_store import compress, decompress
+
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = 64
+MAX_BYTES = 256 * 1024 * 1024
+MAX_DISK_BYTES = 1024 * 1024 * 1024
+
+
+def result_key(old_hash, new_hash, *options):
+    """Cache key for comparing two contents under the given options"""
+    parts = [old_hash, new_hash] + [str(option) for option in options]
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+def approx_size(value):
+    """Rough memory footprint of a cached result, dominated by its strings"""
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(approx_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(approx_size(v) for v in value)
+    if hasattr(value, 'approx_size'):
+        return value.approx_size()
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """Comparison results shared by every session, keyed by result_key().
+
+    The memory tier is an LRU bounded both by entry count and by total
+    size. With disk_dir set, results are also pickled there so they survive
+    eviction and restarts; the disk tier is trimmed oldest-first.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, disk_dir=None,
+                 max_disk_bytes=MAX_DISK_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()   # key -> (result, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def _disk_path(self, key):
+        return self.disk_dir / f"{key}.pkl"
+
+    def get(self, key):
+        """Cached result for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        result = self._read_disk(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._insert(key, result)
+        return result
+
+    def put(self, key, result):
+        with self._lock:
+            self._insert(key, result)
+        self._write_disk(key, result)
+
+    def resize(self, key):
+        """Re-measure an entry whose result has grown (e.g. a view was filled in)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            size = approx_size(entry[0])
+            self._bytes += size - entry[1]
+            self._entries[key] = (entry[0], size)
+            self._evict()
+
+    def _insert(self, key, result):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        size = approx_size(result)
+        self._entries[key] = (result, size)
+        self._bytes += size
+        self._evict()
+
+    def _evict(self):
+        # The newest entry always stays, even if it alone exceeds max_bytes
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries
+                                          or self._bytes > self.max_bytes):
+            _, (_, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            codec, data = path.read_bytes().split(b'\n', 1)
+            result = pickle.loads(decompress(codec.decode('ascii'), data))
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning("Discarding unreadable cached result %s", path, exc_info=True)
+            path.unlink(missing_ok=True)
+            return None
+        os.utime(path)
+        return result
+
+    def _write_disk(self, key, result):
+        if not self.disk_dir:
+            return
+        codec, data = compress(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+        path = self._disk_path(key)
+        # Unique across processes sharing the directory
+        temp = path.with_suffix(f'.{uuid.uuid4().hex}.tmp')
+        temp.write_bytes(codec.encode('ascii') + b'\n' + data)
+        os.replace(temp, path)
+        self._trim_disk()
+
+    def _trim_disk(self):
+        files = []
+        for f in self.disk_dir.glob('*.pkl'):
+            try:
+                stat = f.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, f))
+        total = sum(size for _, size, _ in files)
+        for _, size, f in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            f.unlink(missing_ok=True)
+            total -= size
@@ -0,0 +1,108 @@
+import argparse
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import sapp
+from snapshot_store import GC_GRACE_SECONDS
+
+DEFAULT_KEEP_LAST = 20
+DEFAULT_DAILY_AFTER = 7
+DEFAULT_WEEKLY_AFTER = 30
+
+# Every version from the last keep_last saves or younger than daily_after
+# days is kept. Older ones are thinned to the newest of each day, and those
+# older than weekly_after days to the newest of each ISO week.
+RetentionPolicy = namedtuple('RetentionPolicy', 'keep_last daily_after weekly_after')
+DEFAULT_POLICY = RetentionPolicy(DEFAULT_KEEP_LAST, DEFAULT_DAILY_AFTER, DEFAULT_WEEKLY_AFTER)
+
+
+def expired_versions(versions, policy=DEFAULT_POLICY, now=None):
+    """Version numbers a policy drops, from catalog metadata in any order"""
+    now = now or datetime.now()
+    ordered = sorted(versions, key=lambda metadata: metadata['version'], reverse=True)
+    kept_buckets = set()
+    expired = []
+    for index, metadata in enumerate(ordered):
+        saved = datetime.strptime(metadata['timestamp'], "%Y%m%d_%H%M%S")
+        age = now - saved
+        if index < policy.keep_last or age < timedelta(days=policy.daily_after):
+            continue
+        if age < timedelta(days=policy.weekly_after):
+            bucket = ('day', saved.date())
+        else:
+            bucket = ('week',) + tuple(saved.isocalendar()[:2])
+        # Newest first, so the first version seen in a bucket is the one kept
+        if bucket in kept_buckets:
+            expired.append(metadata['version'])
+        else:
+            kept_buckets.add(bucket)
+    return expired
+
+
+def compact_store(store, policy=DEFAULT_POLICY, dry_run=False, urls=None, progress=None):
+    """Apply a retention policy, then pack every URL's objects and drop unused ones.
+
+    policy None skips retention. Legacy URLs whose address was never seen
+    again cannot be looked up by URL, so they are left as they are. Returns
+    a dict of counts.
+    """
+    summary = {'urls': 0, 'expired': 0, 'migrated': 0, 'packed': 0, 'objects_freed': 0, 'bytes_freed': 0}
+    targets = [url for _, url in store.catalog.urls() if url]
+    if urls:
+        targets = [url for url in targets if url in urls]
+
+    for url in targets:
+        summary['urls'] += 1
+        if policy is not None:
+            expired = expired_versions(store.catalog.versions(url), policy)
+            if not dry_run:
+                expired = store.catalog.delete_versions(url, expired)
+            summary['expired'] += len(expired)
+            if progress and expired:
+                progress(f"{url}: {'would drop' if dry_run else 'dropped'} {len(expired)} versions")
+    if dry_run:
+        return summary
+
+    # Unreferenced objects go first so they are not copied into the packs
+    freed, freed_bytes = store.collect_garbage()
+    summary['objects_freed'] += freed
+    summary['bytes_freed'] += freed_bytes
+    for url in targets:
+        summary['migrated'] += store.migrate_legacy(url)
+        packed = store.compact(url)
+        summary['packed'] += packed
+        if progress:
+            progress(f"{url}: packed {packed} objects")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m sapp compact",
+                                     description="Thin old snapshots and pack the snapshot store")
+    parser.add_argument("urls", nargs="*",
+                        help="only these URLs (default: every URL in the catalog)")
+    parser.add_argument("--keep-last", type=int, default=DEFAULT_KEEP_LAST,
+                        help="newest versions of each URL always kept (default: %(default)s)")
+    parser.add_argument("--daily-after", type=float, default=DEFAULT_DAILY_AFTER,
+                        help="days after which only the newest version of each day is kept (default: %(default)s)")
+    parser.add_argument("--weekly-after", type=float, default=DEFAULT_WEEKLY_AFTER,
+                        help="days after which only the newest version of each week is kept (default: %(default)s)")
+    parser.add_argument("--no-retention", action="store_true",
+                        help="keep every version; only pack and collect garbage")
+    parser.add_argument("--grace", type=float, default=GC_GRACE_SECONDS, metavar="SECONDS",
+                        help="unused files younger than this are kept, as another process may be "
+                             "storing them (default: %(default)s; 0 when nothing else uses the store)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="report the versions retention would drop, and change nothing")
+    args = parser.parse_args(argv)
+
+    sapp.store.gc_grace_seconds = args.grace
+    policy = None if args.no_retention else RetentionPolicy(args.keep_last, args.daily_after, args.weekly_after)
+    summary = compact_store(sapp.store, policy, dry_run=args.dry_run, urls=set(args.urls), progress=print)
+    if args.dry_run:
+        print(f"Would drop {summary['expired']} versions of {summary['urls']} URLs")
+        return 0
+    print(f"Dropped {summary['expired']} versions of {summary['urls']} URLs, "
+          f"migrated {summary['migrated']} legacy snapshots, packed {summary['packed']} objects, "
+          f"freed {summary['objects_freed']} objects ({summary['bytes_freed'] / 1e6:.1f} MB)")
+    return 0
@@ -1,189 +1,265 @@
 import streamlit as st
 import requests
-from bs4 import BeautifulSoup
-import difflib
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from bs4 import Tag
 from datetime import datetime
-import hashlib
 from pathlib import Path
 import re
-from PIL import Image, ImageDraw, ImageFont
 import io
-import base64
+import logging
+import sys
+import threading
+import time
+from streamlit import logger as streamlit_logger
+from snapshot_store import SnapshotStore, content_hash
+import noise_filter
+import dom
+from dom import HAVE_LXML, ParsedPage, as_parsed_page
+import similarity
+import line_diff
+import tree_diff
+import region
+import instrumentation
+import jobs
+from result_cache import ResultCache, result_key
+import screenshot_diff
+import http_body
+import side_by_side
+import text_index
 
-# Initialize session state
-if 'saved_pages' not in st.session_state:
-    st.session_state.saved_pages = {}
-if 'comparison_result' not in st.session_state:
-    st.session_state.comparison_result = None
+# `python -m sapp <command>` hands over to cli before anything below is set
+# up. The commands import sapp, which would otherwise run a second time next
+# to __main__, with a catalog, session and settings of its own.
+if __name__ == "__main__" and len(sys.argv) > 1:
+    import cli
+    sys.exit(cli.main(sys.argv[1:]))
+
+logger = logging.getLogger(__name__)
+
+# Imported outside `streamlit run` (CLI, worker processes): silence bare-mode warnings
+if not st.runtime.exists():
+    streamlit_logger.set_log_level('error')
 
 # Create directory for saved pages
 SAVE_DIR = Path("saved_pages")
 SAVE_DIR.mkdir(exist_ok=True)
 
-def fetch_page(url):
-    """Fetch webpage content"""
+# Number of versions listed in the sidebar
+MAX_LISTED_VERSIONS = 20
+
+# Volatile content (CSRF tokens, nonces, timestamps, ...) masked before comparing.
+# Extra rules can be added in noise_rules.json next to the app.
+NOISE_RULES_FILE = Path("noise_rules.json")
+if NOISE_RULES_FILE.exists():
+    NOISE_RULES = noise_filter.load_rules(NOISE_RULES_FILE)
+else:
+    NOISE_RULES = noise_filter.DEFAULT_COMPILED_RULES
+
+# HTML parser backend: 'auto' uses lxml (when installed) for large pages
+PARSER_BACKEND = 'auto'
+
+# Similarity engine for the change percentages: 'auto' is exact for small
+# pages and a bounded-time estimate for large ones (see similarity.py)
+SIMILARITY_ENGINE = 'auto'
+
+# The Change Summary comes before any view is built. Its code metric gets at
+# most SUMMARY_TIME_BUDGET seconds. Pages up to SUMMARY_TEXT_SIZE characters
+# (both together) have their text extracted for the text metric right away;
+# larger ones start from an estimate on the markup with the tags cut out,
+# measured properly once a view extracts the text.
+SUMMARY_TIME_BUDGET = 0.25
+SUMMARY_TEXT_SIZE = 500_000
+
+# Code diff: 'patience' streams lines as they are found, 'difflib' diffs
+# everything up front. The UI shows the diff a page at a time and spends at
+# most DIFF_TIME_LIMIT_MS computing each page.
+DIFF_ALGORITHM = 'patience'
+DIFF_PAGE_LINES = 500
+DIFF_TIME_LIMIT_MS = 2000
+
+# Part of every result cache key; bumped when what a cached comparison holds
+# changes, so that results pickled to disk by older code are not reused
+RESULT_FORMAT = 2
+
+# Text Changes view: unchanged lines beyond TEXT_CONTEXT_LINES around each
+# change are collapsed, and TEXT_HUNKS_PER_PAGE changes are shown at a time.
+TEXT_CONTEXT_LINES = 3
+TEXT_CONTEXT_CHOICES = (0, 1, 3, 10, 50)
+TEXT_HUNKS_PER_PAGE = 50
+
+@st.cache_resource
+def get_store():
+    """Shared snapshot store, opened once per server process"""
+    return SnapshotStore(SAVE_DIR)
+
+store = get_store()
+catalog = store.catalog
+
+# Comparison results are shared by all sessions, keyed by the content hashes
+# of both versions. Set RESULT_CACHE_DIR (e.g. SAVE_DIR / "result_cache") to
+# also keep them on disk.
+RESULT_CACHE_ENTRIES = 32
+RESULT_CACHE_BYTES = 256 * 1024 * 1024
+RESULT_CACHE_DIR = None
+
+@st.cache_resource
+def get_result_cache():
+    """Shared comparison result cache"""
+    return ResultCache(RESULT_CACHE_ENTRIES, RESULT_CACHE_BYTES, RESULT_CACHE_DIR)
+
+result_cache = get_result_cache()
+
+# Checks run as jobs on a process pool, so a long comparison neither blocks
+# the session nor holds the server's GIL. Identical checks in flight share a job.
+JOB_WORKERS = 2
+JOB_TIMEOUT = 120
+
+@st.cache_resource
+def get_job_queue():
+    """Shared background job queue"""
+    return jobs.JobQueue(JOB_WORKERS)
+
+# Per-stage timings (fetch, save, parse, extract, diff, similarity,
+# highlight, render). With INSTRUMENTATION off the hooks do nothing.
+# TIMINGS_LOG appends one JSON line per timed stage; METRICS_FILE is
+# rewritten with Prometheus histograms after every check.
+INSTRUMENTATION = True
+TIMINGS_LOG = None
+METRICS_FILE = None
+
+instrumentation.configure(INSTRUMENTATION, TIMINGS_LOG)
+
+# Optional screenshot source for the pixel diff: a callable taking a URL and
+# returning an image, an image path, or an iterable of consecutive strips
+# (e.g. from a headless browser). Without it, both screenshots are uploaded.
+SCREENSHOT_CAPTURE = None
+
+# Connection pool sizing for the shared HTTP session
+POOL_HOSTS = 32
+POOL_SIZE = 16
+
+# Response bodies are streamed. Bodies over MAX_BODY_BYTES (after
+# decompression) are refused, or with TRUNCATE_LARGE_PAGES cut off there.
+MAX_BODY_BYTES = 20 * 1024 * 1024
+TRUNCATE_LARGE_PAGES = False
+
+@st.cache_resource
+def get_http_session():
+    """Shared HTTP session with pooled keep-alive connections"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+        # Only advertise encodings urllib3 can decode here (gzip, deflate, br/zstd if installed)
+        'Accept-Encoding': make_headers(accept_encoding=True)['accept-encoding']
+    })
+    return session
+
+def fetch_page(url, validators=None, raise_errors=False, save=False):
+    """Fetch webpage content.
+    
+    Returns a dict with 'status', 'content', 'content_hash', 'unchanged',
+    'truncated' and the response's 'etag' and 'last_modified' validators,
+    or None on error (errors are raised instead when raise_errors is set).
+    When validators from a saved snapshot are given the request is
+    conditional. A 304 response, or a body that hashes the same as the
+    snapshot, comes back unchanged with no content; the body is then never
+    decoded. With save set, a changed page goes straight into the snapshot
+    store and its metadata is returned under 'saved'.
+    """
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        headers = {}
+        if validators:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+        saved_hash = validators.get('content_hash') if validators else None
+        with instrumentation.span('fetch') as timing:
+            with get_http_session().get(url, headers=headers, timeout=10, stream=True) as response:
+                if not response.ok:
+                    http_body.drain(response)
+                response.raise_for_status()
+                body = None
+                if response.status_code != 304:
+                    body = http_body.read_body(response, MAX_BODY_BYTES, TRUNCATE_LARGE_PAGES,
+                                               known_hash=saved_hash)
+                    timing.nbytes = body.nbytes
+        fetched = {
+            'status': response.status_code,
+            'content': body.text if body else None,
+            'content_hash': body.content_hash if body else saved_hash,
+            'unchanged': body is None or body.text is None,
+            'truncated': bool(body and body.truncated),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified')
         }
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        return response.text
+        if save and not fetched['unchanged']:
+            # The hash and UTF-8 bytes from the stream are reused, not recomputed
+            fetched['saved'] = save_page(url, body.text, validators=fetched,
+                                         digest=body.content_hash, raw=body.raw)
+        return fetched
     except Exception as e:
+        if raise_errors:
+            raise
         st.error(f"Error fetching page: {str(e)}")
         return None
 
-def save_page(url, content):
-    """Save page content to disk"""
-    url_hash = hashlib.md5(url.encode()).hexdigest()
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    
-    filename = f"{url_hash}_{timestamp}.html"
-    filepath = SAVE_DIR / filename
+def save_page(url, content, validators=None, digest=None, raw=None):
+    """Save page content to the snapshot store.
     
-    with open(filepath, 'w', encoding='utf-8') as f:
-        f.write(content)
-    
-    # Save metadata
-    metadata = {
-        'url': url,
-        'timestamp': timestamp,
-        'filepath': str(filepath),
-        'display_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
-    
-    if url not in st.session_state.saved_pages:
-        st.session_state.saved_pages[url] = []
-    st.session_state.saved_pages[url].append(metadata)
+    digest and raw (the content's hash and UTF-8 bytes) may be passed when
+    they are already known, e.g. from fetch_page().
+    """
+    now = datetime.now()
+    timestamp = now.strftime("%Y%m%d_%H%M%S")
     
-    return filepath
+    # Identical content is stored once; changed content is kept as a delta
+    with instrumentation.span('save', len(content)):
+        return store.save(url, content, timestamp, now.strftime("%Y-%m-%d %H:%M:%S"),
+                          validators=validators, digest=digest, raw=raw)
 
-def get_text_diff(old_content, new_content):
-    """Generate line-by-line diff"""
+def get_text_diff(old_content, new_content, max_lines=DIFF_PAGE_LINES, max_ms=None, algorithm=None):
+    """Generate line-by-line diff, stopping after max_lines lines or max_ms milliseconds"""
     old_lines = old_content.splitlines()
     new_lines = new_content.splitlines()
     
-    diff = difflib.unified_diff(old_lines, new_lines, lineterm='', n=3)
-    diff_list = list(diff)
+    # Lines are produced one at a time, so hitting a limit stops the diff itself
+    diff = line_diff.iter_unified_diff(old_lines, new_lines, n=3, algorithm=algorithm or DIFF_ALGORITHM)
+    diff_list, stopped = line_diff.limited(diff, max_lines + 1, max_ms)
     
-    # Limit to first 500 lines to avoid overwhelming display
-    if len(diff_list) > 500:
-        diff_list = diff_list[:500] + ['... (truncated, showing first 500 lines)']
+    # Limit to the first lines to avoid overwhelming display
+    if stopped == 'time':
+        diff_list.append(f'... (stopped after {max_ms} ms, showing first {len(diff_list)} lines)')
+    elif len(diff_list) > max_lines:
+        diff_list = diff_list[:max_lines] + [f'... (truncated, showing first {max_lines} lines)']
     
     return '\n'.join(diff_list)
 
-def extract_text_content(html):
-    """Extract visible text content from HTML"""
-    soup = BeautifulSoup(html, 'html.parser')
-    
-    # Remove script and style elements
-    for script in soup(["script", "style", "meta", "link"]):
-        script.decompose()
-    
-    # Get text
-    text = soup.get_text()
-    
-    # Clean up whitespace
-    lines = [line.strip() for line in text.splitlines() if line.strip()]
+def extract_text_content(html, backend='html.parser', block_breaks=False):
+    """Extract visible text content from HTML (or an already parsed page).
     
-    return '\n'.join(lines)
+    With block_breaks, block-level elements (p, div, li, td...) also start
+    and end a line, even where the source has no newline.
+    """
+    # Script, style, meta and link contents are skipped while parsing (dom.TEXT_ENGINE)
+    if block_breaks:
+        page = as_parsed_page(html, backend)
+        text = dom.stream_text(page.html, page.parser, block_breaks=True)
+        if text is not None:
+            return dom.clean_text_lines(text)
+    return as_parsed_page(html, backend).text
 
-def create_text_comparison_html(old_text, new_text):
-    """Create HTML showing text differences with highlighting"""
-    old_lines = old_text.splitlines()
-    new_lines = new_text.splitlines()
-    
-    matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
+def create_text_comparison_html(old_text, new_text, context=None, page=0):
+    """Create HTML showing one page of text differences, side by side.
     
-    html_parts = ["""
-    <style>
-        .comparison-container {
-            display: flex;
-            gap: 20px;
-            font-family: monospace;
-            font-size: 12px;
-        }
-        .version-panel {
-            flex: 1;
-            border: 1px solid #ddd;
-            padding: 15px;
-            background: white;
-            overflow-y: auto;
-            max-height: 600px;
-        }
-        .version-title {
-            font-weight: bold;
-            font-size: 16px;
-            margin-bottom: 10px;
-            padding-bottom: 5px;
-            border-bottom: 2px solid #333;
-        }
-        .line {
-            padding: 2px 5px;
-            margin: 1px 0;
-            white-space: pre-wrap;
-            word-wrap: break-word;
-        }
-        .unchanged {
-            background: white;
-        }
-        .changed {
-            background: #ffcccc;
-            border-left: 3px solid red;
-            font-weight: bold;
-        }
-        .added {
-            background: #ccffcc;
-            border-left: 3px solid green;
-        }
-        .removed {
-            background: #ffcccc;
-            border-left: 3px solid red;
-            text-decoration: line-through;
-        }
-    </style>
-    <div class="comparison-container">
-        <div class="version-panel">
-            <div class="version-title">📁 Saved Version</div>
-    """]
-    
-    old_output = []
-    new_output = []
-    
-    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
-        old_segment = old_lines[i1:i2]
-        new_segment = new_lines[j1:j2]
-        
-        if tag == 'equal':
-            for line in old_segment:
-                old_output.append(f'<div class="line unchanged">{html_escape(line)}</div>')
-            for line in new_segment:
-                new_output.append(f'<div class="line unchanged">{html_escape(line)}</div>')
-        elif tag == 'replace':
-            for line in old_segment:
-                old_output.append(f'<div class="line changed">{html_escape(line)}</div>')
-            for line in new_segment:
-                new_output.append(f'<div class="line changed">{html_escape(line)}</div>')
-        elif tag == 'delete':
-            for line in old_segment:
-                old_output.append(f'<div class="line removed">{html_escape(line)}</div>')
-        elif tag == 'insert':
-            for line in new_segment:
-                new_output.append(f'<div class="line added">{html_escape(line)}</div>')
-    
-    html_parts.append(''.join(old_output))
-    html_parts.append("""
-        </div>
-        <div class="version-panel">
-            <div class="version-title">🆕 Current Version</div>
-    """)
-    html_parts.append(''.join(new_output))
-    html_parts.append("""
-        </div>
-    </div>
-    """)
-    
-    return ''.join(html_parts)
+    Unchanged lines beyond context lines around each change are collapsed.
+    """
+    view = side_by_side.SideBySide(old_text, new_text, DIFF_ALGORITHM)
+    return view.render(page, TEXT_CONTEXT_LINES if context is None else context, TEXT_HUNKS_PER_PAGE)
 
 def html_escape(text):
     """Escape HTML special characters"""
@@ -194,274 +270,530 @@ def html_escape(text):
             .replace('"', '&quot;')
             .replace("'", '&#39;'))
 
+RENDER_NOTICE_HTML = (
+    '<div style="background:#ffffcc;padding:10px;border:2px solid #ff9900;margin:10px;">'
+    '⚠️ Note: This is a rendered version. Some interactive features may not work. '
+    'Images and styles are loaded from the original site.</div>'
+)
+
 def create_iframe_with_base(html_content, base_url):
     """Create an iframe with proper base URL set"""
-    soup = BeautifulSoup(html_content, 'html.parser')
+    editor = as_parsed_page(html_content).editor()
+    soup = editor.soup
     
     # Add or update base tag
     base_tag = soup.find('base')
     if base_tag:
-        base_tag['href'] = base_url
+        editor.set_attr(base_tag, 'href', base_url)
     else:
         if soup.head:
-            base_tag = soup.new_tag('base', href=base_url)
-            soup.head.insert(0, base_tag)
+            editor.prepend(soup.head, f'<base href="{html_escape(base_url)}">')
     
     # Add sandbox attribute notice
-    notice = soup.new_tag('div', style='background:#ffffcc;padding:10px;border:2px solid #ff9900;margin:10px;')
-    notice.string = '⚠️ Note: This is a rendered version. Some interactive features may not work. Images and styles are loaded from the original site.'
-    
     if soup.body:
-        soup.body.insert(0, notice)
-    
-    return str(soup)
-
-def highlight_visual_changes(old_html, new_html, base_url, old_text_lines, new_text_lines):
-    """Create side-by-side comparison with visual highlighting using text diff results"""
-    # Create highlighted versions
-    old_soup_highlighted = BeautifulSoup(old_html, 'html.parser')
-    new_soup_highlighted = BeautifulSoup(new_html, 'html.parser')
-    
-    # Use the text comparison results to find what changed
-    matcher = difflib.SequenceMatcher(None, old_text_lines, new_text_lines)
-    
-    removed_texts = set()
-    added_texts = set()
-    
-    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
-        if tag == 'replace':
-            # Text was changed
-            for line in old_text_lines[i1:i2]:
-                if line.strip() and len(line.strip()) > 3:
-                    removed_texts.add(line.strip())
-            for line in new_text_lines[j1:j2]:
-                if line.strip() and len(line.strip()) > 3:
-                    added_texts.add(line.strip())
-        elif tag == 'delete':
-            # Text was removed
-            for line in old_text_lines[i1:i2]:
-                if line.strip() and len(line.strip()) > 3:
-                    removed_texts.add(line.strip())
-        elif tag == 'insert':
-            # Text was added
-            for line in new_text_lines[j1:j2]:
-                if line.strip() and len(line.strip()) > 3:
-                    added_texts.add(line.strip())
-    
-    print(f"DEBUG: Removed texts ({len(removed_texts)}): {removed_texts}")
-    print(f"DEBUG: Added texts ({len(added_texts)}): {added_texts}")
+        editor.prepend(soup.body, RENDER_NOTICE_HTML)
+    
+    return editor.render()
+
+# Text inside these elements is never highlighted
+UNHIGHLIGHTABLE_TAGS = frozenset(['script', 'style', 'meta', 'link', 'noscript'])
+
+def highlight_target(node):
+    """Element to outline for a changed node, or None if it is not visible"""
+    tag = node if isinstance(node, Tag) else node.parent
+    if tag is None or tag.name in UNHIGHLIGHTABLE_TAGS or tag.name in ('[document]', 'html', 'head'):
+        return None
+    if tag.find_parent('head') is not None:
+        return None
+    return tag
+
+def highlight_visual_changes(old_html, new_html, base_url, noise_rules=None):
+    """Create side-by-side comparison with visual highlighting from a structural diff"""
+    # Highlights are recorded as edits on top of the shared parse
+    old_editor = as_parsed_page(old_html).editor()
+    new_editor = as_parsed_page(new_html).editor()
+    
+    # Element-level changes; unchanged subtrees are skipped by their hashes
+    changes = tree_diff.diff_trees(old_editor.soup, new_editor.soup, noise_rules)
+    
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        counts = {}
+        for change in changes:
+            counts[change.kind] = counts.get(change.kind, 0) + 1
+        logger.debug("Structural changes: %s", counts)
     
     # Add highlighting styles
-    highlight_style_old = old_soup_highlighted.new_tag('style')
-    highlight_style_old.string = """
+    highlight_style_old = """<style>
         .change-highlight-removed {
             background-color: rgba(255, 0, 0, 0.25) !important;
             outline: 3px solid #ff0000 !important;
             outline-offset: 2px;
             box-shadow: 0 0 5px rgba(255, 0, 0, 0.5) !important;
         }
-    """
+    </style>"""
     
-    highlight_style_new = new_soup_highlighted.new_tag('style')
-    highlight_style_new.string = """
+    highlight_style_new = """<style>
         .change-highlight-added {
             background-color: rgba(0, 255, 0, 0.25) !important;
             outline: 3px solid #00ff00 !important;
             outline-offset: 2px;
             box-shadow: 0 0 5px rgba(0, 255, 0, 0.5) !important;
         }
-    """
+    </style>"""
     
-    if old_soup_highlighted.head:
-        old_soup_highlighted.head.append(highlight_style_old)
-    if new_soup_highlighted.head:
-        new_soup_highlighted.head.append(highlight_style_new)
-    
-    # Function to find and highlight elements containing the text
-    def highlight_elements(soup, texts_to_find, css_class, label):
-        count = 0
-        for text_target in texts_to_find:
-            found = False
-            # Search through all text elements
-            for elem in soup.find_all(text=True):
-                if elem.parent.name in ['script', 'style', 'meta', 'link', 'noscript']:
-                    continue
-                
-                elem_text = elem.strip()
-                
-                # Try exact match first
-                if elem_text == text_target:
-                    parent = elem.parent
-                    # Check if already highlighted
-                    current_classes = parent.get('class', [])
-                    if css_class in current_classes:
-                        continue
-                    
-                    # Highlight the parent element
-                    if current_classes:
-                        parent['class'] = current_classes + [css_class]
-                    else:
-                        parent['class'] = [css_class]
-                    count += 1
-                    found = True
-                    print(f"DEBUG {label}: Highlighted '{text_target[:50]}...' in <{parent.name}>")
-                    break
-                
-                # Also try if the target is contained in this element's text
-                elif text_target in elem_text and len(text_target) > 10:
-                    parent = elem.parent
-                    current_classes = parent.get('class', [])
-                    if css_class in current_classes:
-                        continue
-                    
-                    if current_classes:
-                        parent['class'] = current_classes + [css_class]
-                    else:
-                        parent['class'] = [css_class]
-                    count += 1
-                    found = True
-                    print(f"DEBUG {label}: Highlighted (partial) '{text_target[:50]}...' in <{parent.name}>")
-                    break
-            
-            if not found:
-                print(f"DEBUG {label}: Could not find element with text '{text_target[:50]}...'")
-        
-        return count
+    highlight_style_both = """<style>
+        .change-highlight-modified {
+            outline: 3px solid #ff9900 !important;
+            outline-offset: 2px;
+        }
+        .change-highlight-moved {
+            outline: 3px dashed #3366ff !important;
+            outline-offset: 2px;
+        }
+    </style>"""
+    
+    if old_editor.soup.head:
+        old_editor.append(old_editor.soup.head, highlight_style_old + highlight_style_both)
+    if new_editor.soup.head:
+        new_editor.append(new_editor.soup.head, highlight_style_new + highlight_style_both)
     
-    # Apply highlights
-    removed_count = highlight_elements(old_soup_highlighted, removed_texts, 'change-highlight-removed', 'OLD')
-    added_count = highlight_elements(new_soup_highlighted, added_texts, 'change-highlight-added', 'NEW')
+    def highlight(editor, node, css_class):
+        tag = highlight_target(node)
+        if tag is None:
+            return False
+        current_classes = editor.get_attr(tag, 'class', [])
+        if css_class in current_classes:
+            return False
+        editor.set_attr(tag, 'class', current_classes + [css_class])
+        return True
+    
+    # Changed text marks its element as removed on the old side and added on the new
+    side_classes = {
+        'removed': ('change-highlight-removed', None),
+        'inserted': (None, 'change-highlight-added'),
+        'text': ('change-highlight-removed', 'change-highlight-added'),
+        'attributes': ('change-highlight-modified', 'change-highlight-modified'),
+        'moved': ('change-highlight-moved', 'change-highlight-moved'),
+    }
+    removed_count = added_count = 0
+    for change in changes:
+        old_class, new_class = side_classes[change.kind]
+        if old_class and highlight(old_editor, change.old, old_class):
+            removed_count += 1
+        if new_class and highlight(new_editor, change.new, new_class):
+            added_count += 1
     
-    print(f"DEBUG: Total highlighted - {removed_count} removed, {added_count} added")
+    if debug:
+        logger.debug("Total highlighted - %d old, %d new", removed_count, added_count)
     
     # Fix URLs
-    for soup in [old_soup_highlighted, new_soup_highlighted]:
-        for img in soup.find_all('img'):
+    for editor in [old_editor, new_editor]:
+        for img in editor.soup.find_all('img'):
             if img.get('src'):
-                img['src'] = requests.compat.urljoin(base_url, img['src'])
-        for link in soup.find_all('link'):
+                editor.set_attr(img, 'src', requests.compat.urljoin(base_url, img['src']))
+        for link in editor.soup.find_all('link'):
             if link.get('href'):
-                link['href'] = requests.compat.urljoin(base_url, link['href'])
-        for script in soup.find_all('script'):
+                editor.set_attr(link, 'href', requests.compat.urljoin(base_url, link['href']))
+        for script in editor.soup.find_all('script'):
             if script.get('src'):
-                script['src'] = requests.compat.urljoin(base_url, script['src'])
+                editor.set_attr(script, 'src', requests.compat.urljoin(base_url, script['src']))
     
-    return str(old_soup_highlighted), str(new_soup_highlighted)
+    return old_editor.render(), new_editor.render()
+
+def unchanged_result():
+    """Comparison result for two versions that only differ in masked noise"""
+    return {
+        'unchanged': True,
+        'code_diff': '',
+        'code_diff_pager': None,
+        'change_percentage': 0.0,
+        'visual_change_percentage': 0.0,
+        'change_percentage_exact': True,
+        'visual_change_percentage_exact': True
+    }
 
-def compare_pages(old_content, new_content, url):
-    """Compare two page versions"""
-    # Code-level comparison (limited to avoid overwhelming output)
-    code_diff = get_text_diff(old_content, new_content)
+_MISSING = object()
+
+class ComparisonResult:
+    """Comparison of two page versions whose views are built on first use.
+    
+    The headline metrics are computed up front within a bounded time; on
+    large pages the text change starts as an estimate and is measured once
+    the texts are extracted. Each view (code diff, clean iframes,
+    highlighted pages, text comparison) is built the first time it is read
+    and then kept. Reads work like the dict compare_pages() used to return,
+    and are safe from several sessions at once.
+    """
+    
+    # View key -> method that builds it (and its sibling views)
+    VIEWS = {
+        'code_diff': '_build_code_diff',
+        'code_diff_pager': '_build_code_diff',
+        'old_iframe': '_build_renderings',
+        'new_iframe': '_build_renderings',
+        'old_highlighted': '_build_renderings',
+        'new_highlighted': '_build_renderings',
+        'text_comparison': '_build_text_comparison',
+        'text_comparison_html': '_build_text_comparison',
+        'old_text': '_build_texts',
+        'new_text': '_build_texts',
+    }
+    
+    def __init__(self, old_content, new_content, url, old_normalized, new_normalized,
+                 noise_rules, parser_backend, similarity_engine):
+        self.url = url
+        self.parser_backend = parser_backend
+        self.noise_rules = noise_rules
+        self.similarity_engine = similarity_engine
+        self._contents = (old_content, new_content)
+        self._normalized = (old_normalized, new_normalized)
+        self._normalized_texts = None
+        self._lock = threading.RLock()
+        self._values = {'unchanged': False}
+        
+        # Calculate similarity
+        with instrumentation.span('similarity', len(old_normalized) + len(new_normalized)):
+            code_similarity = similarity.similarity(old_normalized, new_normalized, similarity_engine,
+                                                    time_budget=SUMMARY_TIME_BUDGET)
+        self._values.update({
+            'change_percentage': (1 - code_similarity['ratio']) * 100,
+            'change_percentage_exact': code_similarity['exact'],
+        })
+        
+        if len(old_normalized) + len(new_normalized) <= SUMMARY_TEXT_SIZE:
+            self._build_texts()
+            return
+        
+        # Too large to wait for a parse: estimate from the markup
+        old_rough, new_rough = dom.rough_text(old_normalized), dom.rough_text(new_normalized)
+        with instrumentation.span('similarity', len(old_rough) + len(new_rough)):
+            text_similarity = similarity.similarity(old_rough, new_rough, similarity_engine,
+                                                    time_budget=SUMMARY_TIME_BUDGET)
+        self._values.update({
+            'visual_change_percentage': (1 - text_similarity['ratio']) * 100,
+            'visual_change_percentage_exact': False,
+        })
     
-    # Calculate similarity
-    similarity = difflib.SequenceMatcher(None, old_content, new_content).ratio()
-    change_percentage = (1 - similarity) * 100
+    def __getitem__(self, key):
+        value = self._values.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if key not in self.VIEWS:
+            raise KeyError(key)
+        with self._lock:
+            if key not in self._values:
+                getattr(self, self.VIEWS[key])()
+            return self._values[key]
     
-    # Extract and compare text content
-    old_text = extract_text_content(old_content)
-    new_text = extract_text_content(new_content)
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
     
-    old_text_lines = old_text.splitlines()
-    new_text_lines = new_text.splitlines()
+    def is_built(self, key):
+        """Whether a view has been built already"""
+        return key in self._values
     
-    text_similarity = difflib.SequenceMatcher(None, old_text, new_text).ratio()
-    visual_change_percentage = (1 - text_similarity) * 100
+    def refine(self):
+        """Measure the text change on the extracted texts, if it was only estimated"""
+        self['old_text']
     
-    # Create text comparison HTML
-    text_comparison_html = create_text_comparison_html(old_text, new_text)
+    def _parse(self):
+        # Parsed trees are far larger than the HTML, so they are not kept
+        # between builds
+        old_content, new_content = self._contents
+        return ParsedPage(old_content, self.parser_backend), ParsedPage(new_content, self.parser_backend)
     
-    # Create iframes with base URL (no highlighting)
-    old_iframe = create_iframe_with_base(old_content, url)
-    new_iframe = create_iframe_with_base(new_content, url)
+    def _build_code_diff(self):
+        # Lines are matched with noise masked but shown as they are. Only the
+        # first page is computed now, the rest on demand.
+        old_content, new_content = self._contents
+        old_normalized, new_normalized = self._normalized
+        with instrumentation.span('diff', len(old_content) + len(new_content)):
+            pager = line_diff.DiffPager(old_content.splitlines(), new_content.splitlines(),
+                                        page_size=DIFF_PAGE_LINES, algorithm=DIFF_ALGORITHM,
+                                        keys=(old_normalized.splitlines(), new_normalized.splitlines()))
+            self._values['code_diff'] = '\n'.join(pager.page(0, DIFF_TIME_LIMIT_MS)[0])
+        self._values['code_diff_pager'] = pager
     
-    # Create highlighted visual comparison
-    old_highlighted, new_highlighted = highlight_visual_changes(old_content, new_content, url, old_text_lines, new_text_lines)
+    def _build_renderings(self):
+        # Both rendered views share one parse of each version
+        old_page, new_page = self._parse()
+        
+        # Iframes with base URL (no highlighting)
+        with instrumentation.span('render', len(old_page.html) + len(new_page.html)):
+            self._values['old_iframe'] = create_iframe_with_base(old_page, self.url)
+            self._values['new_iframe'] = create_iframe_with_base(new_page, self.url)
+        
+        # Highlighted visual comparison
+        with instrumentation.span('highlight', len(old_page.html) + len(new_page.html)):
+            old_highlighted, new_highlighted = highlight_visual_changes(old_page, new_page, self.url,
+                                                                        self.noise_rules)
+        self._values['old_highlighted'] = old_highlighted
+        self._values['new_highlighted'] = new_highlighted
     
-    return {
-        'code_diff': code_diff,
-        'change_percentage': change_percentage,
-        'visual_change_percentage': visual_change_percentage,
-        'old_iframe': old_iframe,
-        'new_iframe': new_iframe,
-        'old_highlighted': old_highlighted,
-        'new_highlighted': new_highlighted,
-        'text_comparison_html': text_comparison_html,
-        'old_text': old_text,
-        'new_text': new_text
-    }
+    def _build_texts(self):
+        # The masked copies are only matched on; the texts themselves are
+        # shown and downloaded
+        old_page, new_page = self._parse()
+        old_text, new_text = old_page.text, new_page.text
+        old_masked = noise_filter.normalize(old_text, self.noise_rules)
+        new_masked = noise_filter.normalize(new_text, self.noise_rules)
+        
+        # Markup-only changes leave the text layer identical
+        if content_hash(old_masked) == content_hash(new_masked):
+            text_similarity = {'ratio': 1.0, 'exact': True}
+        else:
+            with instrumentation.span('similarity', len(old_masked) + len(new_masked)):
+                text_similarity = similarity.similarity(old_masked, new_masked, self.similarity_engine)
+        
+        self._normalized_texts = (old_masked, new_masked)
+        self._values.update({
+            'visual_change_percentage': (1 - text_similarity['ratio']) * 100,
+            'visual_change_percentage_exact': text_similarity['exact'],
+            'old_text': old_text,
+            'new_text': new_text
+        })
+    
+    def _build_text_comparison(self):
+        old_text, new_text = self['old_text'], self['new_text']
+        with instrumentation.span('diff', len(old_text) + len(new_text)):
+            view = side_by_side.SideBySide(old_text, new_text, DIFF_ALGORITHM, keys=self._normalized_texts)
+        # The first page at the default context; other pages are rendered when shown
+        with instrumentation.span('render', len(old_text) + len(new_text)):
+            self._values['text_comparison_html'] = view.render(0, TEXT_CONTEXT_LINES, TEXT_HUNKS_PER_PAGE)
+        self._values['text_comparison'] = view
+    
+    def line_changes(self):
+        """(lines added, lines removed, changed regions) between the noise-masked sources"""
+        old_normalized, new_normalized = self._normalized
+        with instrumentation.span('diff', len(old_normalized) + len(new_normalized)):
+            return line_diff.change_summary(old_normalized.splitlines(), new_normalized.splitlines(),
+                                            algorithm=DIFF_ALGORITHM)
+    
+    def approx_size(self):
+        """Characters held by the built views and the inputs they are built from"""
+        size = sum(len(text) for text in self._contents + self._normalized + (self._normalized_texts or ()))
+        for value in self._values.values():
+            if isinstance(value, str):
+                size += len(value)
+            elif isinstance(value, (line_diff.DiffPager, side_by_side.SideBySide)):
+                size += value.approx_size()
+        return size
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
 
-# Streamlit UI
-st.set_page_config(page_title="Web Page Change Detector", page_icon="🔍", layout="wide")
+def compare_pages(old_content, new_content, url, noise_rules=None, parser_backend=None,
+                  similarity_engine=None):
+    """Compare two page versions.
+    
+    Returns unchanged_result() when only volatile noise differs, otherwise a
+    ComparisonResult whose views are built when first read.
+    """
+    if noise_rules is None:
+        noise_rules = NOISE_RULES
+    if parser_backend is None:
+        parser_backend = PARSER_BACKEND
+    if similarity_engine is None:
+        similarity_engine = SIMILARITY_ENGINE
+    
+    # Fast path: nothing but volatile noise changed
+    old_normalized = noise_filter.normalize(old_content, noise_rules)
+    new_normalized = noise_filter.normalize(new_content, noise_rules)
+    if content_hash(old_normalized) == content_hash(new_normalized):
+        return unchanged_result()
+    
+    return ComparisonResult(old_content, new_content, url, old_normalized, new_normalized,
+                            noise_rules, parser_backend, similarity_engine)
 
-st.title("🔍 Web Page Change Detector")
-st.markdown("Monitor and visualize changes in web pages")
+def comparison_key(old_hash, new_hash, url, noise_rules=None, parser_backend=None,
+                   similarity_engine=None, watch_selector=None):
+    """Result cache key for comparing two contents (or, with a watch selector, their regions)"""
+    return result_key(old_hash, new_hash, RESULT_FORMAT, url, parser_backend or PARSER_BACKEND,
+                      similarity_engine or SIMILARITY_ENGINE,
+                      noise_filter.fingerprint(NOISE_RULES if noise_rules is None else noise_rules),
+                      watch_selector or '')
 
-# Sidebar
-with st.sidebar:
-    st.header("⚙️ Settings")
-    url = st.text_input("Enter URL to monitor:", placeholder="https://example.com", key="url_input")
+def cached_compare(old_content, new_content, url, old_hash=None, new_hash=None, noise_rules=None,
+                   parser_backend=None, similarity_engine=None, watch_selector=None, use_cache=True):
+    """compare_pages() through the shared result cache.
     
-    col1, col2 = st.columns(2)
-    with col1:
-        if st.button("📥 Save Current", use_container_width=True):
-            if url:
-                with st.spinner("Fetching page..."):
-                    content = fetch_page(url)
-                    if content:
-                        save_page(url, content)
-                        st.success("✅ Page saved!")
-                        st.rerun()
-            else:
-                st.warning("⚠️ Please enter a URL")
+    Returns (key, result); the key is what sessions keep to find the result
+    again. Known content hashes can be passed to avoid rehashing, and when
+    they are equal the contents are not needed at all. With a watch
+    selector only the matching region of each version is compared.
+    use_cache=False only computes the key (for job workers, whose results
+    are cached by the process that collects them).
+    """
+    if noise_rules is None:
+        noise_rules = NOISE_RULES
+    if parser_backend is None:
+        parser_backend = PARSER_BACKEND
+    if similarity_engine is None:
+        similarity_engine = SIMILARITY_ENGINE
     
-    with col2:
-        if st.button("🔄 Check Changes", use_container_width=True):
-            if url:
-                if url in st.session_state.saved_pages and len(st.session_state.saved_pages[url]) > 0:
-                    with st.spinner("Analyzing changes..."):
-                        # Get current page
-                        current_content = fetch_page(url)
-                        if current_content:
-                            # Get last saved version
-                            last_saved = st.session_state.saved_pages[url][-1]
-                            with open(last_saved['filepath'], 'r', encoding='utf-8') as f:
-                                old_content = f.read()
-                            
-                            # Compare
-                            st.session_state.comparison_result = compare_pages(old_content, current_content, url)
-                            st.success("✅ Analysis complete!")
-                            st.rerun()
-                else:
-                    st.warning("⚠️ No saved version found. Save the page first.")
-            else:
-                st.warning("⚠️ Please enter a URL")
+    if watch_selector and not (old_hash and old_hash == new_hash):
+        # Only the watched region is hashed, diffed and rendered
+        old_content = region.region_document(old_content, watch_selector, parser_backend)
+        new_content = region.region_document(new_content, watch_selector, parser_backend)
+        old_hash = new_hash = None
     
-    st.divider()
+    old_hash = old_hash or content_hash(old_content)
+    new_hash = new_hash or content_hash(new_content)
+    key = comparison_key(old_hash, new_hash, url, noise_rules, parser_backend, similarity_engine,
+                         watch_selector)
+    result = result_cache.get(key) if use_cache else None
+    if result is None:
+        if old_hash == new_hash:
+            result = unchanged_result()
+        else:
+            result = compare_pages(old_content, new_content, url, noise_rules=noise_rules,
+                                   parser_backend=parser_backend, similarity_engine=similarity_engine)
+        if use_cache:
+            result_cache.put(key, result)
+    return key, result
+
+def check_page(url, last_saved, parser_backend=None, watch_selector=None, use_cache=True):
+    """Fetch a page and compare it with its last saved snapshot.
+    
+    Returns (key, result) like cached_compare(). Fetch errors and invalid
+    watch selectors are raised.
+    """
+    jobs.report("Fetching page", 0.05)
+    fetched = fetch_page(url, validators=last_saved, raise_errors=True)
+    if fetched['unchanged']:
+        # Server confirmed the saved version is current, or the body hashed the same
+        saved_hash = last_saved['content_hash'] or content_hash(store.read(last_saved))
+        return cached_compare(None, None, url, old_hash=saved_hash, new_hash=saved_hash,
+                              parser_backend=parser_backend, watch_selector=watch_selector,
+                              use_cache=use_cache)
+    
+    jobs.report("Comparing with the saved version", 0.3)
+    old_content = store.read(last_saved)
+    return cached_compare(old_content, fetched['content'], url, old_hash=last_saved['content_hash'],
+                          parser_backend=parser_backend, watch_selector=watch_selector,
+                          use_cache=use_cache)
+
+def check_page_job(url, last_saved, parser_backend=None, watch_selector=None):
+    """check_page() in a job worker; the result comes back as portable_result() data"""
+    key, result = check_page(url, last_saved, parser_backend, watch_selector, use_cache=False)
+    return key, portable_result(result)
+
+def portable_result(result):
+    """A result as plain data, so that unpickling it does not need this module by name"""
+    if isinstance(result, ComparisonResult):
+        return ('comparison', result.__getstate__())
+    return ('dict', result)
+
+def restore_result(data):
+    """The result a portable_result() came from"""
+    kind, value = data
+    if kind == 'comparison':
+        result = ComparisonResult.__new__(ComparisonResult)
+        result.__setstate__(value)
+        return result
+    return value
+
+def compare_versions_job(url, old_metadata, new_metadata, parser_backend=None, watch_selector=None):
+    """Compare two saved versions in a job worker; returns (key, portable_result())"""
+    jobs.report("Reading saved versions", 0.1)
+    old_content = store.read(old_metadata)
+    new_content = store.read(new_metadata)
+    jobs.report("Comparing versions", 0.3)
+    key, result = cached_compare(old_content, new_content, url, old_hash=old_metadata['content_hash'],
+                                 new_hash=new_metadata['content_hash'], parser_backend=parser_backend,
+                                 watch_selector=watch_selector, use_cache=False)
+    return key, portable_result(result)
+
+# Changed-line ranges kept per version for the timeline
+MAX_STORED_REGIONS = 50
+
+def version_stats(old_content, new_content, url, watch_selector=None):
+    """Change stats of one version against another, as stored for the timeline"""
+    if watch_selector:
+        old_content = region.region_document(old_content, watch_selector)
+        new_content = region.region_document(new_content, watch_selector)
+    result = compare_pages(old_content, new_content, url)
+    if result['unchanged']:
+        added, removed, regions = 0, 0, []
+    else:
+        result.refine()
+        added, removed, regions = result.line_changes()
+    return {
+        'change_percentage': result['change_percentage'],
+        'text_change_percentage': result['visual_change_percentage'],
+        'lines_added': added,
+        'lines_removed': removed,
+        'region_count': len(regions),
+        'regions': regions[:MAX_STORED_REGIONS]
+    }
+
+def timeline_pending(versions, stored, watch_selector=None):
+    """(previous, current) version pairs whose stored stats are missing or stale"""
+    pending = []
+    for previous, current in zip(versions, versions[1:]):
+        stats = stored.get(current['version'])
+        if (stats is None or stats['base_version'] != previous['version']
+                or stats['watch_selector'] != (watch_selector or None)):
+            pending.append((previous, current))
+    return pending
+
+def update_timeline(url, watch_selector=None):
+    """Store stats for every version of a URL against the one before it, and index its text.
+    
+    Versions whose stats are stored already (against the same previous
+    version and watch region) are skipped, as are versions already in the
+    text index, so this is cheap to call after every save. Returns the
+    number of versions whose stats were computed.
+    """
+    versions = catalog.versions(url)
+    pending = timeline_pending(versions, catalog.version_stats(url), watch_selector)
     
-    # Show saved pages
-    if url and url in st.session_state.saved_pages:
-        st.subheader("📚 Saved Versions")
-        for idx, page in enumerate(reversed(st.session_state.saved_pages[url])):
-            with st.container():
-                st.markdown(f"**Version {len(st.session_state.saved_pages[url]) - idx}**")
-                st.caption(f"🕐 {page['display_time']}")
-                if idx < len(st.session_state.saved_pages[url]) - 1:
-                    st.markdown("---")
-
-# Main content area
-if st.session_state.comparison_result:
-    result = st.session_state.comparison_result
-    
-    # Show change summary
-    st.header("📊 Change Summary")
+    contents = {}  # the previous pair's versions, which the next pair usually shares
+    for index, (previous, current) in enumerate(pending):
+        jobs.report(f"Version {current['version']} of {versions[-1]['version']}", index / len(pending))
+        if previous['content_hash'] and previous['content_hash'] == current['content_hash']:
+            stats = {'change_percentage': 0.0, 'text_change_percentage': 0.0, 'lines_added': 0,
+                     'lines_removed': 0, 'region_count': 0, 'regions': []}
+        else:
+            contents = {version['version']: contents.get(version['version']) or store.read(version)
+                        for version in (previous, current)}
+            stats = version_stats(contents[previous['version']], contents[current['version']], url,
+                                  watch_selector)
+        catalog.set_version_stats(url, current['version'], previous['version'], stats, watch_selector)
+    # The whole page's text is indexed, whatever region is watched
+    text_index.index_url(store, url, progress=jobs.report)
+    return len(pending)
+
+def format_percentage(value, exact):
+    """Format a change percentage, marking estimates with ≈"""
+    return f"{value:.2f}%" if exact else f"≈{value:.2f}%"
+
+def export_metrics():
+    """Rewrite METRICS_FILE with the current stage metrics, if one is configured"""
+    if METRICS_FILE and instrumentation.enabled():
+        instrumentation.write_metrics(METRICS_FILE)
+
+def render_summary(result):
+    """Code and text change metrics and the resulting status"""
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        st.metric("Code Change", f"{result['change_percentage']:.2f}%", 
+        st.metric("Code Change", format_percentage(result['change_percentage'], result['change_percentage_exact']),
                  delta=f"{result['change_percentage']:.1f}%" if result['change_percentage'] > 0 else None)
     
     with col2:
-        st.metric("Text Content Change", f"{result['visual_change_percentage']:.2f}%",
+        st.metric("Text Content Change", format_percentage(result['visual_change_percentage'],
+                                                           result['visual_change_percentage_exact']),
                  delta=f"{result['visual_change_percentage']:.1f}%" if result['visual_change_percentage'] > 0 else None)
     
     with col3:
@@ -475,113 +807,535 @@ if st.session_state.comparison_result:
             status = "🟢 No Changes"
             color = "green"
         st.markdown(f"**Status:** :{color}[{status}]")
+
+def render_timings(timings):
+    """Per-stage timings of the current comparison"""
+    rows = [{'Stage': stage, 'Calls': calls, 'Time (ms)': round(seconds * 1000, 1), 'Bytes': nbytes}
+            for stage, seconds, nbytes, calls in instrumentation.summarize(timings)]
+    st.table(rows)
+    st.caption("Stages run by this check and the views opened since. Results reused from the "
+               "cache, and views built by another session, cost nothing here.")
+
+@st.fragment(run_every=0.5)
+def render_job_status():
+    """Progress of the session's running check, polled until it finishes"""
+    job = get_job_queue().get(st.session_state.job_id)
+    if job is None:
+        st.session_state.job_id = None
+        st.rerun()
+    if not job.done:
+        st.progress(job.progress, text=f"{job.message} ({job.elapsed:.1f} s)")
+        if st.button("✖️ Cancel", key="cancel_job", use_container_width=True):
+            get_job_queue().cancel(job.id)
+            st.rerun(scope="fragment")
+        return
     
-    # Tabs for different views
-    tab1, tab2, tab3, tab4 = st.tabs(["📝 Code Diff", "👁️ Visual Comparison", "🔴 Highlighted Visual", "📄 Text Changes"])
-    
-    with tab1:
-        st.subheader("Code-Level Differences")
-        st.info("💡 Shows raw HTML differences (first 500 lines)")
-        if result['code_diff']:
-            st.code(result['code_diff'], language='diff')
-        else:
-            st.success("✅ No code differences detected")
+    st.session_state.job_id = None
+    if job.status == jobs.DONE:
+        key, data = job.result
+        if result_cache.get(key) is None:
+            result_cache.put(key, restore_result(data))
+        # The worker's stage timings count towards this process's metrics
+        for timing in job.timings:
+            instrumentation.observe(*timing)
+        show_comparison(key, st.session_state.get('job_title'), job.timings)
+        export_metrics()
+        st.toast("✅ Analysis complete!")
+    elif job.status == jobs.FAILED:
+        st.session_state.job_notice = ('error', f"❌ {job.message}")
+    else:
+        st.session_state.job_notice = ('warning', f"⚠️ Check {job.message.lower()}")
+    st.rerun()
+
+def submit_timeline_update(url, watch_selector):
+    """Compute missing timeline stats and index new versions of a URL in the background"""
+    try:
+        get_job_queue().submit(('timeline', url, watch_selector), 'sapp:update_timeline', url,
+                               watch_selector, timeout=None)
+    except jobs.QueueFull:
+        pass
+
+def request_timeline_update(url, watch_selector):
+    """submit_timeline_update() once per session; saving a version submits its own update"""
+    requested = st.session_state.setdefault('timeline_requested', set())
+    if (url, watch_selector) not in requested:
+        requested.add((url, watch_selector))
+        submit_timeline_update(url, watch_selector)
+
+def render_timeline(url, watch_selector, parser_backend):
+    """Change history from the stored per-version stats, and a picker to compare any two versions"""
+    versions = catalog.versions(url)
+    stored = catalog.version_stats(url)
+    pending = timeline_pending(versions, stored, watch_selector)
+    by_version = {version['version']: version for version in versions}
     
-    with tab2:
-        st.subheader("Side-by-Side Page Rendering (Clean)")
-        st.warning("⚠️ Note: Some sites may not render perfectly due to security restrictions. Images and styles are loaded from the original URL.")
+    with st.expander(f"📈 Change History ({len(versions)} versions)"):
+        if pending:
+            st.caption(f"⏳ Computing change stats for {len(pending)} versions in the background...")
+            request_timeline_update(url, watch_selector)
         
-        col1, col2 = st.columns(2)
+        stale = {current['version'] for _, current in pending}
+        points = [(version, stored[version['version']]) for version in versions[1:]
+                  if version['version'] not in stale]
+        if points:
+            st.line_chart({
+                'Saved': [datetime.strptime(version['timestamp'], "%Y%m%d_%H%M%S") for version, _ in points],
+                'Text change %': [stats['text_change_percentage'] for _, stats in points],
+                'Code change %': [stats['change_percentage'] for _, stats in points],
+            }, x='Saved', y=['Text change %', 'Code change %'], height=250)
+            st.dataframe([{
+                'Version': version['version'],
+                'Saved': version['display_time'],
+                'Text change %': round(stats['text_change_percentage'], 2),
+                'Code change %': round(stats['change_percentage'], 2),
+                'Lines added': stats['lines_added'],
+                'Lines removed': stats['lines_removed'],
+                'Regions': stats['region_count'],
+            } for version, stats in reversed(points)], hide_index=True, height=250)
         
+        # Any two versions; results are shared through the result cache
+        numbers = [version['version'] for version in reversed(versions)]
+        label = lambda number: f"Version {number} · {by_version[number]['display_time']}"
+        col1, col2, col3 = st.columns([2, 2, 1])
         with col1:
-            st.markdown("**📁 Saved Version**")
-            st.components.v1.html(result['old_iframe'], height=700, scrolling=True)
+            old_number = st.selectbox("From", numbers, index=1, format_func=label, key="timeline_from")
+        with col2:
+            new_number = st.selectbox("To", numbers, index=0, format_func=label, key="timeline_to")
+        with col3:
+            compare = st.button("🔍 Compare", key="timeline_compare", use_container_width=True)
+        if compare:
+            if old_number == new_number:
+                st.info("Pick two different versions")
+                return
+            old_version, new_version = by_version[old_number], by_version[new_number]
+            title = f"Version {old_number} → Version {new_number}"
+            if not watch_selector and old_version['content_hash'] and new_version['content_hash']:
+                key = comparison_key(old_version['content_hash'], new_version['content_hash'], url,
+                                     parser_backend=parser_backend)
+                if result_cache.get(key) is not None:
+                    show_comparison(key, title)
+                    st.rerun()
+            try:
+                job = get_job_queue().submit(('versions', url, old_number, new_number, parser_backend, watch_selector),
+                                             'sapp:compare_versions_job', url, old_version, new_version,
+                                             parser_backend, watch_selector, timeout=JOB_TIMEOUT)
+            except jobs.QueueFull:
+                st.error("❌ Too many checks are running. Try again shortly.")
+                return
+            st.session_state.job_id = job.id
+            st.session_state.job_title = title
+            st.rerun()
+
+# Longest list of spans shown for a search
+MAX_LISTED_SPANS = 100
+
+def render_history_search(url, watch_selector):
+    """Search box over the text index of a URL's saved versions"""
+    with st.expander("🔎 Search History"):
+        latest = catalog.latest(url)
+        indexed = catalog.indexed_version(url)
+        if indexed < latest['version']:
+            st.caption(f"⏳ Indexing new versions in the background; results cover versions up to {indexed}.")
+            request_timeline_update(url, watch_selector)
+        phrase = st.text_input("Word or phrase", key="history_search",
+                               placeholder="When did this first appear, or disappear?")
+        if not phrase.strip():
+            return
+        started = time.perf_counter()
+        found = text_index.search(catalog, url, phrase)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if found is None:
+            st.info(f"Not found in any indexed version ({elapsed_ms:.1f} ms)")
+            return
         
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("First seen", f"Version {found.first['version']}")
+            st.caption(f"🕐 {found.first['display_time']}")
         with col2:
-            st.markdown("**🆕 Current Version**")
-            st.components.v1.html(result['new_iframe'], height=700, scrolling=True)
+            st.metric("Last seen", f"Version {found.last['version']}")
+            st.caption(f"🕐 {found.last['display_time']}")
+        with col3:
+            if found.gone:
+                st.metric("Gone since", f"Version {found.gone['version']}")
+                st.caption(f"🕐 {found.gone['display_time']}")
+            else:
+                st.metric("Gone since", "Still present")
+        st.caption(f"In {found.versions} version{'s' if found.versions != 1 else ''} over {len(found.spans)} "
+                   f"span{'s' if len(found.spans) != 1 else ''} · searched in {elapsed_ms:.1f} ms")
+        if len(found.spans) > 1:
+            times = {version['version']: version['display_time'] for version in catalog.versions(url)}
+            st.dataframe([{
+                'From version': first,
+                'From': times[first],
+                'To version': last,
+                'To': times[last],
+            } for first, last in found.spans[:MAX_LISTED_SPANS]], hide_index=True, height=250)
+
+def show_comparison(key, title=None, timings=()):
+    """Make a cached comparison result the one this session shows"""
+    st.session_state.comparison_key = key
+    st.session_state.comparison_title = title
+    st.session_state.code_diff_page = 0
+    st.session_state.text_diff_page = 0
+    st.session_state.timings = list(timings)
+
+def reset_text_diff_page():
+    st.session_state.text_diff_page = 0
+
+def build_views(result, *keys):
+    """Build comparison views that are not ready yet, under a spinner"""
+    if all(result.is_built(key) for key in keys):
+        return
+    with st.spinner("Building view..."), instrumentation.recording(st.session_state.timings):
+        for key in keys:
+            result[key]
+    export_metrics()
+    # The cached result grew; let the cache account for it
+    result_cache.resize(st.session_state.comparison_key)
+
+@st.cache_data(max_entries=4, show_spinner="Comparing screenshots...")
+def cached_screenshot_diff(old_png, new_png):
+    """Pixel diff of two uploaded screenshots"""
+    return screenshot_diff.diff_screenshots(io.BytesIO(old_png), io.BytesIO(new_png))
+
+def render_screenshot_diff(url):
+    """Screenshot uploaders (or capture hook) and the pixel diff result"""
+    col1, col2 = st.columns(2)
+    with col1:
+        old_file = st.file_uploader("Saved screenshot", type=["png", "jpg", "jpeg", "webp"], key="screenshot_old")
+    with col2:
+        if SCREENSHOT_CAPTURE is None:
+            new_file = st.file_uploader("Current screenshot", type=["png", "jpg", "jpeg", "webp"], key="screenshot_new")
+        else:
+            new_file = None
+            capture = st.button("📸 Capture current page", key="screenshot_capture")
+    if old_file is None:
+        return
+
+    try:
+        if new_file is not None:
+            diff = cached_screenshot_diff(old_file.getvalue(), new_file.getvalue())
+        elif SCREENSHOT_CAPTURE is not None and capture:
+            with st.spinner("Capturing and comparing screenshots..."):
+                diff = screenshot_diff.diff_screenshots(io.BytesIO(old_file.getvalue()), SCREENSHOT_CAPTURE(url))
+        else:
+            return
+    except ValueError as e:
+        st.error(f"❌ Cannot compare these screenshots: {e}")
+        return
+
+    st.metric("Changed Area", f"{diff.changed_percentage:.2f}%")
+    st.caption(f"{diff.changed_tiles} of {diff.total_tiles} tiles changed in {len(diff.boxes)} regions "
+               f"({diff.width}×{diff.height} px)")
+    st.image(diff.overlay_png, caption="Changed regions on the current screenshot")
+
+def render_app():
+    """Render the Streamlit UI"""
+    # Initialize session state
+    # Only the result cache key is kept per session, not the result itself
+    if 'comparison_key' not in st.session_state:
+        st.session_state.comparison_key = None
+    if 'code_diff_page' not in st.session_state:
+        st.session_state.code_diff_page = 0
+    if 'text_diff_page' not in st.session_state:
+        st.session_state.text_diff_page = 0
+    if 'timings' not in st.session_state:
+        st.session_state.timings = []
+    if 'job_id' not in st.session_state:
+        st.session_state.job_id = None
+    if 'comparison_title' not in st.session_state:
+        st.session_state.comparison_title = None
     
-    with tab3:
-        st.subheader("🔴 Visual Comparison with Highlighted Changes")
-        st.success("🎯 Red outline = Removed content | Green outline = Added content | Orange outline = Modified")
-        st.info("💡 Changes are highlighted directly on the rendered pages below")
+    st.set_page_config(page_title="Web Page Change Detector", page_icon="🔍", layout="wide")
+
+    st.title("🔍 Web Page Change Detector")
+    st.markdown("Monitor and visualize changes in web pages")
+
+    # Sidebar
+    with st.sidebar:
+        st.header("⚙️ Settings")
+        url = st.text_input("Enter URL to monitor:", placeholder="https://example.com", key="url_input")
+        parser_options = ['auto', 'html.parser'] + (['lxml'] if HAVE_LXML else [])
+        parser_backend = st.selectbox("HTML parser:", parser_options, key="parser_backend",
+                                      help="'auto' switches to lxml for large pages when it is installed")
         
+        # Region to watch, remembered per URL in the catalog
+        stored_selector = catalog.watch_selector(url) if url else None
+        watch_selector = st.text_input("Watch region (optional):", value=stored_selector or '',
+                                       placeholder="#price, div.changelog or //main//table",
+                                       key=f"watch_selector_{url}", disabled=not url,
+                                       help="CSS selector or XPath; only the matching part of the page is compared")
+        watch_selector = watch_selector.strip() or None
+        if url and watch_selector != stored_selector:
+            catalog.set_watch_selector(url, watch_selector)
+    
         col1, col2 = st.columns(2)
-        
         with col1:
-            st.markdown("**📁 Saved Version (Changes in Red)**")
-            st.components.v1.html(result['old_highlighted'], height=700, scrolling=True)
-        
+            if st.button("📥 Save Current", use_container_width=True):
+                if url:
+                    with st.spinner("Fetching page..."):
+                        fetched = fetch_page(url, save=True)
+                        if fetched:
+                            submit_timeline_update(url, watch_selector)
+                            export_metrics()
+                            if fetched['truncated']:
+                                st.toast(f"Page was cut off at {MAX_BODY_BYTES / 1e6:g} MB", icon="⚠️")
+                            st.success("✅ Page saved!")
+                            st.rerun()
+                else:
+                    st.warning("⚠️ Please enter a URL")
+    
         with col2:
-            st.markdown("**🆕 Current Version (Changes in Green)**")
-            st.components.v1.html(result['new_highlighted'], height=700, scrolling=True)
+            if st.button("🔄 Check Changes", use_container_width=True):
+                if url:
+                    last_saved = catalog.latest(url)
+                    if last_saved:
+                        # Runs in the background; the same check already in flight is joined
+                        job_key = result_key(last_saved['content_hash'] or str(last_saved['version']),
+                                             'check', url, parser_backend, watch_selector or '')
+                        try:
+                            job = get_job_queue().submit(job_key, 'sapp:check_page_job', url, last_saved,
+                                                         parser_backend, watch_selector, timeout=JOB_TIMEOUT)
+                        except jobs.QueueFull:
+                            st.error("❌ Too many checks are running. Try again shortly.")
+                        else:
+                            st.session_state.job_id = job.id
+                            st.session_state.job_title = None
+                    else:
+                        st.warning("⚠️ No saved version found. Save the page first.")
+                else:
+                    st.warning("⚠️ Please enter a URL")
+    
+        if st.session_state.job_id:
+            render_job_status()
+        notice = st.session_state.pop('job_notice', None)
+        if notice:
+            getattr(st, notice[0])(notice[1])
+    
+        st.divider()
+    
+        # Show saved pages (newest first, only the most recent ones are loaded)
+        saved_versions = catalog.versions(url, limit=MAX_LISTED_VERSIONS, newest_first=True) if url else []
+        if saved_versions:
+            st.subheader("📚 Saved Versions")
+            stats_by_version = catalog.version_stats(url)
+            for idx, page in enumerate(saved_versions):
+                with st.container():
+                    st.markdown(f"**Version {page['version']}**")
+                    st.caption(f"🕐 {page['display_time']}")
+                    stats = stats_by_version.get(page['version'])
+                    if stats:
+                        st.caption(f"+{stats['lines_added']} / −{stats['lines_removed']} lines · "
+                                   f"{stats['text_change_percentage']:.1f}% text")
+                    if idx < len(saved_versions) - 1:
+                        st.markdown("---")
+            total_versions = catalog.count(url)
+            if total_versions > len(saved_versions):
+                st.caption(f"… and {total_versions - len(saved_versions)} older versions")
+
+    # Main content area
+    version_count = catalog.count(url) if url else 0
+    if version_count > 1:
+        render_timeline(url, watch_selector, parser_backend)
+    if version_count:
+        render_history_search(url, watch_selector)
+    
+    result = None
+    if st.session_state.comparison_key:
+        result = result_cache.get(st.session_state.comparison_key)
+        if result is None:
+            st.warning("⚠️ This comparison is no longer cached. Click Check Changes to run it again.")
+    if result:
     
-    with tab4:
-        st.subheader("📄 Text Content Changes")
-        st.info("🎯 Red = Changed/Removed | Green = Added | White = Unchanged")
+        # Show change summary
+        st.header("📊 Change Summary")
+        if st.session_state.comparison_title:
+            st.caption(st.session_state.comparison_title)
+        # Filled in last, so that an estimated text change refined by a view
+        # further down shows its measured figure
+        summary_area = st.container()
+    
+        # Filled in last, so that views built further down are included
+        timings_area = st.container()
+    
+        if result['unchanged']:
+            st.success("✅ Page is identical to the saved version (ignoring tokens, timestamps and other volatile content)")
+        else:
+            # Tabs for different views; only the selected one runs, so each
+            # view is built the first time its tab is opened
+            tab1, tab2, tab3, tab4 = st.tabs(["📝 Code Diff", "👁️ Visual Comparison", "🔴 Highlighted Visual", "📄 Text Changes"],
+                                             key="result_tab", on_change="rerun")
+    
+            with tab1:
+                if tab1.open:
+                    build_views(result, 'code_diff')
+                    st.subheader("Code-Level Differences")
+                    pager = result['code_diff_pager']
+                    if pager is None or not result['code_diff']:
+                        st.success("✅ No code differences detected")
+                    else:
+                        st.info(f"💡 Shows raw HTML differences ({pager.page_size} lines per page)")
+                        page_index = st.session_state.code_diff_page
+                        lines, finished = pager.page(page_index, DIFF_TIME_LIMIT_MS)
+                        st.code('\n'.join(lines), language='diff')
+                        if not finished:
+                            st.caption(f"⏱️ Stopped after {DIFF_TIME_LIMIT_MS} ms with {len(lines)} lines on this page")
+    
+                        col1, col2, col3 = st.columns([1, 2, 1])
+                        with col1:
+                            if st.button("⬅️ Previous", disabled=page_index == 0, key="diff_prev"):
+                                st.session_state.code_diff_page -= 1
+                                st.rerun()
+                        with col2:
+                            total = "" if pager.complete else "+"
+                            st.caption(f"Page {page_index + 1} · {pager.lines_computed}{total} diff lines computed")
+                        with col3:
+                            if not finished:
+                                if st.button("Continue ▶️", key="diff_continue"):
+                                    st.rerun()
+                            elif st.button("Next ➡️", disabled=not pager.has_next(page_index), key="diff_next"):
+                                st.session_state.code_diff_page += 1
+                                st.rerun()
+    
+            with tab2:
+                if tab2.open:
+                    build_views(result, 'old_iframe')
+                    st.subheader("Side-by-Side Page Rendering (Clean)")
+                    st.warning("⚠️ Note: Some sites may not render perfectly due to security restrictions. Images and styles are loaded from the original URL.")
         
-        st.components.v1.html(result['text_comparison_html'], height=700, scrolling=True)
+                    col1, col2 = st.columns(2)
         
-        # Download options
-        st.divider()
-        col1, col2 = st.columns(2)
-        with col1:
-            st.download_button(
-                label="📥 Download Old Version Text",
-                data=result['old_text'],
-                file_name="old_version.txt",
-                mime="text/plain"
-            )
-        with col2:
-            st.download_button(
-                label="📥 Download New Version Text",
-                data=result['new_text'],
-                file_name="new_version.txt",
-                mime="text/plain"
-            )
+                    with col1:
+                        st.markdown("**📁 Saved Version**")
+                        st.components.v1.html(result['old_iframe'], height=700, scrolling=True)
+        
+                    with col2:
+                        st.markdown("**🆕 Current Version**")
+                        st.components.v1.html(result['new_iframe'], height=700, scrolling=True)
 
-else:
-    # Welcome screen
-    st.info("👆 Enter a URL in the sidebar and click **'📥 Save Current'** to start monitoring")
+                    with st.expander("🖼️ Screenshot Comparison"):
+                        render_screenshot_diff(result.url)
     
-    col1, col2 = st.columns(2)
+            with tab3:
+                if tab3.open:
+                    build_views(result, 'old_highlighted')
+                    st.subheader("🔴 Visual Comparison with Highlighted Changes")
+                    st.success("🎯 Red outline = Removed content | Green outline = Added content | Orange outline = Attributes changed | Blue dashed = Moved")
+                    st.info("💡 Changes are highlighted directly on the rendered pages below")
+        
+                    col1, col2 = st.columns(2)
+        
+                    with col1:
+                        st.markdown("**📁 Saved Version (Changes in Red)**")
+                        st.components.v1.html(result['old_highlighted'], height=700, scrolling=True)
+        
+                    with col2:
+                        st.markdown("**🆕 Current Version (Changes in Green)**")
+                        st.components.v1.html(result['new_highlighted'], height=700, scrolling=True)
     
-    with col1:
-        st.markdown("""
-        ### 🚀 How to Use
+            with tab4:
+                if tab4.open:
+                    build_views(result, 'text_comparison')
+                    st.subheader("📄 Text Content Changes")
+                    st.info("🎯 Red = Changed/Removed | Green = Added | White = Unchanged | ⋯ = unchanged lines (click to expand short runs)")
+                    
+                    view = result['text_comparison']
+                    context = st.selectbox("Context lines", TEXT_CONTEXT_CHOICES,
+                                           index=TEXT_CONTEXT_CHOICES.index(TEXT_CONTEXT_LINES),
+                                           key="text_context", on_change=reset_text_diff_page)
+                    page_count = view.page_count(context, TEXT_HUNKS_PER_PAGE)
+                    page_index = min(st.session_state.text_diff_page, page_count - 1)
+                    with instrumentation.span('render', len(result['old_text']) + len(result['new_text'])):
+                        page_html = view.render(page_index, context, TEXT_HUNKS_PER_PAGE)
+                    st.components.v1.html(page_html, height=700, scrolling=True)
+                    
+                    if page_count > 1:
+                        col1, col2, col3 = st.columns([1, 2, 1])
+                        with col1:
+                            if st.button("⬅️ Previous", disabled=page_index == 0, key="text_prev"):
+                                st.session_state.text_diff_page = page_index - 1
+                                st.rerun()
+                        with col2:
+                            removed, added = view.changed_lines()
+                            st.caption(f"Page {page_index + 1} of {page_count} · "
+                                       f"{len(view.hunks(context))} changes · −{removed} / +{added} lines")
+                        with col3:
+                            if st.button("Next ➡️", disabled=page_index + 1 >= page_count, key="text_next"):
+                                st.session_state.text_diff_page = page_index + 1
+                                st.rerun()
+        
+                    # Download options
+                    st.divider()
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        st.download_button(
+                            label="📥 Download Old Version Text",
+                            data=result['old_text'],
+                            file_name="old_version.txt",
+                            mime="text/plain"
+                        )
+                    with col2:
+                        st.download_button(
+                            label="📥 Download New Version Text",
+                            data=result['new_text'],
+                            file_name="new_version.txt",
+                            mime="text/plain"
+                        )
+    
+        with summary_area:
+            render_summary(result)
+    
+        if st.session_state.timings:
+            with timings_area, st.expander("⏱️ Timings"):
+                render_timings(st.session_state.timings)
+
+
+    else:
+        # Welcome screen
+        st.info("👆 Enter a URL in the sidebar and click **'📥 Save Current'** to start monitoring")
+    
+        col1, col2 = st.columns(2)
+    
+        with col1:
+            st.markdown("""
+            ### 🚀 How to Use
         
-        1. **Enter URL** - Paste any public website URL
-        2. **Save Current** - Capture the current page state
-        3. **Check Changes** - Compare current page with saved version
-        4. **View Results** - Analyze differences in multiple views
+            1. **Enter URL** - Paste any public website URL
+            2. **Save Current** - Capture the current page state
+            3. **Check Changes** - Compare current page with saved version
+            4. **View Results** - Analyze differences in multiple views
         
-        ### 📋 Best Practices
+            ### 📋 Best Practices
         
-        - Save pages before expected changes
-        - Check regularly for updates
-        - Use for monitoring news, prices, or content
-        - Download text versions for records
-        """)
+            - Save pages before expected changes
+            - Check regularly for updates
+            - Use for monitoring news, prices, or content
+            - Download text versions for records
+            """)
     
-    with col2:
-        st.markdown("""
-        ### ✨ Features
+        with col2:
+            st.markdown("""
+            ### ✨ Features
         
-        - **Code Diff** - Line-by-line HTML comparison
-        - **Visual Rendering** - See pages side-by-side
-        - **Text Highlighting** - Changes marked in red/green
-        - **Change Metrics** - Percentage-based analysis
-        - **Version History** - Track multiple snapshots
-        - **Export Options** - Download text versions
+            - **Code Diff** - Line-by-line HTML comparison
+            - **Visual Rendering** - See pages side-by-side
+            - **Text Highlighting** - Changes marked in red/green
+            - **Change Metrics** - Percentage-based analysis
+            - **Version History** - Track multiple snapshots
+            - **Export Options** - Download text versions
         
-        ### 💡 Use Cases
+            ### 💡 Use Cases
         
-        - Monitor news article updates
-        - Track price changes on e-commerce
-        - Watch for policy/documentation updates
-        - Detect website modifications
-        """)
-
-# Footer
-st.divider()
-st.caption("🔍 Web Page Change Detector v2.0 | Built with Streamlit | Detect • Compare • Visualize")
+            - Monitor news article updates
+            - Track price changes on e-commerce
+            - Watch for policy/documentation updates
+            - Detect website modifications
+            """)
+
+    # Footer
+    st.divider()
+    st.caption("🔍 Web Page Change Detector v2.0 | Built with Streamlit | Detect • Compare • Visualize")
+
+if __name__ == "__main__":
+    render_app()
@@ -0,0 +1,266 @@
+import io
+from collections import namedtuple
+from itertools import chain, zip_longest
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# Side of the square tiles screenshots are compared in, in pixels
+TILE_SIZE = 32
+
+# Each tile's perceptual hash is HASH_CELLS x HASH_CELLS bits
+HASH_CELLS = 8
+
+# A tile counts as changed when this many hash bits differ, or when its
+# average colour moved by more than MEAN_THRESHOLD (0-255) in any channel
+HASH_THRESHOLD = 6
+MEAN_THRESHOLD = 8.0
+
+# Rows of pixels decoded and compared at a time
+STRIP_HEIGHT = 512
+
+# Pillow decodes an image file as a whole, so a single file may hold at most
+# this many pixels (about 180 MB as RGB, a 1920-pixel-wide page 31,000
+# pixels tall); taller pages go in a list of strips
+MAX_IMAGE_PIXELS = 60_000_000
+
+# The overlay is scaled down to at most this width
+OVERLAY_MAX_WIDTH = 1000
+
+# Padding for the narrower/shorter screenshot
+PAD_VALUE = 255
+
+# (x, y, width, height) in pixels of the full-size screenshots
+Box = namedtuple('Box', 'x y width height')
+
+ScreenshotDiff = namedtuple(
+    'ScreenshotDiff', 'width height changed_tiles total_tiles changed_percentage boxes overlay_png')
+
+
+def _open(part, number, max_pixels):
+    """Open one image file, refusing it before decoding if it is too large"""
+    try:
+        image = Image.open(part)
+    except Image.DecompressionBombError as e:
+        raise ValueError(f"Screenshot part {number} is too large to decode: {e}") from None
+    if image.width * image.height > max_pixels:
+        raise ValueError(f"Screenshot part {number} is {image.width}×{image.height} pixels, over the "
+                         f"{max_pixels:,} a single image may have; pass it as a list of strips")
+    return image
+
+
+def image_strips(source, strip_height=STRIP_HEIGHT, max_pixels=MAX_IMAGE_PIXELS):
+    """Yield a screenshot as RGB strips from top to bottom, all as wide as the first.
+
+    source may be a path, a file object, a PIL image, or a list/iterable of
+    those holding consecutive strips of one page (the way scrolling capture
+    tools produce full-page shots). Single files are decoded by Pillow as a
+    whole, so files over max_pixels raise ValueError; strip lists are decoded
+    one strip at a time. Strips narrower than the first are padded with
+    PAD_VALUE, and wider ones raise ValueError.
+    """
+    if isinstance(source, (str, Path, Image.Image)) or hasattr(source, 'read'):
+        sources = [source]
+    else:
+        sources = source
+    width = None
+    for number, part in enumerate(sources, start=1):
+        image = part if isinstance(part, Image.Image) else _open(part, number, max_pixels)
+        if width is None:
+            width = image.width
+        elif image.width > width:
+            raise ValueError(f"Screenshot part {number} is {image.width} pixels wide, "
+                             f"wider than the first part's {width}")
+        for top in range(0, image.height, strip_height):
+            strip = image.crop((0, top, image.width, min(top + strip_height, image.height)))
+            if strip.mode != 'RGB':
+                strip = strip.convert('RGB')
+            if strip.width < width:
+                padded = Image.new('RGB', (width, strip.height), (PAD_VALUE,) * 3)
+                padded.paste(strip, (0, 0))
+                strip = padded
+            yield strip
+
+
+def _tile_rows(strips, tile_size):
+    """Re-chunk strips into RGB arrays exactly tile_size rows high (the last may be shorter)"""
+    pending = []
+    rows = 0
+    for strip in strips:
+        pending.append(np.asarray(strip))
+        rows += strip.height
+        if rows < tile_size:
+            continue
+        block = np.concatenate(pending) if len(pending) > 1 else pending[0]
+        whole = rows - rows % tile_size
+        for top in range(0, whole, tile_size):
+            yield block[top:top + tile_size]
+        pending = [block[whole:]] if whole < rows else []
+        rows -= whole
+    if rows:
+        yield np.concatenate(pending) if len(pending) > 1 else pending[0]
+
+
+def _pad(row, height, width):
+    """Pad a tile row to height x width with PAD_VALUE"""
+    if row.shape[0] == height and row.shape[1] == width:
+        return row
+    padded = np.full((height, width, 3), PAD_VALUE, dtype=np.uint8)
+    padded[:row.shape[0], :row.shape[1]] = row
+    return padded
+
+
+def _tile_hashes(tiles, tile_size):
+    """Average-hash bits and mean colour of tiles shaped (n, tile, tile, 3)"""
+    cell = tile_size // HASH_CELLS
+    gray = tiles.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    cells = gray.reshape(len(tiles), HASH_CELLS, cell, HASH_CELLS, cell).mean(axis=(2, 4))
+    bits = cells.reshape(len(tiles), -1) > cells.mean(axis=(1, 2))[:, None]
+    return bits, tiles.mean(axis=(1, 2))
+
+
+def _changed_tiles(old_row, new_row, tile_size, columns):
+    """Indices of the tiles in one tile row that changed perceptibly"""
+    # Tiles with identical pixels are skipped without hashing
+    old_tiles = old_row.reshape(tile_size, columns, tile_size, 3).swapaxes(0, 1)
+    new_tiles = new_row.reshape(tile_size, columns, tile_size, 3).swapaxes(0, 1)
+    differs = np.flatnonzero((old_tiles != new_tiles).any(axis=(1, 2, 3)))
+    if not len(differs):
+        return differs
+    old_bits, old_mean = _tile_hashes(old_tiles[differs], tile_size)
+    new_bits, new_mean = _tile_hashes(new_tiles[differs], tile_size)
+    distance = (old_bits != new_bits).sum(axis=1)
+    color_shift = np.abs(old_mean - new_mean).max(axis=1)
+    return differs[(distance >= HASH_THRESHOLD) | (color_shift > MEAN_THRESHOLD)]
+
+
+def _merge_boxes(runs_by_row, tile_size, width, height):
+    """Merge changed tiles into boxes: horizontal runs, joined with overlapping runs below"""
+    boxes = []
+    growing = []  # [x0, x1, y0, y1] in tiles, ending at the previous row
+    for row, runs in runs_by_row:
+        extended = []
+        for start, end in runs:
+            for box in growing:
+                if box[3] == row and box[0] < end and start < box[1]:
+                    box[0], box[1], box[3] = min(box[0], start), max(box[1], end), row + 1
+                    if not any(other is box for other in extended):
+                        extended.append(box)
+                    break
+            else:
+                extended.append([start, end, row, row + 1])
+        boxes.extend(box for box in growing if not any(other is box for other in extended))
+        growing = extended
+    boxes.extend(growing)
+    return [Box(x0 * tile_size, y0 * tile_size,
+                min(x1 * tile_size, width) - x0 * tile_size,
+                min(y1 * tile_size, height) - y0 * tile_size)
+            for x0, x1, y0, y1 in boxes]
+
+
+def _runs(indices):
+    """Consecutive runs [start, end) in a sorted index array"""
+    runs = []
+    for index in indices.tolist():
+        if runs and runs[-1][1] == index:
+            runs[-1][1] = index + 1
+        else:
+            runs.append([index, index + 1])
+    return runs
+
+
+def _render_overlay(parts, scale, width, height, boxes, changed_percentage):
+    """Paste the scaled (image, top) parts onto a canvas and draw the boxes over them"""
+    canvas = Image.new('RGB', (max(1, round(width * scale)), max(1, round(height * scale))),
+                       (PAD_VALUE,) * 3)
+    for part, top in parts:
+        canvas.paste(part, (0, top))
+
+    shade = Image.new('RGBA', canvas.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(shade)
+    for box in boxes:
+        rectangle = [box.x * scale, box.y * scale,
+                     (box.x + box.width) * scale - 1, (box.y + box.height) * scale - 1]
+        draw.rectangle(rectangle, fill=(255, 0, 0, 50), outline=(255, 0, 0, 255), width=2)
+    label = f"{changed_percentage:.2f}% changed"
+    font = ImageFont.load_default()
+    draw.rectangle(draw.textbbox((4, 4), label, font=font), fill=(255, 255, 255, 220))
+    draw.text((4, 4), label, fill=(255, 0, 0, 255), font=font)
+    canvas = Image.alpha_composite(canvas.convert('RGBA'), shade)
+
+    buffer = io.BytesIO()
+    canvas.convert('RGB').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _peek(strips):
+    """First strip of an iterator (or None), and an iterator that still yields it"""
+    first = next(strips, None)
+    return first, (chain([first], strips) if first is not None else strips)
+
+
+def diff_screenshots(old_source, new_source, tile_size=TILE_SIZE, overlay=True,
+                     strip_height=STRIP_HEIGHT):
+    """Compare two screenshots tile by tile, streaming them in strips.
+
+    Sources are anything image_strips() accepts. Only a few strips of each
+    screenshot, plus the scaled-down overlay, are in memory at any time.
+    Returns a ScreenshotDiff with the percentage of the page area that
+    changed, the changed regions as boxes, and (if overlay is set) a PNG of
+    the new screenshot with those boxes drawn on it.
+    """
+    if tile_size % HASH_CELLS:
+        raise ValueError(f"tile_size must be a multiple of {HASH_CELLS}")
+    old_first, old_strips = _peek(image_strips(old_source, strip_height))
+    new_first, new_strips = _peek(image_strips(new_source, strip_height))
+    width = max(old_first.width if old_first else 0, new_first.width if new_first else 0)
+    if not width:
+        raise ValueError("Both screenshots are empty")
+    columns = -(-width // tile_size)
+    scale = min(1.0, OVERLAY_MAX_WIDTH / width)
+
+    overlay_parts = []
+    runs_by_row = []
+    changed = 0
+    changed_area = 0
+    height = 0
+    # Width of each tile column; the last one may be partial
+    column_widths = np.full(columns, tile_size)
+    column_widths[-1] = width - (columns - 1) * tile_size
+    rows = zip_longest(_tile_rows(old_strips, tile_size), _tile_rows(new_strips, tile_size))
+    for row, (old_row, new_row) in enumerate(rows):
+        row_height = max(len(old_row) if old_row is not None else 0,
+                         len(new_row) if new_row is not None else 0)
+        top = height
+        height += row_height
+        if old_row is None or new_row is None:
+            # Beyond the end of the shorter screenshot everything changed
+            indices = np.arange(columns)
+        else:
+            indices = _changed_tiles(_pad(old_row, tile_size, columns * tile_size),
+                                     _pad(new_row, tile_size, columns * tile_size),
+                                     tile_size, columns)
+        if len(indices):
+            changed += len(indices)
+            changed_area += int(column_widths[indices].sum()) * row_height
+            runs_by_row.append((row, _runs(indices)))
+        if overlay and new_row is not None:
+            part = Image.fromarray(np.ascontiguousarray(new_row))
+            # Each row goes where its full-size position scales to, so the
+            # rounding does not add up down the page and the boxes line up
+            scaled_top = round(top * scale)
+            if scale < 1:
+                scaled_height = round((top + part.height) * scale) - scaled_top
+                if not scaled_height:
+                    continue
+                part = part.resize((max(1, round(part.width * scale)), scaled_height))
+            overlay_parts.append((part, scaled_top))
+
+    total = columns * -(-height // tile_size)
+    boxes = _merge_boxes(runs_by_row, tile_size, width, height)
+    # Area-weighted, so partial tiles at the edges count for what they cover
+    changed_percentage = changed_area / (width * height) * 100 if height else 0.0
+    overlay_png = (_render_overlay(overlay_parts, scale, width, height, boxes, changed_percentage)
+                   if overlay else None)
+    return ScreenshotDiff(width, height, changed, total, changed_percentage, boxes, overlay_png)
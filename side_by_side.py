@@ -0,0 +1,174 @@
+from html import escape
+
+import line_diff
+
+DEFAULT_CONTEXT = 3
+HUNKS_PER_PAGE = 50
+
+# Collapsed runs up to this many lines are sent along, hidden until expanded;
+# longer ones are only counted
+EXPANDABLE_LINES = 200
+
+STYLE = """
+<style>
+    .side-by-side {
+        display: grid;
+        grid-template-columns: minmax(0, 1fr) minmax(0, 1fr);
+        column-gap: 20px;
+        font-family: monospace;
+        font-size: 12px;
+    }
+    .version-title {
+        font-weight: bold;
+        font-size: 16px;
+        margin-bottom: 10px;
+        padding-bottom: 5px;
+        border-bottom: 2px solid #333;
+    }
+    .cell {
+        border-left: 1px solid #ddd;
+        border-right: 1px solid #ddd;
+        background: white;
+    }
+    .line {
+        padding: 2px 5px;
+        margin: 1px 0;
+        white-space: pre-wrap;
+        word-wrap: break-word;
+    }
+    .line-number {
+        display: inline-block;
+        min-width: 4em;
+        color: #999;
+        user-select: none;
+    }
+    .unchanged {
+        background: white;
+    }
+    .changed {
+        background: #ffcccc;
+        border-left: 3px solid red;
+        font-weight: bold;
+    }
+    .added {
+        background: #ccffcc;
+        border-left: 3px solid green;
+    }
+    .removed {
+        background: #ffcccc;
+        border-left: 3px solid red;
+        text-decoration: line-through;
+    }
+    .stub {
+        grid-column: 1 / -1;
+        margin: 4px 0;
+        padding: 4px 8px;
+        background: #f0f2f6;
+        color: #555;
+    }
+    .stub summary {
+        cursor: pointer;
+    }
+    .no-changes {
+        padding: 10px;
+        color: #555;
+    }
+</style>
+"""
+
+
+class SideBySide:
+    """Side-by-side text diff rendered a page of hunks at a time.
+
+    Unchanged runs beyond each change's context collapse into stubs, and
+    short ones can be expanded in place. Both versions share one grid, so
+    every change sits level with its counterpart. A page's HTML grows with
+    the changes on it, not with the size of the texts.
+    """
+
+    def __init__(self, old_text, new_text, algorithm='patience', keys=None):
+        # keys: texts whose lines are matched in place of the shown ones, e.g. noise-masked copies
+        self.old_lines = old_text.splitlines()
+        self.new_lines = new_text.splitlines()
+        if keys is not None:
+            keys = (keys[0].splitlines(), keys[1].splitlines())
+        old_keys, new_keys = line_diff.matching_keys(self.old_lines, self.new_lines, keys)
+        self.opcodes = list(line_diff.iter_opcodes(old_keys, new_keys, algorithm))
+        self._hunks = {}  # context -> hunks
+
+    def hunks(self, context=DEFAULT_CONTEXT):
+        """Groups of opcodes with context lines around each change"""
+        hunks = self._hunks.get(context)
+        if hunks is None:
+            hunks = self._hunks[context] = list(line_diff.grouped_opcodes(self.opcodes, context))
+        return hunks
+
+    def page_count(self, context=DEFAULT_CONTEXT, hunks_per_page=HUNKS_PER_PAGE):
+        return max(1, -(-len(self.hunks(context)) // hunks_per_page))
+
+    def changed_lines(self):
+        """(lines removed, lines added)"""
+        removed = sum(i2 - i1 for tag, i1, i2, _, _ in self.opcodes if tag != 'equal')
+        added = sum(j2 - j1 for tag, _, _, j1, j2 in self.opcodes if tag != 'equal')
+        return removed, added
+
+    def _lines(self, lines, start, stop, css_class):
+        return ''.join(f'<div class="line {css_class}"><span class="line-number">{number + 1}</span>'
+                       f'{escape(lines[number])}</div>'
+                       for number in range(start, stop))
+
+    def _stub(self, i1, i2, j1, j2):
+        count = i2 - i1
+        if not count:
+            return ''
+        label = f"⋯ {count} unchanged line{'s' if count != 1 else ''}"
+        if count > EXPANDABLE_LINES:
+            return f'<div class="stub">{label}</div>'
+        return (f'<details class="stub"><summary>{label}</summary><div class="side-by-side">'
+                f'<div class="cell">{self._lines(self.old_lines, i1, i2, "unchanged")}</div>'
+                f'<div class="cell">{self._lines(self.new_lines, j1, j2, "unchanged")}</div>'
+                f'</div></details>')
+
+    def _row(self, tag, i1, i2, j1, j2):
+        if i1 == i2 and j1 == j2:
+            return ''
+        old_class, new_class = {
+            'equal': ('unchanged', 'unchanged'),
+            'replace': ('changed', 'changed'),
+            'delete': ('removed', None),
+            'insert': (None, 'added'),
+        }[tag]
+        old_cell = self._lines(self.old_lines, i1, i2, old_class) if old_class else ''
+        new_cell = self._lines(self.new_lines, j1, j2, new_class) if new_class else ''
+        return f'<div class="cell">{old_cell}</div><div class="cell">{new_cell}</div>'
+
+    def render(self, page=0, context=DEFAULT_CONTEXT, hunks_per_page=HUNKS_PER_PAGE):
+        """HTML of one page of hunks (out-of-range pages show the last one)"""
+        hunks = self.hunks(context)
+        parts = [STYLE, '<div class="side-by-side">',
+                 '<div class="version-title">📁 Saved Version</div>',
+                 '<div class="version-title">🆕 Current Version</div>']
+        if not hunks:
+            parts.append('<div class="stub no-changes">No text differences</div></div>')
+            return ''.join(parts)
+
+        page = min(max(page, 0), self.page_count(context, hunks_per_page) - 1)
+        first = page * hunks_per_page
+        # Where the hunk before this page ended
+        if first:
+            previous = hunks[first - 1][-1]
+            i, j = previous[2], previous[4]
+        else:
+            i = j = 0
+        for hunk in hunks[first:first + hunks_per_page]:
+            parts.append(self._stub(i, hunk[0][1], j, hunk[0][3]))
+            parts.extend(self._row(*opcode) for opcode in hunk)
+            i, j = hunk[-1][2], hunk[-1][4]
+        if first + hunks_per_page >= len(hunks):
+            parts.append(self._stub(i, len(self.old_lines), j, len(self.new_lines)))
+        parts.append('</div>')
+        return ''.join(parts)
+
+    def approx_size(self):
+        """Characters held by the two texts"""
+        return sum(len(line) for line in self.old_lines) + sum(len(line) for line in self.new_lines)
@@ -0,0 +1,125 @@
+import difflib
+import re
+import time
+from collections import Counter
+
+import line_diff
+
+# Inputs up to this many characters (both sides together) get an exact ratio.
+# SequenceMatcher is worst-case quadratic, so this is kept small.
+EXACT_SIZE_BUDGET = 20_000
+
+# Time allowed for matching lines and refining changed hunks character by
+# character; line matching that runs out of time falls back to token bags
+TIME_BUDGET = 0.5
+
+# Changed hunks larger than this (both sides together) are always estimated
+MAX_HUNK_SIZE = 5_000
+
+# Beyond this many lines even the line-level diff is skipped
+MAX_DIFF_LINES = 200_000
+
+TOKEN_RE = re.compile(r'\S+')
+
+
+def _result(ratio, exact, method):
+    return {'ratio': ratio, 'exact': exact, 'method': method}
+
+
+def sequence_similarity(a, b, **options):
+    """Exact difflib.SequenceMatcher ratio; worst-case quadratic"""
+    return _result(difflib.SequenceMatcher(None, a, b).ratio(), True, 'sequence')
+
+
+def _token_matches(a, b):
+    """Characters shared by the bags of whitespace-separated tokens of a and b,
+    and the number of non-whitespace characters on both sides"""
+    a_tokens = Counter(TOKEN_RE.findall(a))
+    b_tokens = Counter(TOKEN_RE.findall(b))
+    common = sum(len(token) * count for token, count in (a_tokens & b_tokens).items())
+    total = (sum(len(token) * count for token, count in a_tokens.items())
+             + sum(len(token) * count for token, count in b_tokens.items()))
+    return common, total
+
+
+def token_similarity(a, b, **options):
+    """Dice coefficient over token bags, weighted by token length; linear time"""
+    common, total = _token_matches(a, b)
+    if not total:
+        return _result(1.0 if a == b else 0.0, a == b, 'tokens')
+    return _result(2.0 * common / total, False, 'tokens')
+
+
+def line_similarity(a, b, time_budget=TIME_BUDGET, **options):
+    """Diff lines first, then refine the changed hunks until the time budget runs out.
+
+    Lines are matched with the streaming patience diff, and if that alone
+    exhausts the budget the result is token_similarity() instead. Unchanged
+    lines count as fully matched. Each changed hunk is compared character by
+    character while time remains and it is small enough, and by token bags
+    otherwise, so the total time stays bounded.
+    """
+    total = len(a) + len(b)
+    if not total:
+        return _result(1.0, True, 'lines')
+
+    a_lines = a.splitlines(keepends=True)
+    b_lines = b.splitlines(keepends=True)
+    if len(a_lines) + len(b_lines) > MAX_DIFF_LINES:
+        return token_similarity(a, b)
+
+    deadline = time.perf_counter() + time_budget
+    opcodes = []
+    for opcode in line_diff.iter_opcodes(a_lines, b_lines):
+        if time.perf_counter() > deadline:
+            return token_similarity(a, b)
+        opcodes.append(opcode)
+
+    matches = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            matches += sum(len(line) for line in a_lines[i1:i2])
+            continue
+        if tag != 'replace':
+            continue
+        old_hunk = ''.join(a_lines[i1:i2])
+        new_hunk = ''.join(b_lines[j1:j2])
+        if len(old_hunk) + len(new_hunk) <= MAX_HUNK_SIZE and time.perf_counter() < deadline:
+            hunk_matcher = difflib.SequenceMatcher(None, old_hunk, new_hunk, autojunk=False)
+            matches += sum(block.size for block in hunk_matcher.get_matching_blocks())
+        else:
+            # Scale the token overlap to the hunk's full size (whitespace included)
+            common, token_total = _token_matches(old_hunk, new_hunk)
+            if token_total:
+                matches += common * (len(old_hunk) + len(new_hunk)) / token_total
+
+    return _result(2.0 * matches / total, False, 'lines')
+
+
+def auto_similarity(a, b, size_budget=EXACT_SIZE_BUDGET, time_budget=TIME_BUDGET, **options):
+    """Exact ratio for small inputs, bounded-time estimate for large ones"""
+    if a == b:
+        return _result(1.0, True, 'identical')
+    if len(a) + len(b) <= size_budget:
+        return sequence_similarity(a, b)
+    return line_similarity(a, b, time_budget=time_budget)
+
+
+ENGINES = {
+    'auto': auto_similarity,
+    'sequence': sequence_similarity,
+    'lines': line_similarity,
+    'tokens': token_similarity,
+}
+
+
+def register_engine(name, func):
+    """Add a similarity engine: func(a, b, **options) -> {'ratio', 'exact', 'method'}"""
+    ENGINES[name] = func
+
+
+def similarity(a, b, engine='auto', **options):
+    """Similarity of two strings in [0, 1], and whether the figure is exact"""
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown similarity engine: {engine}")
+    return ENGINES[engine](a, b, **options)
@@ -0,0 +1,898 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib is always available
+    zstandard = None
+
+CATALOG_NAME = "catalog.db"
+
+# WAL lets readers run alongside a writer. It needs shared memory between
+# the processes using the catalog, so on network filesystems (NFS, SMB)
+# set 'delete' to fall back to the rollback journal and file locks.
+JOURNAL_MODE = 'wal'
+
+# Seconds a write waits for another process's transaction before failing
+BUSY_TIMEOUT = 30
+
+# Stored in the catalog's user_version once it is set up
+SCHEMA_VERSION = 1
+OBJECTS_DIR = "objects"
+PACKS_DIR = "packs"
+
+# Pack files start with PACK_MAGIC; each entry is the object's raw sha256,
+# its length and its stored bytes. The catalog records where the bytes start.
+PACK_MAGIC = b'DCPACK1\n'
+PACK_ENTRY = struct.Struct('>32sQ')
+
+# Pack files kept memory-mapped at once
+OPEN_PACKS = 64
+
+# Unused object files and packs younger than this are left for a later
+# collection: another process may have just written them and not yet
+# recorded them in the catalog
+GC_GRACE_SECONDS = 3600
+
+# A new full keyframe is written after this many deltas against the same one,
+# or when a delta would be larger than this fraction of a full copy.
+KEYFRAME_INTERVAL = 20
+MAX_DELTA_RATIO = 0.5
+
+# Number of decoded keyframes kept in memory for delta reconstruction
+KEYFRAME_CACHE_SIZE = 8
+
+# Files written by older versions of the app: <url_hash>_<timestamp>.html
+LEGACY_FILE_RE = re.compile(r'^([0-9a-f]{32})_(\d{8}_\d{6})\.html$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS urls (
+    url_hash TEXT PRIMARY KEY,
+    url TEXT,
+    latest_version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    url_hash TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    display_time TEXT NOT NULL,
+    filepath TEXT NOT NULL,
+    PRIMARY KEY (url_hash, version)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS objects (
+    hash TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    codec TEXT NOT NULL,
+    base_hash TEXT,
+    size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS objects_base ON objects (base_hash);
+CREATE TABLE IF NOT EXISTS version_stats (
+    url_hash TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    base_version INTEGER NOT NULL,
+    watch_selector TEXT,
+    change_percentage REAL NOT NULL,
+    text_change_percentage REAL NOT NULL,
+    lines_added INTEGER NOT NULL,
+    lines_removed INTEGER NOT NULL,
+    region_count INTEGER NOT NULL,
+    regions TEXT NOT NULL,
+    PRIMARY KEY (url_hash, version)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS text_postings (
+    url_hash TEXT NOT NULL,
+    term TEXT NOT NULL,
+    first_version INTEGER NOT NULL,
+    end_version INTEGER,
+    PRIMARY KEY (url_hash, term, first_version)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS text_postings_open ON text_postings (url_hash, term)
+    WHERE end_version IS NULL;
+"""
+
+# Columns added to existing tables after their first release
+MIGRATIONS = {
+    'snapshots': [('content_hash', 'TEXT'), ('etag', 'TEXT'), ('last_modified', 'TEXT')],
+    'urls': [('watch_selector', 'TEXT'), ('indexed_version', 'INTEGER NOT NULL DEFAULT 0')],
+    'objects': [('pack', 'TEXT'), ('pack_offset', 'INTEGER')],
+}
+
+
+def url_hash(url):
+    """Hash a URL the same way snapshot filenames do"""
+    return hashlib.md5(url.encode()).hexdigest()
+
+
+def content_hash(content):
+    """Content address of a snapshot"""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def write_atomic(path, data):
+    """Write a file through a temporary one, so readers see all of it or none of it"""
+    # Unique across processes and hosts sharing the directory
+    temp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(temp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+    except BaseException:
+        temp.unlink(missing_ok=True)
+        raise
+
+
+# Matches an object that can be read: it is recorded, and so is its keyframe
+READABLE_OBJECT = ("SELECT 1 FROM objects o WHERE hash = ? AND (base_hash IS NULL OR "
+                   "EXISTS (SELECT 1 FROM objects b WHERE b.hash = o.base_hash))")
+
+
+def format_display_time(timestamp):
+    """Turn a %Y%m%d_%H%M%S timestamp into the format shown in the UI"""
+    return datetime.strptime(timestamp, "%Y%m%d_%H%M%S").strftime("%Y-%m-%d %H:%M:%S")
+
+
+@contextmanager
+def _immediate(conn):
+    """Write transaction on an autocommit connection, holding the write lock from its start"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+class SnapshotCatalog:
+    """Persistent SQLite index of saved snapshots, keyed by url hash.
+
+    The database is opened lazily on first use, so creating a catalog is
+    free. Looking up the latest version of a URL is two primary-key lookups
+    and never touches the snapshot directory.
+
+    Any number of threads and processes, on any number of hosts sharing the
+    directory, may use one catalog. Each thread has its own connection and
+    reads take no lock; in WAL mode they never wait for writers either.
+    Writes take the database's write lock for their whole transaction, so
+    concurrent writers queue up instead of reusing version numbers.
+    """
+
+    def __init__(self, save_dir, journal_mode=None):
+        self.save_dir = Path(save_dir)
+        self.db_path = self.save_dir / CATALOG_NAME
+        self.journal_mode = journal_mode or JOURNAL_MODE
+        self._local = threading.local()
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """This thread's connection, opened on first use; the schema is set up once"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Transactions are begun explicitly, by _transaction()
+            conn = sqlite3.connect(str(self.db_path), timeout=BUSY_TIMEOUT, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            with self._lock:
+                if not self._ready:
+                    self._setup(conn)
+                    self._ready = True
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _immediate(self._connect())
+
+    def _setup(self, conn):
+        """Create the schema, add newer columns and import legacy files, once per database"""
+        try:
+            conn.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+        except sqlite3.OperationalError:
+            # Switching modes needs a moment without other connections; the
+            # mode is stored in the database, so a later start will switch it
+            pass
+        conn.executescript(SCHEMA)
+        with _immediate(conn):
+            self._migrate(conn)
+            if not conn.execute("PRAGMA user_version").fetchone()[0]:
+                # Catalogs from before user_version was set imported their legacy files when created
+                if conn.execute("SELECT 1 FROM snapshots LIMIT 1").fetchone() is None:
+                    self._import_legacy_files(conn)
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _migrate(self, conn):
+        """Add columns introduced after a catalog was created"""
+        for table, columns in MIGRATIONS.items():
+            existing = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for name, definition in columns:
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+    def _import_legacy_files(self, conn):
+        """Index snapshots that were saved before the catalog existed"""
+        found = {}
+        for path in self.save_dir.iterdir():
+            match = LEGACY_FILE_RE.match(path.name)
+            if match:
+                found.setdefault(match.group(1), []).append((match.group(2), path))
+
+        for key, files in found.items():
+            files.sort()
+            conn.executemany(
+                "INSERT INTO snapshots (url_hash, version, timestamp, display_time, filepath) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(key, version, timestamp, format_display_time(timestamp), str(path))
+                 for version, (timestamp, path) in enumerate(files, start=1)]
+            )
+            conn.execute(
+                "INSERT INTO urls (url_hash, url, latest_version) VALUES (?, NULL, ?)",
+                (key, len(files))
+            )
+
+    def _to_metadata(self, row, url):
+        return {
+            'url': url,
+            'version': row['version'],
+            'timestamp': row['timestamp'],
+            'filepath': row['filepath'],
+            'display_time': row['display_time'],
+            'content_hash': row['content_hash'],
+            'etag': row['etag'],
+            'last_modified': row['last_modified']
+        }
+
+    def add(self, url, filepath, timestamp, display_time, content_hash=None, validators=None):
+        """Record a new snapshot and return its metadata.
+
+        validators holds the HTTP 'etag' and 'last_modified' values the
+        snapshot was served with, used for conditional re-fetching. Raises
+        KeyError if the object stored under content_hash, or its keyframe,
+        is not in the catalog (e.g. collected since it was stored).
+        """
+        validators = validators or {}
+        key = url_hash(url)
+        with self._transaction() as conn:
+            if content_hash and conn.execute(READABLE_OBJECT, (content_hash,)).fetchone() is None:
+                raise KeyError(content_hash)
+            row = conn.execute(
+                "SELECT latest_version FROM urls WHERE url_hash = ?", (key,)
+            ).fetchone()
+            version = (row['latest_version'] if row else 0) + 1
+            conn.execute(
+                "INSERT INTO snapshots (url_hash, version, timestamp, display_time, "
+                "filepath, content_hash, etag, last_modified) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, version, timestamp, display_time, str(filepath), content_hash,
+                 validators.get('etag'), validators.get('last_modified'))
+            )
+            conn.execute(
+                "INSERT INTO urls (url_hash, url, latest_version) VALUES (?, ?, ?) "
+                "ON CONFLICT(url_hash) DO UPDATE SET url = excluded.url, "
+                "latest_version = excluded.latest_version",
+                (key, url, version)
+            )
+        return {
+            'url': url,
+            'version': version,
+            'timestamp': timestamp,
+            'filepath': str(filepath),
+            'display_time': display_time,
+            'content_hash': content_hash,
+            'etag': validators.get('etag'),
+            'last_modified': validators.get('last_modified')
+        }
+
+    def latest(self, url):
+        """Return metadata for the most recent snapshot of a URL, or None"""
+        row = self._connect().execute(
+            "SELECT s.* FROM urls u JOIN snapshots s "
+            "ON s.url_hash = u.url_hash AND s.version = u.latest_version "
+            "WHERE u.url_hash = ?",
+            (url_hash(url),)
+        ).fetchone()
+        return self._to_metadata(row, url) if row else None
+
+    def count(self, url):
+        """Number of saved versions of a URL"""
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM snapshots WHERE url_hash = ?", (url_hash(url),)
+        ).fetchone()
+        return row[0]
+
+    def watch_selector(self, url):
+        """CSS selector or XPath of the region watched on a URL, or None for the whole page"""
+        row = self._connect().execute(
+            "SELECT watch_selector FROM urls WHERE url_hash = ?", (url_hash(url),)
+        ).fetchone()
+        return row['watch_selector'] if row else None
+
+    def set_watch_selector(self, url, selector):
+        """Watch only the region matching selector (None for the whole page)"""
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO urls (url_hash, url, watch_selector) VALUES (?, ?, ?) "
+                "ON CONFLICT(url_hash) DO UPDATE SET url = excluded.url, "
+                "watch_selector = excluded.watch_selector",
+                (url_hash(url), url, selector or None)
+            )
+
+    def versions(self, url, limit=None, newest_first=False):
+        """List snapshot metadata for a URL, oldest first by default"""
+        query = "SELECT * FROM snapshots WHERE url_hash = ? ORDER BY version"
+        if newest_first:
+            query += " DESC"
+        params = [url_hash(url)]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        rows = self._connect().execute(query, params).fetchall()
+        return [self._to_metadata(row, url) for row in rows]
+
+    def version_stats(self, url):
+        """Stored change stats of each version against the one before it, by version"""
+        rows = self._connect().execute(
+            "SELECT * FROM version_stats WHERE url_hash = ?", (url_hash(url),)
+        ).fetchall()
+        stats = {}
+        for row in rows:
+            record = dict(row)
+            del record['url_hash']
+            record['regions'] = json.loads(record['regions'])
+            stats[record['version']] = record
+        return stats
+
+    def set_version_stats(self, url, version, base_version, stats, watch_selector=None):
+        """Store the change stats of a version against base_version.
+
+        stats holds 'change_percentage', 'text_change_percentage',
+        'lines_added', 'lines_removed', 'region_count' and 'regions' (a list
+        of [old_start, old_end, new_start, new_end] line ranges).
+        """
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO version_stats (url_hash, version, base_version, "
+                "watch_selector, change_percentage, text_change_percentage, lines_added, "
+                "lines_removed, region_count, regions) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url_hash(url), version, base_version, watch_selector or None,
+                 stats['change_percentage'], stats['text_change_percentage'],
+                 stats['lines_added'], stats['lines_removed'], stats['region_count'],
+                 json.dumps(stats['regions'], separators=(',', ':')))
+            )
+
+    def version(self, url, version):
+        """Metadata of one saved version of a URL, or None"""
+        row = self._connect().execute(
+            "SELECT * FROM snapshots WHERE url_hash = ? AND version = ?", (url_hash(url), version)
+        ).fetchone()
+        return self._to_metadata(row, url) if row else None
+
+    def version_numbers(self, url):
+        """Numbers of the saved versions of a URL, in order"""
+        rows = self._connect().execute(
+            "SELECT version FROM snapshots WHERE url_hash = ? ORDER BY version", (url_hash(url),)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def indexed_version(self, url):
+        """Last version of a URL whose text is in the text index (0 for none)"""
+        row = self._connect().execute(
+            "SELECT indexed_version FROM urls WHERE url_hash = ?", (url_hash(url),)
+        ).fetchone()
+        return row['indexed_version'] if row else 0
+
+    def open_terms(self, url):
+        """Terms in the text of the last indexed version of a URL"""
+        rows = self._connect().execute(
+            "SELECT term FROM text_postings WHERE url_hash = ? AND end_version IS NULL",
+            (url_hash(url),)
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def index_version(self, url, version, previous_version, added, removed):
+        """Record the terms a version's text gained and lost since previous_version.
+
+        A term's postings are version ranges: it is present from
+        first_version up to, not including, end_version (NULL while it is
+        still present). Returns False without changing anything when
+        previous_version is no longer the last indexed one, i.e. another
+        indexer got there first.
+        """
+        key = url_hash(url)
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE urls SET indexed_version = ? WHERE url_hash = ? AND indexed_version = ?",
+                (version, key, previous_version)
+            ).rowcount
+            if not updated:
+                return False
+            conn.executemany(
+                "UPDATE text_postings SET end_version = ? "
+                "WHERE url_hash = ? AND term = ? AND end_version IS NULL",
+                [(version, key, term) for term in removed]
+            )
+            conn.executemany(
+                "INSERT INTO text_postings (url_hash, term, first_version) VALUES (?, ?, ?)",
+                [(key, term, version) for term in added]
+            )
+        return True
+
+    def postings(self, url, terms):
+        """(first_version, end_version) ranges of each term, in version order"""
+        terms = list(terms)
+        rows = self._connect().execute(
+            "SELECT term, first_version, end_version FROM text_postings "
+            f"WHERE url_hash = ? AND term IN ({', '.join('?' * len(terms))}) ORDER BY first_version",
+            [url_hash(url)] + terms
+        ).fetchall()
+        postings = {term: [] for term in terms}
+        for row in rows:
+            postings[row['term']].append((row['first_version'], row['end_version']))
+        return postings
+
+    def urls(self):
+        """Every URL with saved versions (None for legacy ones never seen since)"""
+        rows = self._connect().execute("SELECT url_hash, url FROM urls").fetchall()
+        return [(row['url_hash'], row['url']) for row in rows]
+
+    def delete_versions(self, url, versions):
+        """Forget saved versions of a URL; their objects are left to delete_unreferenced_objects().
+
+        The latest version is never deleted.
+        """
+        key = url_hash(url)
+        with self._transaction() as conn:
+            latest = conn.execute(
+                "SELECT latest_version FROM urls WHERE url_hash = ?", (key,)
+            ).fetchone()
+            versions = [version for version in versions
+                        if latest is None or version != latest['latest_version']]
+            for table in ('snapshots', 'version_stats'):
+                conn.executemany(f"DELETE FROM {table} WHERE url_hash = ? AND version = ?",
+                                 [(key, version) for version in versions])
+        return versions
+
+    def set_content_hash(self, url, version, digest, filepath):
+        """Point a legacy snapshot at the object its content is now stored as"""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE snapshots SET content_hash = ?, filepath = ? WHERE url_hash = ? AND version = ?",
+                (digest, str(filepath), url_hash(url), version)
+            )
+
+    def url_objects(self, url):
+        """Records of the objects a URL's versions need: their own and their keyframes"""
+        rows = self._connect().execute(
+            "SELECT * FROM objects WHERE hash IN ("
+            "SELECT content_hash FROM snapshots WHERE url_hash = ? "
+            "UNION SELECT o.base_hash FROM snapshots s JOIN objects o ON o.hash = s.content_hash "
+            "WHERE s.url_hash = ?)",
+            (url_hash(url), url_hash(url))
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def delete_unreferenced_objects(self):
+        """Drop records of objects no snapshot needs any more; returns them"""
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT * FROM objects WHERE hash NOT IN ("
+                "SELECT content_hash FROM snapshots WHERE content_hash IS NOT NULL "
+                "UNION SELECT o.base_hash FROM snapshots s JOIN objects o ON o.hash = s.content_hash "
+                "WHERE o.base_hash IS NOT NULL)"
+            ).fetchall()
+            conn.executemany("DELETE FROM objects WHERE hash = ?", [(row['hash'],) for row in rows])
+        return [dict(row) for row in rows]
+
+    def set_object_locations(self, locations):
+        """Record where objects are stored: (hash, pack name or None, offset) tuples"""
+        with self._transaction() as conn:
+            conn.executemany("UPDATE objects SET pack = ?, pack_offset = ? WHERE hash = ?",
+                             [(pack, offset, digest) for digest, pack, offset in locations])
+
+    def loose_objects(self):
+        """Hashes of the objects stored in files of their own"""
+        rows = self._connect().execute("SELECT hash FROM objects WHERE pack IS NULL").fetchall()
+        return {row[0] for row in rows}
+
+    def packs_in_use(self):
+        rows = self._connect().execute(
+            "SELECT DISTINCT pack FROM objects WHERE pack IS NOT NULL").fetchall()
+        return {row['pack'] for row in rows}
+
+    def get_object(self, digest):
+        """Return the stored-object record for a content hash, or None"""
+        row = self._connect().execute(
+            "SELECT * FROM objects WHERE hash = ?", (digest,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def has_object(self, digest):
+        """Whether an object is recorded and can be read"""
+        return self._connect().execute(READABLE_OBJECT, (digest,)).fetchone() is not None
+
+    def add_object(self, digest, kind, codec, base_hash, size, stored_size, write=None):
+        """Record a stored object unless it already is; returns whether it was added.
+
+        write, if given, stores the object's bytes. It is called inside the
+        transaction, so no other process can write another encoding of the
+        same content in between. Raises KeyError if the keyframe base_hash
+        is not recorded.
+        """
+        with self._transaction() as conn:
+            if conn.execute(READABLE_OBJECT, (digest,)).fetchone() is not None:
+                return False
+            if base_hash and conn.execute(
+                "SELECT 1 FROM objects WHERE hash = ?", (base_hash,)
+            ).fetchone() is None:
+                raise KeyError(base_hash)
+            if write:
+                write()
+            # Replaces a record left without its keyframe
+            conn.execute(
+                "INSERT OR REPLACE INTO objects (hash, kind, codec, base_hash, size, stored_size) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (digest, kind, codec, base_hash, size, stored_size)
+            )
+        return True
+
+    def delta_count(self, url, base_hash):
+        """Number of versions of a URL stored as deltas against a keyframe"""
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM snapshots s JOIN objects o ON o.hash = s.content_hash "
+            "WHERE s.url_hash = ? AND o.base_hash = ?",
+            (url_hash(url), base_hash)
+        ).fetchone()
+        return row[0]
+
+
+def compress(data):
+    """Compress bytes with the best available codec"""
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=10).compress(data)
+    return 'zlib', zlib.compress(data, 6)
+
+
+def decompress(codec, data):
+    """Inverse of compress()"""
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Snapshot was stored with zstd but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def make_delta(base_lines, new_lines):
+    """Encode new_lines as copy ranges from base_lines plus literal text.
+
+    Ops are [start, length] for a run copied from the base, or a string of
+    literal text. Matching is greedy on whole lines, preferring to continue
+    the previous copy, so encoding is linear in the number of lines.
+    """
+    positions = {}
+    for i, line in enumerate(base_lines):
+        positions.setdefault(line, []).append(i)
+
+    ops = []
+    literal = []
+    next_base = -1
+    j = 0
+    while j < len(new_lines):
+        candidates = positions.get(new_lines[j])
+        if not candidates:
+            literal.append(new_lines[j])
+            j += 1
+            continue
+
+        if 0 <= next_base < len(base_lines) and base_lines[next_base] == new_lines[j]:
+            candidates = [next_base]
+        best_start, best_len = candidates[0], 0
+        for start in candidates[:16]:
+            length = 0
+            while (start + length < len(base_lines) and j + length < len(new_lines)
+                   and base_lines[start + length] == new_lines[j + length]):
+                length += 1
+            if length > best_len:
+                best_start, best_len = start, length
+
+        if literal:
+            ops.append(''.join(literal))
+            literal = []
+        if ops and isinstance(ops[-1], list) and ops[-1][0] + ops[-1][1] == best_start:
+            ops[-1][1] += best_len
+        else:
+            ops.append([best_start, best_len])
+        next_base = best_start + best_len
+        j += best_len
+
+    if literal:
+        ops.append(''.join(literal))
+    return ops
+
+
+def apply_delta(base_lines, ops):
+    """Rebuild text from base_lines and make_delta() ops"""
+    parts = []
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            start, length = op
+            parts.extend(base_lines[start:start + length])
+    return ''.join(parts)
+
+
+class SnapshotStore:
+    """Content-addressed, compressed snapshot storage.
+
+    Identical snapshots are stored once. Each URL gets a full keyframe
+    followed by line deltas against that keyframe, so reading any version
+    costs at most two decompressions. New objects are written as loose
+    files; compact() moves a URL's objects into one pack file, which is
+    read through a memory map.
+    """
+
+    def __init__(self, save_dir):
+        self.save_dir = Path(save_dir)
+        self.objects_dir = self.save_dir / OBJECTS_DIR
+        self.packs_dir = self.save_dir / PACKS_DIR
+        self.catalog = SnapshotCatalog(self.save_dir)
+        self._keyframes = OrderedDict()
+        self._keyframe_lock = threading.Lock()
+        self._packs = OrderedDict()  # pack name -> mmap
+        self._pack_lock = threading.Lock()
+        self.gc_grace_seconds = GC_GRACE_SECONDS
+
+    def object_path(self, digest):
+        return self.objects_dir / digest[:2] / digest
+
+    def _open_pack(self, name):
+        with self._pack_lock:
+            pack = self._packs.get(name)
+            if pack is not None:
+                self._packs.move_to_end(name)
+                return pack
+            with open(self.packs_dir / name, 'rb') as f:
+                pack = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._packs[name] = pack
+            # Evicted maps are closed once the last reader lets go of them
+            while len(self._packs) > OPEN_PACKS:
+                self._packs.popitem(last=False)
+            return pack
+
+    def _load(self, digest):
+        """Decompressed bytes of a stored object, read from its pack or its own file"""
+        # A concurrent compact() may move the object between the lookup and the read
+        for attempt in (1, 2):
+            record = self.catalog.get_object(digest)
+            if record is None:
+                raise KeyError(digest)
+            try:
+                if record['pack']:
+                    start = record['pack_offset']
+                    # Decompressed straight from the mapped pages, without copying them first
+                    with memoryview(self._open_pack(record['pack'])) as pack, \
+                            pack[start:start + record['stored_size']] as data:
+                        return record, decompress(record['codec'], data)
+                return record, decompress(record['codec'], self.object_path(digest).read_bytes())
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+
+    def _write_object(self, digest, kind, codec, data, size, base_hash=None):
+        path = self.object_path(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.catalog.add_object(digest, kind, codec, base_hash, size, len(data),
+                                write=lambda: write_atomic(path, data))
+
+    def _keyframe_lines(self, digest):
+        """Decoded keyframe split into lines, cached across reads"""
+        with self._keyframe_lock:
+            if digest in self._keyframes:
+                self._keyframes.move_to_end(digest)
+                return self._keyframes[digest]
+        _, data = self._load(digest)
+        lines = data.decode('utf-8').splitlines(keepends=True)
+        with self._keyframe_lock:
+            self._keyframes[digest] = lines
+            while len(self._keyframes) > KEYFRAME_CACHE_SIZE:
+                self._keyframes.popitem(last=False)
+        return lines
+
+    def _current_keyframe(self, url):
+        """Keyframe the next version of a URL may be delta-encoded against"""
+        latest = self.catalog.latest(url)
+        if not latest or not latest['content_hash']:
+            return None
+        record = self.catalog.get_object(latest['content_hash'])
+        if record is None:
+            return None
+        if record['kind'] == 'full':
+            return latest['content_hash']
+        return record['base_hash']
+
+    def put(self, url, content, digest=None, raw=None):
+        """Store content if it is not stored yet and return its hash.
+
+        digest and raw, the content's hash and UTF-8 bytes, are computed
+        when not given.
+        """
+        digest = digest or content_hash(content)
+        if self.catalog.has_object(digest):
+            return digest
+
+        if raw is None:
+            raw = content.encode('utf-8')
+        codec, data = compress(raw)
+
+        base_hash = self._current_keyframe(url)
+        if base_hash and self.catalog.delta_count(url, base_hash) < KEYFRAME_INTERVAL:
+            try:
+                base_lines = self._keyframe_lines(base_hash)
+                ops = make_delta(base_lines, content.splitlines(keepends=True))
+                delta_codec, delta = compress(json.dumps(ops, separators=(',', ':')).encode('utf-8'))
+                if len(delta) <= len(data) * MAX_DELTA_RATIO:
+                    self._write_object(digest, 'delta', delta_codec, delta, len(raw), base_hash)
+                    return digest
+            except KeyError:
+                # The keyframe was collected since it was looked up; a full copy is stored instead
+                pass
+
+        self._write_object(digest, 'full', codec, data, len(raw))
+        return digest
+
+    def get(self, digest):
+        """Reconstruct the content stored under a hash"""
+        record = self.catalog.get_object(digest)
+        if record is None:
+            raise KeyError(digest)
+        if record['kind'] == 'full':
+            return ''.join(self._keyframe_lines(digest))
+        record, data = self._load(digest)
+        return apply_delta(self._keyframe_lines(record['base_hash']), json.loads(data))
+
+    def save(self, url, content, timestamp, display_time, validators=None, digest=None, raw=None):
+        """Store a new version of a URL and return its metadata"""
+        for attempt in (1, 2):
+            digest = self.put(url, content, digest, raw)
+            try:
+                return self.catalog.add(url, self.object_path(digest), timestamp, display_time,
+                                        content_hash=digest, validators=validators)
+            except KeyError:
+                # A concurrent collect_garbage() dropped the object between put() and add()
+                if attempt == 2:
+                    raise
+
+    def read(self, metadata):
+        """Load the content of a snapshot described by catalog metadata"""
+        if metadata.get('content_hash'):
+            return self.get(metadata['content_hash'])
+        # Snapshot saved before the object store existed
+        with open(metadata['filepath'], 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def migrate_legacy(self, url):
+        """Move a URL's snapshots saved as plain files before the object store into it"""
+        migrated = 0
+        for metadata in self.catalog.versions(url):
+            if metadata['content_hash']:
+                continue
+            path = Path(metadata['filepath'])
+            with open(path, 'r', encoding='utf-8') as f:
+                digest = self.put(url, f.read())
+            self.catalog.set_content_hash(url, metadata['version'], digest, self.object_path(digest))
+            path.unlink(missing_ok=True)
+            migrated += 1
+        return migrated
+
+    def compact(self, url):
+        """Rewrite a URL's objects, loose or packed, into one new pack file.
+
+        Objects already packed for another URL stay where they are. Returns
+        the number of objects packed.
+        """
+        prefix = f"{url_hash(url)}-"
+        records = [record for record in self.catalog.url_objects(url)
+                   if record['pack'] is None or record['pack'].startswith(prefix)]
+        if not records:
+            return 0
+        self.packs_dir.mkdir(parents=True, exist_ok=True)
+        name = f"{prefix}{time.time_ns():x}.pack"
+        temp = self.packs_dir / f".{name}.{uuid.uuid4().hex}.tmp"
+        locations = []
+        try:
+            with open(temp, 'wb') as f:
+                f.write(PACK_MAGIC)
+                for record in records:
+                    f.write(PACK_ENTRY.pack(bytes.fromhex(record['hash']), record['stored_size']))
+                    locations.append((record['hash'], name, f.tell()))
+                    if record['pack']:
+                        start = record['pack_offset']
+                        with memoryview(self._open_pack(record['pack'])) as pack:
+                            f.write(pack[start:start + record['stored_size']])
+                    else:
+                        f.write(self.object_path(record['hash']).read_bytes())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, self.packs_dir / name)
+        except BaseException:
+            temp.unlink(missing_ok=True)
+            raise
+        self.catalog.set_object_locations(locations)
+
+        # Nothing reads the loose files or the previous packs any more. The
+        # packs this call superseded go at once; the grace period only
+        # protects packs that other processes may have just written.
+        superseded = set()
+        for record in records:
+            if record['pack'] is None:
+                self.object_path(record['hash']).unlink(missing_ok=True)
+            else:
+                superseded.add(record['pack'])
+        for pack in superseded - self.catalog.packs_in_use():
+            self._remove_pack(pack)
+        self._remove_unused_packs()
+        return len(records)
+
+    def collect_garbage(self):
+        """Delete objects no saved version needs; returns (objects, stored bytes) freed"""
+        records = self.catalog.delete_unreferenced_objects()
+        self._remove_unused_files()
+        with self._keyframe_lock:
+            for record in records:
+                self._keyframes.pop(record['hash'], None)
+        # Dead entries in a pack are dropped when its URL is compacted again
+        self._remove_unused_packs()
+        return len(records), sum(record['stored_size'] for record in records)
+
+    def _is_recent(self, path, since):
+        """Whether a file was written after, or less than gc_grace_seconds before, since"""
+        try:
+            return path.stat().st_mtime > since - self.gc_grace_seconds
+        except FileNotFoundError:
+            return False
+
+    def _remove_unused_files(self):
+        """Delete loose object files the catalog does not point to, and abandoned temporary files"""
+        if not self.objects_dir.exists():
+            return
+        # Files written after the catalog was read are all recent, however long this takes
+        started = time.time()
+        loose = self.catalog.loose_objects()
+        for path in self.objects_dir.glob('*/*'):
+            # A recent file may be an object a concurrent save has not recorded yet
+            if path.name not in loose and not self._is_recent(path, started):
+                path.unlink(missing_ok=True)
+
+    def _remove_unused_packs(self):
+        if not self.packs_dir.exists():
+            return
+        started = time.time()
+        in_use = self.catalog.packs_in_use()
+        for path in self.packs_dir.iterdir():
+            # A recent pack may be one a concurrent compact() has not recorded yet
+            if path.name not in in_use and not self._is_recent(path, started):
+                self._remove_pack(path.name)
+
+    def _remove_pack(self, name):
+        with self._pack_lock:
+            self._packs.pop(name, None)
+        try:
+            (self.packs_dir / name).unlink()
+        except OSError:
+            # Already gone, or still mapped by a reader on a platform that refuses to delete it
+            pass
@@ -1,19 +1,44 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
+import os
+import random
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.utils import parsedate_to_datetime
 
 API_KEY = "SPDdJ_kP7zKiKjX806J_CQ"
 
-MATCH_URL = "https://api.apollo.io/api/v1/people/match"
-REVEAL_URL = "https://api.apollo.io/api/v1/people/reveal"
+# Point at a local mock of the two endpoints with APOLLO_API_BASE=http://127.0.0.1:8000
+API_BASE = os.environ.get("APOLLO_API_BASE", "https://api.apollo.io")
+
+MATCH_URL = f"{API_BASE}/api/v1/people/match"
+REVEAL_URL = f"{API_BASE}/api/v1/people/reveal"
 
 headers = {
     "Content-Type": "application/json",
     "x-api-key": API_KEY
 }
 
+# Requests per minute allowed by the API plan, shared by every user of the
+# app, and how many may go out back to back after a quiet spell
+REQUESTS_PER_MINUTE = 200
+BURST = 10
+
+# Matches in flight at once
+WORKERS = 8
+
+# 429 and 5xx responses (and connection errors) are retried with
+# exponential backoff, or after the server's Retry-After when it sends one
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60
+MAX_RETRY_AFTER = 600
+REQUEST_TIMEOUT = 30
+
 st.set_page_config(page_title="Apollo Enrichment", layout="wide")
 
 st.title("Apollo LinkedIn Enrichment Tool")
@@ -26,33 +51,160 @@ linkedin_input = st.text_area(
 start = st.button("Match Profiles")
 
 
+class TokenBucket:
+    """Thread-safe token bucket: rate tokens per second, holding at most burst"""
+
+    def __init__(self, rate, burst):
+
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+
+        while True:
+
+            with self.lock:
+
+                now = time.monotonic()
+
+                if now >= self.paused_until:
+
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+
+                    wait = (1 - self.tokens) / self.rate
+
+                else:
+                    wait = self.paused_until - now
+
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Send nothing for the next seconds, e.g. after a 429"""
+
+        with self.lock:
+
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.updated = self.paused_until
+
+
+@st.cache_resource
+def get_session():
+    """HTTP session shared by all workers, keeping connections to the API open"""
+
+    session = requests.Session()
+    session.headers.update(headers)
+
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=WORKERS)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+@st.cache_resource
+def get_limiter():
+    """Rate limiter shared by every session of the app, so together they stay within the quota"""
+
+    return TokenBucket(REQUESTS_PER_MINUTE / 60, BURST)
+
+
 def is_valid(url):
     pattern = r"^https:\/\/(www\.)?linkedin\.com\/in\/"
     return re.match(pattern, url)
 
 
-def match_person(linkedin):
+def retry_after(response):
+    """Seconds the server asked us to wait, or None"""
+
+    value = response.headers.get("Retry-After")
+
+    if not value:
+        return None
+
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+
+    return min(max(seconds, 0), MAX_RETRY_AFTER)
+
+
+def backoff(attempt):
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1)
+
+
+def post(session, limiter, url, payload):
+    """POST within the rate limit, retrying throttled and failed requests"""
+
+    for attempt in range(MAX_RETRIES + 1):
+
+        limiter.acquire()
+
+        try:
+            r = session.post(url, json=payload, timeout=REQUEST_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(backoff(attempt))
+            continue
+
+        if r.status_code != 429 and r.status_code < 500:
+            return r
+
+        if attempt == MAX_RETRIES:
+            return r
+
+        delay = retry_after(r)
+
+        if delay is None:
+            delay = backoff(attempt)
+
+        if r.status_code == 429:
+            # Over the quota: every worker waits, not just this one
+            limiter.pause(delay)
+        else:
+            time.sleep(delay)
+
+
+def match_person(linkedin, session, limiter):
 
     payload = {
         "linkedin_url": linkedin
     }
 
-    r = requests.post(MATCH_URL, headers=headers, json=payload)
+    r = post(session, limiter, MATCH_URL, payload)
 
     if r.status_code == 200:
         return r.json()
 
+    if r.status_code == 429 or r.status_code >= 500:
+        r.raise_for_status()
+
     return None
 
 
-def reveal_phone(person_id):
+def reveal_phone(person_id, session, limiter):
 
     payload = {
         "id": person_id,
         "reveal_phone_number": True
     }
 
-    r = requests.post(REVEAL_URL, headers=headers, json=payload)
+    r = post(session, limiter, REVEAL_URL, payload)
 
     if r.status_code == 200:
 
@@ -66,42 +218,82 @@ def reveal_phone(person_id):
     return None
 
 
+def match_all(urls, session, limiter, on_result=None):
+    """Match LinkedIn URLs concurrently.
+
+    Returns the result rows in input order and the (url, error) pairs that
+    failed. on_result(done, total, matched) is called after each URL.
+    """
+
+    rows = {}
+    failed = []
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+
+        futures = {pool.submit(match_person, url, session, limiter): (i, url) for i, url in enumerate(urls)}
+
+        for done, future in enumerate(as_completed(futures), start=1):
+
+            i, url = futures[future]
+
+            try:
+                data = future.result()
+            except requests.RequestException as e:
+                failed.append((url, str(e)))
+                data = None
+
+            if data and "person" in data:
+
+                p = data["person"]
+
+                rows[i] = {
+                    "person_id": p.get("id"),
+                    "LinkedIn": url,
+                    "Name": p.get("name"),
+                    "Title": p.get("title"),
+                    "Company": (p.get("organization") or {}).get("name"),
+                    "Email": p.get("email"),
+                    "Phone": ""
+                }
+
+            if on_result:
+                on_result(done, len(urls), len(rows))
+
+    return [rows[i] for i in sorted(rows)], failed
+
+
 # --------------------
 # MATCH PROFILES
 # --------------------
 
 if start:
 
-    urls = [u.strip() for u in linkedin_input.split("\n") if u.strip()]
+    lines = [u.strip() for u in linkedin_input.split("\n") if u.strip()]
 
-    results = []
+    urls = [u for u in lines if is_valid(u)]
 
-    progress = st.progress(0)
+    progress = st.progress(0.0)
 
-    for i, url in enumerate(urls):
+    started = time.monotonic()
 
-        if not is_valid(url):
-            continue
+    def show_progress(done, total, matched):
 
-        data = match_person(url)
+        elapsed = time.monotonic() - started
+        rate = f" · {done / elapsed:.1f} per second" if elapsed > 0 else ""
 
-        if data and "person" in data:
+        progress.progress(done / total, text=f"{done} / {total} checked · {matched} matched{rate}")
 
-            p = data["person"]
+    results, failed = match_all(urls, get_session(), get_limiter(), show_progress) if urls else ([], [])
 
-            results.append({
-                "person_id": p.get("id"),
-                "LinkedIn": url,
-                "Name": p.get("name"),
-                "Title": p.get("title"),
-                "Company": p.get("organization", {}).get("name"),
-                "Email": p.get("email"),
-                "Phone": ""
-            })
+    progress.progress(1.0, text=f"{len(results)} of {len(urls)} matched in {time.monotonic() - started:.0f} s")
 
-        progress.progress((i + 1) / len(urls))
+    if len(lines) > len(urls):
+        st.caption(f"Skipped {len(lines) - len(urls)} of the pasted lines: not LinkedIn profile URLs")
 
-        time.sleep(0.7)
+    if failed:
+        st.warning(f"{len(failed)} URLs failed after {MAX_RETRIES} retries")
+        with st.expander("Failed URLs"):
+            st.dataframe(pd.DataFrame(failed, columns=["LinkedIn", "Error"]), hide_index=True)
 
     df = pd.DataFrame(results)
 
@@ -127,7 +319,7 @@ if "df" in st.session_state:
 
         if col5.button("Reveal Phone", key=i):
 
-            phone = reveal_phone(row["person_id"])
+            phone = reveal_phone(row["person_id"], get_session(), get_limiter())
 
             df.loc[i, "Phone"] = phone
 
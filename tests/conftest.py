@@ -0,0 +1,125 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+# The app's modules live at the top of the repository
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.owner._handle(self)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalServer:
+    """A threaded HTTP server on 127.0.0.1 that answers as each test sets up.
+
+    Every request is recorded in requests as (method, path, headers, body,
+    time.monotonic(), client address) for the test to inspect.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self._routes = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.owner = self
+        # Polled often, so that close() does not hold up every test for half a second
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.01,), daemon=True)
+        self._thread.start()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self._server.server_port}{path}"
+
+    def respond(self, path, *responses):
+        """Answer path with (status, headers, body) responses in turn, repeating the last"""
+        queue = list(responses)
+
+        def route(request):
+            with self._lock:
+                return queue.pop(0) if len(queue) > 1 else queue[0]
+        self._routes[path] = route
+
+    def serve_page(self, path, html, validators=True):
+        """Serve an HTML page, with an ETag and 304 answers to matching revalidations if validators is set"""
+        body = html.encode('utf-8')
+        etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+
+        def route(request):
+            headers = {'Content-Type': 'text/html; charset=utf-8'}
+            if not validators:
+                return 200, headers, body
+            headers['ETag'] = etag
+            if request.headers.get('If-None-Match') == etag:
+                return 304, {'ETag': etag}, b''
+            return 200, headers, body
+        self._routes[path] = route
+
+    def count(self, path):
+        return sum(1 for request in self.requests if request[1] == path)
+
+    def _handle(self, request):
+        length = int(request.headers.get('Content-Length') or 0)
+        body = request.rfile.read(length) if length else b''
+        with self._lock:
+            self.requests.append((request.command, request.path, dict(request.headers), body,
+                                  time.monotonic(), request.client_address))
+        route = self._routes.get(request.path)
+        status, headers, content = route(request) if route else (404, {}, b'')
+        request.send_response(status)
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.send_header('Content-Length', str(len(content)))
+        request.end_headers()
+        request.wfile.write(content)
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def http_server():
+    server = LocalServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture(scope='session')
+def sapp_module(tmp_path_factory):
+    """The app module, imported once in a scratch directory (it creates saved_pages/ on import)"""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('app'))
+    try:
+        import sapp
+    finally:
+        os.chdir(cwd)
+    return sapp
+
+
+@pytest.fixture
+def sapp(sapp_module, tmp_path, monkeypatch):
+    """The app module, run in tmp_path with a snapshot store of its own there"""
+    from snapshot_store import SnapshotStore
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'saved_pages').mkdir()
+    store = SnapshotStore(tmp_path / 'saved_pages')
+    monkeypatch.setattr(sapp_module, 'SAVE_DIR', store.save_dir)
+    monkeypatch.setattr(sapp_module, 'store', store)
+    monkeypatch.setattr(sapp_module, 'catalog', store.catalog)
+    return sapp_module
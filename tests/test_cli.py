@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Runs `python -m sapp compact --dry-run`, counting the snapshot stores opened
+SCRIPT = """
+import runpy, sys
+import snapshot_store
+
+opened = []
+init = snapshot_store.SnapshotStore.__init__
+
+def counting_init(self, *args):
+    opened.append(self)
+    init(self, *args)
+
+snapshot_store.SnapshotStore.__init__ = counting_init
+sys.argv = ['sapp', 'compact', '--dry-run']
+try:
+    runpy.run_module('sapp', run_name='__main__', alter_sys=True)
+except SystemExit as e:
+    print(e.code, len(opened))
+"""
+
+
+def run(directory, *args):
+    return subprocess.run([sys.executable, *args], cwd=directory, env=dict(os.environ, PYTHONPATH=str(ROOT)),
+                          capture_output=True, text=True, timeout=120)
+
+
+def test_commands_load_the_app_once(tmp_path):
+    process = run(tmp_path, "-c", SCRIPT)
+
+    assert process.stdout.splitlines()[-1] == "0 1", process.stderr
+
+
+def test_unknown_command(tmp_path):
+    process = run(tmp_path, "-m", "sapp", "frobnicate")
+
+    assert process.returncode == 2
+    assert "Unknown command: frobnicate" in process.stdout
@@ -0,0 +1,75 @@
+import random
+
+import pytest
+from bs4 import BeautifulSoup
+
+import dom
+from dom import ParsedPage, clean_text_lines, stream_text, visible_text
+
+PARSERS = ['html.parser', pytest.param('lxml', marks=pytest.mark.skipif(not dom.HAVE_LXML, reason="needs lxml"))]
+
+PAGES = [
+    "",
+    "plain text, no markup",
+    "<!DOCTYPE html><html><head><title>News &amp; views</title>"
+    "<meta charset='utf-8'><link rel='stylesheet' href='a.css'>"
+    "<style>p { color: red }</style><script>var x = '</p>';</script></head>"
+    "<body><h1>Top&nbsp;stories</h1><p>First<br>line</p><p>Second &#8212; &#x2603; &copy</p></body></html>",
+    "<p>Unclosed <b>bold <i>both</p> after<div>div <span>span",
+    "<ul><li>One<li>Two<li>Three</ul><table><tr><td>A<td>B<tr><td>C</table>",
+    "<pre>\n  keep   this\n    spacing\n</pre><textarea>  and\n this </textarea>",
+    "<p>Before<!-- a comment <p>inside</p> -->after</p><![CDATA[ cdata text ]]><?php echo 1; ?>",
+    "<svg><script>alert(1)</script><text>In SVG</text></svg><noscript>No script</noscript>",
+    "<template><p>Template content</p></template><P CLASS='x'>UPPER</P><Script>hidden()</SCRIPT>",
+    "<p title='a > b'>Quoted &gt; attribute</p><p>Stray </ closing and < less-than</p>",
+    "\N{BYTE ORDER MARK}<html><body><p>After a BOM</p></body></html>",
+    "<body><script>unterminated script <p>never shown",
+    "<p>&unknownentity; &amp &lt;tag&gt; &#0; &#xD800; &#1114112;</p>",
+    "<meta name='a' content='not text'><p>Text</p><link href='x'>tail",
+    "<html><body>\r\n<p>Windows\r\nline endings</p>\r\n</body></html>",
+    "<div>\t  Tabs\tand  spaces \x0c form feed </div>",
+]
+
+
+def baseline_text(html, parser):
+    """The original extraction: decompose the non-text tags, then get_text()"""
+    soup = BeautifulSoup(html, parser)
+    for tag in soup(["script", "style", "meta", "link"]):
+        tag.decompose()
+    return soup.get_text()
+
+
+def random_page(rng):
+    tags = ['p', 'div', 'span', 'b', 'script', 'style', 'pre', 'textarea', 'li', 'table', 'td', 'br', 'meta', 'title']
+    parts = []
+    for _ in range(rng.randrange(1, 60)):
+        choice = rng.random()
+        tag = rng.choice(tags)
+        if choice < 0.3:
+            parts.append(f"<{tag}>")
+        elif choice < 0.5:
+            parts.append(f"</{tag}>")
+        elif choice < 0.55:
+            parts.append(rng.choice(["<!-- note -->", "&amp;", "&#169;", "&nbsp;", "<br/>", "\n", "  "]))
+        else:
+            parts.append(rng.choice(["word", "two words", " spaced ", "x<y", "a\nb", "été"]))
+    return ''.join(parts)
+
+
+@pytest.mark.parametrize("parser", PARSERS)
+@pytest.mark.parametrize("html", PAGES)
+def test_stream_text_matches_baseline(html, parser):
+    expected = baseline_text(html, parser)
+
+    assert stream_text(html, parser) == expected
+    assert visible_text(BeautifulSoup(html, parser)) == expected
+    assert ParsedPage(html, parser).text == clean_text_lines(expected)
+
+
+@pytest.mark.parametrize("parser", PARSERS)
+def test_stream_text_matches_baseline_on_random_pages(parser):
+    rng = random.Random(0)
+    for _ in range(500):
+        html = random_page(rng)
+
+        assert stream_text(html, parser) == baseline_text(html, parser), html
@@ -0,0 +1,81 @@
+import pytest
+import requests
+
+PAGE = "<html><head><title>News</title></head><body><p>First story</p></body></html>"
+CHANGED = "<html><head><title>News</title></head><body><p>Second story</p></body></html>"
+
+
+def test_first_fetch(sapp, http_server):
+    http_server.serve_page("/page", PAGE)
+
+    fetched = sapp.fetch_page(http_server.url("/page"), raise_errors=True)
+
+    assert fetched["status"] == 200
+    assert fetched["content"] == PAGE
+    assert fetched["etag"]
+    assert not fetched["unchanged"]
+
+
+def test_not_modified(sapp, http_server):
+    http_server.serve_page("/page", PAGE)
+    first = sapp.fetch_page(http_server.url("/page"), raise_errors=True)
+
+    fetched = sapp.fetch_page(http_server.url("/page"), validators=first, raise_errors=True)
+
+    assert fetched["status"] == 304
+    assert fetched["unchanged"]
+    assert fetched["content"] is None
+    assert fetched["content_hash"] == first["content_hash"]
+    assert http_server.requests[-1][2]["If-None-Match"] == first["etag"]
+
+
+def test_same_body_is_unchanged_without_validators(sapp, http_server):
+    http_server.serve_page("/page", PAGE, validators=False)
+    first = sapp.fetch_page(http_server.url("/page"), raise_errors=True)
+
+    fetched = sapp.fetch_page(http_server.url("/page"), validators=first, raise_errors=True)
+
+    assert "If-None-Match" not in http_server.requests[-1][2]
+    assert fetched["status"] == 200
+    assert fetched["unchanged"]
+    assert fetched["content"] is None
+    assert fetched["content_hash"] == first["content_hash"]
+
+
+def test_changed_body(sapp, http_server):
+    http_server.serve_page("/page", PAGE)
+    first = sapp.fetch_page(http_server.url("/page"), raise_errors=True)
+    http_server.serve_page("/page", CHANGED)
+
+    fetched = sapp.fetch_page(http_server.url("/page"), validators=first, raise_errors=True)
+
+    assert fetched["status"] == 200
+    assert not fetched["unchanged"]
+    assert fetched["content"] == CHANGED
+    assert fetched["content_hash"] != first["content_hash"]
+
+
+def test_connection_is_reused(sapp, http_server):
+    http_server.serve_page("/a", PAGE)
+    http_server.serve_page("/b", CHANGED)
+
+    for path in ["/a", "/b", "/a", "/b", "/missing", "/a"]:
+        sapp.fetch_page(http_server.url(path))
+
+    assert len(http_server.requests) == 6
+    assert len({request[5] for request in http_server.requests}) == 1
+
+
+def test_http_errors(sapp, http_server):
+    assert sapp.fetch_page(http_server.url("/missing")) is None
+    with pytest.raises(requests.HTTPError):
+        sapp.fetch_page(http_server.url("/missing"), raise_errors=True)
+
+
+def test_save(sapp, http_server):
+    http_server.serve_page("/page", PAGE)
+
+    fetched = sapp.fetch_page(http_server.url("/page"), save=True)
+
+    assert fetched["saved"]["version"] == 1
+    assert sapp.store.read(sapp.catalog.latest(http_server.url("/page"))) == PAGE
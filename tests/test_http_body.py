@@ -0,0 +1,97 @@
+import gzip
+
+import pytest
+import requests
+
+from http_body import BodyTooLarge, read_body
+from snapshot_store import content_hash
+
+TEXT = "<p>Café, naïve, 東京 – “quotes”</p>\n" * 20
+
+
+def get(http_server, content_type, body, headers=None):
+    http_server.respond("/page", (200, dict({'Content-Type': content_type}, **(headers or {})), body))
+    return requests.get(http_server.url("/page"), stream=True, timeout=10)
+
+
+@pytest.mark.parametrize("content_type, body", [
+    ("text/html; charset=utf-8", TEXT.encode('utf-8')),
+    ("text/html; charset=iso-8859-1", "<p>Café</p>".encode('iso-8859-1')),
+    ("text/html; charset=windows-1252", "<p>“Café”</p>".encode('cp1252')),
+    ("text/html; charset=shift_jis", "<p>東京の天気</p>".encode('shift_jis')),
+    ("text/html; charset=utf-16", TEXT.encode('utf-16')),
+    ("text/html; charset=no-such-charset", TEXT.encode('utf-8')),
+    # requests' default for text/* without a charset
+    ("text/html", TEXT.encode('utf-8')),
+    # No charset at all: UTF-8 when it decodes, detected otherwise
+    ("application/xhtml+xml", TEXT.encode('utf-8')),
+    ("application/xhtml+xml", ("<p>Ceci est une phrase en français, très élégante.</p>\n" * 20).encode('cp1252')),
+], ids=['utf-8', 'latin-1', 'cp1252', 'shift_jis', 'utf-16', 'unknown', 'text-default', 'undeclared-utf-8',
+        'undeclared-cp1252'])
+@pytest.mark.parametrize("chunk_size", [3, 64 * 1024])
+def test_text_is_what_requests_gives(http_server, content_type, body, chunk_size):
+    expected = requests.get(get(http_server, content_type, body).url, timeout=10).text
+
+    result = read_body(get(http_server, content_type, body), chunk_size=chunk_size)
+
+    assert result.text == expected
+    assert result.content_hash == content_hash(expected)
+    assert result.nbytes == len(body)
+    assert not result.truncated
+    assert result.raw is None or result.raw == expected.encode('utf-8')
+
+
+def test_utf8_body_keeps_its_bytes(http_server):
+    body = TEXT.encode('utf-8')
+
+    result = read_body(get(http_server, "application/xhtml+xml", body))
+
+    assert result.raw == body
+
+
+def test_known_hash_leaves_body_undecoded(http_server):
+    for content_type, body in [("text/html; charset=utf-8", TEXT.encode('utf-8')),
+                               ("text/html; charset=iso-8859-1", "<p>Café</p>".encode('iso-8859-1')),
+                               ("application/xhtml+xml", "<p>Café élégant</p>".encode('cp1252'))]:
+        first = read_body(get(http_server, content_type, body))
+
+        again = read_body(get(http_server, content_type, body), known_hash=first.content_hash)
+        changed = read_body(get(http_server, content_type, body + b"<p>more</p>"),
+                            known_hash=first.content_hash)
+
+        assert (again.text, again.raw, again.content_hash) == (None, None, first.content_hash)
+        assert changed.text is not None and changed.content_hash != first.content_hash
+
+
+def test_content_length_over_the_limit(http_server):
+    with pytest.raises(BodyTooLarge, match="Response is 1000 bytes"):
+        read_body(get(http_server, "text/html", b"x" * 1000), max_bytes=999)
+
+
+def test_decompressed_body_over_the_limit(http_server):
+    body = gzip.compress(b"x" * 100_000)
+    response = get(http_server, "text/html", body, {'Content-Encoding': 'gzip'})
+
+    with pytest.raises(BodyTooLarge, match="more than the 50000 bytes"):
+        read_body(response, max_bytes=50_000)
+
+
+@pytest.mark.parametrize("headers, body", [
+    ({}, TEXT.encode('utf-8')),
+    ({'Content-Encoding': 'gzip'}, gzip.compress(TEXT.encode('utf-8'))),
+])
+def test_truncate(http_server, headers, body):
+    result = read_body(get(http_server, "text/html; charset=utf-8", body, headers),
+                       max_bytes=100, truncate=True, chunk_size=64)
+
+    assert result.truncated
+    assert result.nbytes == 100
+    assert result.text == TEXT.encode('utf-8')[:100].decode('utf-8', errors='replace')
+
+
+def test_within_the_limit(http_server):
+    body = TEXT.encode('utf-8')
+
+    result = read_body(get(http_server, "text/html; charset=utf-8", body), max_bytes=len(body))
+
+    assert result.text == TEXT and not result.truncated
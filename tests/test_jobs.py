@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+import jobs
+from jobs import CANCELLED, DONE, FAILED, TIMEOUT, JobQueue
+
+
+def add(a, b):
+    return a + b
+
+
+def fail():
+    raise RuntimeError("broken")
+
+
+def never_reports():
+    while True:
+        time.sleep(0.1)
+
+
+def reports(seconds):
+    """Report progress every 0.05 s for the given time"""
+    started = time.monotonic()
+    while time.monotonic() - started < seconds:
+        jobs.report("Working")
+        time.sleep(0.05)
+    return seconds
+
+
+def wait_for(*watched, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not all(job.done for job in watched):
+        assert time.monotonic() < deadline, [job.status for job in watched]
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def queue():
+    queue = JobQueue(workers=2)
+    yield queue
+    queue.shutdown()
+
+
+def test_jobs_run(queue):
+    job = queue.submit('add', add, 2, 3)
+    failing = queue.submit('fail', fail)
+
+    wait_for(job, failing)
+
+    assert (job.status, job.result) == (DONE, 5)
+    assert (failing.status, failing.message) == (FAILED, "broken")
+
+
+def test_same_key_joins_the_job(queue):
+    first = queue.submit('work', reports, 0.5)
+
+    assert queue.submit('work', reports, 0.5) is first
+    wait_for(first)
+    assert queue.submit('work', reports, 0.5) is not first
+
+
+def test_cancel_stops_at_the_next_report(queue):
+    job = queue.submit('work', reports, 60)
+    while job.status != jobs.RUNNING:
+        time.sleep(0.05)
+
+    assert queue.cancel(job.id)
+
+    after = queue.submit('after', add, 1, 1)
+    wait_for(after, timeout=10)
+    assert job.status == CANCELLED
+    assert after.result == 2
+
+
+def test_timed_out_job_without_checkpoints_frees_its_worker(queue):
+    stuck = [queue.submit(f'stuck {n}', never_reports, timeout=1) for n in range(2)]
+    running = queue.submit('running', reports, 3, timeout=30)
+    waiting = queue.submit('waiting', add, 2, 3)
+
+    wait_for(*stuck, running, waiting)
+
+    assert [job.status for job in stuck] == [TIMEOUT, TIMEOUT]
+    assert (waiting.status, waiting.result) == (DONE, 5)
+    # Jobs on the replaced pool start again on the new one
+    assert (running.status, running.result) == (DONE, 3)
+    later = queue.submit('later', add, 1, 2)
+    wait_for(later)
+    assert later.result == 3
@@ -0,0 +1,177 @@
+import difflib
+import pickle
+import random
+
+import pytest
+
+from line_diff import DiffPager, grouped_opcodes, iter_opcodes, iter_unified_diff
+
+
+def random_pair(rng):
+    """Two line lists, the second an edited copy of the first, from a small alphabet so lines repeat"""
+    a = [f"line {rng.randrange(30)}\n" for _ in range(rng.randrange(80))]
+    b = list(a)
+    for _ in range(rng.randrange(8)):
+        at = rng.randrange(len(b) + 1)
+        action = rng.random()
+        if action < 0.4:
+            b[at:at] = [f"new {rng.randrange(1000)}\n" for _ in range(rng.randrange(1, 5))]
+        elif action < 0.8:
+            del b[at:at + rng.randrange(1, 6)]
+        else:
+            b[at:at + 2] = [f"line {rng.randrange(30)}\n"]
+    return a, b
+
+
+def pairs(count, seed=0):
+    rng = random.Random(seed)
+    return [random_pair(rng) for _ in range(count)]
+
+
+def apply_unified_diff(a, diff):
+    """Rebuild the new side from the old one and unified diff lines"""
+    b = []
+    position = 0
+    for line in diff[2:]:
+        if line.startswith('@@'):
+            start = int(line.split()[1][1:].split(',')[0])
+            count = line.split()[1].split(',')
+            # An empty range names the line before it
+            start = start if len(count) == 1 or int(count[1]) else start + 1
+            b.extend(a[position:start - 1])
+            position = start - 1
+        elif line[0] == ' ':
+            assert a[position] == line[1:]
+            b.append(line[1:])
+            position += 1
+        elif line[0] == '-':
+            assert a[position] == line[1:]
+            position += 1
+        else:
+            b.append(line[1:])
+    return b + a[position:]
+
+
+def all_pages(pager):
+    """Every page of a pager, in order, joined up"""
+    lines = []
+    index = 0
+    while True:
+        page, finished = pager.page(index)
+        assert finished
+        lines += page
+        if not pager.has_next(index):
+            return lines
+        index += 1
+
+
+@pytest.mark.parametrize("n", [0, 1, 3])
+def test_difflib_algorithm_matches_difflib(n):
+    for a, b in pairs(300):
+        assert list(iter_unified_diff(a, b, n, algorithm='difflib')) == \
+            list(difflib.unified_diff(a, b, n=n, lineterm=''))
+
+
+def test_grouped_opcodes_match_difflib():
+    for a, b in pairs(300, seed=1):
+        matcher = difflib.SequenceMatcher(None, a, b)
+        if a == b:
+            continue
+        for n in (0, 1, 3, 10):
+            assert list(grouped_opcodes(matcher.get_opcodes(), n)) == list(matcher.get_grouped_opcodes(n))
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_patience_opcodes_are_a_valid_edit_script(seed):
+    for a, b in pairs(300, seed):
+        i = j = 0
+        previous = None
+        for tag, i1, i2, j1, j2 in iter_opcodes(a, b):
+            assert (i1, j1) == (i, j)
+            if tag == 'equal':
+                assert a[i1:i2] == b[j1:j2]
+            # Adjacent changes are merged, so changes and equal runs alternate
+            assert (tag == 'equal') != (previous == 'equal') or previous is None
+            i, j, previous = i2, j2, tag
+        assert (i, j) == (len(a), len(b))
+
+
+@pytest.mark.parametrize("n", [0, 3])
+def test_patience_unified_diff_applies(n):
+    for a, b in pairs(300, seed=3):
+        diff = list(iter_unified_diff(a, b, n))
+
+        assert (diff == []) == (a == b)
+        assert apply_unified_diff(a, diff) == b
+
+
+def test_patience_matches_difflib_on_unique_lines():
+    rng = random.Random(4)
+    for _ in range(100):
+        a = [f"line {i}\n" for i in range(60)]
+        b = list(a)
+        at = rng.randrange(55)
+        b[at:at + rng.randrange(5)] = [f"new {i}\n" for i in range(rng.randrange(4))]
+
+        assert list(iter_unified_diff(a, b)) == list(difflib.unified_diff(a, b, lineterm=''))
+
+
+def test_keys_are_matched_and_lines_shown():
+    a = ["<p>1</p>\n", "<i>token=abc</i>\n", "<p>2</p>\n"]
+    b = ["<p>1</p>\n", "<i>token=xyz</i>\n", "<p>3</p>\n"]
+    keys = (["<p>1</p>\n", "<i>token=*</i>\n", "<p>2</p>\n"],
+            ["<p>1</p>\n", "<i>token=*</i>\n", "<p>3</p>\n"])
+
+    diff = list(iter_unified_diff(a, b, n=1, keys=keys))
+
+    # Only the unmasked change shows; the context is the old page's own line
+    assert diff[3:] == [" " + a[1], "-" + a[2], "+" + b[2]]
+
+
+@pytest.mark.parametrize("page_size", [1, 7, 50, 1000])
+def test_pager_pages_make_up_the_diff(page_size):
+    for a, b in pairs(50, seed=5):
+        full = list(iter_unified_diff(a, b))
+        pager = DiffPager(a, b, page_size=page_size)
+
+        assert all_pages(pager) == full
+        assert pager.complete
+        assert pager.page(len(full) // page_size + 1) == ([], True)
+
+
+def test_pager_pages_in_any_order():
+    a, b = pairs(1, seed=6)[0]
+    full = list(iter_unified_diff(a, b))
+    pager = DiffPager(a, b, page_size=5)
+    count = -(-len(full) // 5)
+
+    for index in [count - 1, 0, count // 2, count - 1, 1]:
+        assert pager.page(index) == (full[index * 5:index * 5 + 5], True)
+
+
+def test_pager_resumes_after_time_limit():
+    a = [f"line {i}\n" for i in range(3000)]
+    b = [line for i, line in enumerate(a) if i % 3] + ["end\n"]
+    full = list(iter_unified_diff(a, b))
+    pager = DiffPager(a, b, page_size=len(full))
+
+    attempts = 0
+    page, finished = pager.page(0, max_ms=0)
+    while not finished:
+        attempts += 1
+        page, finished = pager.page(0, max_ms=0)
+
+    assert attempts > 0
+    assert page == full
+
+
+def test_pager_survives_pickling():
+    a, b = pairs(1, seed=7)[0]
+    full = list(iter_unified_diff(a, b))
+    pager = DiffPager(a, b, page_size=3)
+    first, _ = pager.page(0)
+
+    restored = pickle.loads(pickle.dumps(pager))
+
+    assert restored.page(0) == (first, True)
+    assert all_pages(restored) == full
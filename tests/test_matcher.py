@@ -0,0 +1,144 @@
+import json
+import runpy
+import threading
+import time
+from pathlib import Path
+
+import pytest
+import requests
+
+SCRIPT = Path(__file__).resolve().parent.parent / "streamlit_app.py.py"
+
+MATCH_PATH = "/api/v1/people/match"
+
+
+def person(slug):
+    return json.dumps({"person": {"id": f"id-{slug}", "name": slug.title(), "title": "Engineer",
+                                  "organization": {"name": "Org"}, "email": f"{slug}@example.com"}}).encode()
+
+
+@pytest.fixture(scope="module")
+def app():
+    """The matcher script's globals, run bare (no button is pressed, so nothing is matched)"""
+    namespace = runpy.run_path(str(SCRIPT))
+    # Its functions read the script's own globals, not the copy run_path returns
+    return namespace["post"].__globals__
+
+
+@pytest.fixture
+def api(app, http_server, monkeypatch):
+    monkeypatch.setitem(app, "MATCH_URL", http_server.url(MATCH_PATH))
+    monkeypatch.setitem(app, "BACKOFF_BASE", 0.01)
+    return http_server
+
+
+def test_match_person(app, api):
+    api.respond(MATCH_PATH, (200, {}, person("ada")))
+
+    data = app["match_person"]("https://www.linkedin.com/in/ada", requests.Session(), app["TokenBucket"](100, 10))
+
+    assert data["person"]["name"] == "Ada"
+    request = api.requests[0]
+    assert json.loads(request[3]) == {"linkedin_url": "https://www.linkedin.com/in/ada"}
+
+
+def test_429_waits_for_retry_after(app, api):
+    api.respond(MATCH_PATH, (429, {"Retry-After": "1"}, b"{}"), (200, {}, person("ada")))
+    limiter = app["TokenBucket"](100, 10)
+
+    data = app["match_person"]("https://www.linkedin.com/in/ada", requests.Session(), limiter)
+
+    assert data["person"]["id"] == "id-ada"
+    first, second = api.requests
+    assert second[4] - first[4] >= 0.9
+    # The pause holds back every worker sharing the limiter
+    assert limiter.paused_until >= first[4] + 0.9
+
+
+def test_server_errors_are_retried(app, api):
+    api.respond(MATCH_PATH, (503, {}, b"{}"), (502, {}, b"{}"), (200, {}, person("ada")))
+
+    data = app["match_person"]("https://www.linkedin.com/in/ada", requests.Session(), app["TokenBucket"](100, 10))
+
+    assert data["person"]["id"] == "id-ada"
+    assert api.count(MATCH_PATH) == 3
+
+
+def test_gives_up_after_max_retries(app, api, monkeypatch):
+    monkeypatch.setitem(app, "MAX_RETRIES", 2)
+    api.respond(MATCH_PATH, (503, {}, b"{}"))
+    urls = ["https://www.linkedin.com/in/ada"]
+
+    rows, failed = app["match_all"](urls, requests.Session(), app["TokenBucket"](100, 10))
+
+    assert rows == []
+    assert [url for url, _ in failed] == urls
+    assert api.count(MATCH_PATH) == 3
+
+
+def test_not_found_is_not_retried(app, api):
+    api.respond(MATCH_PATH, (404, {}, b"{}"))
+
+    rows, failed = app["match_all"](["https://www.linkedin.com/in/nobody"], requests.Session(),
+                                    app["TokenBucket"](100, 10))
+
+    assert (rows, failed) == ([], [])
+    assert api.count(MATCH_PATH) == 1
+
+
+def test_match_all_keeps_input_order(app, api):
+    api.respond(MATCH_PATH, (200, {}, person("someone")))
+    urls = [f"https://www.linkedin.com/in/person-{i}" for i in range(20)]
+    progress = []
+
+    rows, failed = app["match_all"](urls, requests.Session(), app["TokenBucket"](1000, 20),
+                                    lambda done, total, matched: progress.append((done, total, matched)))
+
+    assert [row["LinkedIn"] for row in rows] == urls
+    assert failed == []
+    assert progress[-1] == (20, 20, 20)
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2", 2.0),
+    ("-5", 0),
+    ("1000000", 600),
+    ("soon", None),
+])
+def test_retry_after(app, value, expected):
+    response = requests.Response()
+    response.headers["Retry-After"] = value
+
+    assert app["retry_after"](response) == expected
+
+
+def test_token_bucket_limits_the_rate(app):
+    limiter = app["TokenBucket"](50, 5)
+    times = []
+
+    def worker():
+        for _ in range(10):
+            limiter.acquire()
+            times.append(time.monotonic())
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # The burst goes out at once, the other 35 at 50 per second
+    assert time.monotonic() - started >= 35 / 50 * 0.9
+    times.sort()
+    assert times[5] - started >= 1 / 50 * 0.9
+
+
+def test_token_bucket_pause(app):
+    limiter = app["TokenBucket"](1000, 10)
+    limiter.pause(0.3)
+
+    started = time.monotonic()
+    limiter.acquire()
+
+    assert time.monotonic() - started >= 0.25
@@ -0,0 +1,67 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from snapshot_store import SnapshotStore
+
+ROOT = Path(__file__).resolve().parent.parent
+
+PAGE = "<html><body><p>First story</p></body></html>"
+CHANGED = "<html><body><p>Second story</p></body></html>"
+
+
+def run_monitor(directory, urls):
+    """Run 'python -m sapp monitor --once' in directory; returns the process and its log records"""
+    (directory / "urls.txt").write_text("".join(f"{url}\n" for url in urls), encoding="utf-8")
+    log = directory / "changes.jsonl"
+    log.unlink(missing_ok=True)
+    process = subprocess.run(
+        [sys.executable, "-m", "sapp", "monitor", "urls.txt", "--once", "--workers", "1"],
+        cwd=directory, env=dict(os.environ, PYTHONPATH=str(ROOT)),
+        capture_output=True, text=True, timeout=120)
+    records = [json.loads(line) for line in log.read_text(encoding="utf-8").splitlines()]
+    return process, {record["url"]: record for record in records}
+
+
+def test_once(tmp_path, http_server):
+    http_server.serve_page("/a", PAGE)
+    http_server.serve_page("/b", PAGE)
+    urls = [http_server.url("/a"), http_server.url("/b"), http_server.url("/missing")]
+
+    process, records = run_monitor(tmp_path, urls)
+
+    assert process.returncode == 0, process.stderr
+    assert "Checked 3 URLs: 0 changed, 1 errors" in process.stdout
+    assert records[urls[0]]["status"] == "saved"
+    assert records[urls[1]]["status"] == "saved"
+    assert records[urls[2]]["status"] == "error"
+
+    http_server.serve_page("/b", CHANGED)
+    process, records = run_monitor(tmp_path, urls[:2])
+
+    assert process.returncode == 0, process.stderr
+    assert "Checked 2 URLs: 1 changed, 0 errors" in process.stdout
+    assert records[urls[0]]["status"] == "unchanged"
+    assert records[urls[0]]["not_modified"]
+    assert records[urls[1]]["status"] == "changed"
+    assert records[urls[1]]["version"] == 2
+    assert records[urls[1]]["change_percentage"] > 0
+
+
+def test_failed_check_does_not_stop_the_others(tmp_path, http_server):
+    http_server.serve_page("/a", PAGE)
+    http_server.serve_page("/b", PAGE)
+    urls = [http_server.url("/a"), http_server.url("/b")]
+    run_monitor(tmp_path, urls)
+    # Pseudo-elements cannot be selected: the comparison of /a fails in the worker
+    SnapshotStore(tmp_path / "saved_pages").catalog.set_watch_selector(urls[0], "p::before")
+    http_server.serve_page("/a", CHANGED)
+    http_server.serve_page("/b", CHANGED)
+
+    process, records = run_monitor(tmp_path, urls)
+
+    assert process.returncode == 0, process.stderr
+    assert records[urls[0]]["status"] == "error"
+    assert records[urls[1]]["status"] == "changed"
@@ -0,0 +1,88 @@
+import pytest
+
+import region
+from region import REGION_DOCUMENT, region_document
+
+PAGE = """<!DOCTYPE html>
+<html><head><title>News</title></head><body>
+<div id="header"><a href="/">Home</a></div>
+<div class="news featured"><p>First story</p><p class="late">Second story</p></div>
+<div class="news"><div class="news"><p>Nested story</p></div></div>
+<div class="sidebar" data-kind="ads"><p>Buy now</p></div>
+</body></html>"""
+
+needs_lxml = pytest.mark.skipif(not region.HAVE_LXML, reason="XPath needs lxml")
+
+
+def document(*parts):
+    return REGION_DOCUMENT.format('\n'.join(parts))
+
+
+@pytest.fixture(params=['lxml', 'html.parser'])
+def backend(request, monkeypatch):
+    """Simple selectors run as XPath with lxml, and as a parse-time filter without it"""
+    if request.param == 'lxml':
+        if not region.HAVE_LXML:
+            pytest.skip("lxml is not installed")
+    else:
+        monkeypatch.setattr(region, 'HAVE_LXML', False)
+    return request.param
+
+
+@pytest.mark.parametrize("selector, expected", [
+    ("#header", ['<div id="header"><a href="/">Home</a></div>']),
+    ("p.late", ['<p class="late">Second story</p>']),
+    ("[data-kind=ads]", ['<div class="sidebar" data-kind="ads"><p>Buy now</p></div>']),
+    # Only the outermost of nested matches
+    (".news", ['<div class="news featured"><p>First story</p><p class="late">Second story</p></div>',
+               '<div class="news"><div class="news"><p>Nested story</p></div></div>']),
+])
+def test_simple_css(backend, selector, expected):
+    assert region_document(PAGE, selector, backend) == document(*expected)
+
+
+def test_css_with_combinators(backend):
+    assert region_document(PAGE, "div.featured > p:first-child", backend) == document('<p>First story</p>')
+    assert region_document(PAGE, "body > .news p", backend) == document(
+        '<p>First story</p>', '<p class="late">Second story</p>', '<p>Nested story</p>')
+
+
+@needs_lxml
+def test_xpath():
+    assert region_document(PAGE, "//div[@id='header']") == document(
+        '<div id="header"><a href="/">Home</a></div>')
+    assert region_document(PAGE, "//div[contains(@class, 'news')]") == document(
+        '<div class="news featured"><p>First story</p><p class="late">Second story</p></div>',
+        '<div class="news"><div class="news"><p>Nested story</p></div></div>')
+    assert region_document(PAGE, "//p[@class='late']/text()") == document('Second story')
+
+
+@needs_lxml
+def test_xpath_on_xml_declared_page():
+    page = '\N{BYTE ORDER MARK}<?xml version="1.0" encoding="utf-8"?>\n' + PAGE
+
+    assert region_document(page, "//a") == document('<a href="/">Home</a>')
+
+
+@pytest.mark.parametrize("selector", ["#footer", "table td", pytest.param("//table", marks=needs_lxml)])
+def test_no_match_is_an_empty_region(selector):
+    assert region_document(PAGE, selector) == document('')
+
+
+@pytest.mark.parametrize("page", ["", "<!-- nothing here -->"])
+def test_empty_page(page):
+    assert region_document(page, "#header") == document('')
+
+
+@pytest.mark.parametrize("selector, message", [
+    ("div[", "Invalid CSS selector"),
+    ("p::before", "Unsupported CSS selector"),
+    pytest.param("//div[", "Invalid XPath", marks=needs_lxml),
+    pytest.param("//p/unknown-function()", "Invalid XPath", marks=needs_lxml),
+])
+def test_invalid_selector(selector, message):
+    with pytest.raises(ValueError, match=message):
+        region_document(PAGE, selector)
+    # Whatever the page holds
+    with pytest.raises(ValueError, match=message):
+        region_document("", selector)
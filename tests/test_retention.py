@@ -0,0 +1,158 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from snapshot_store import SnapshotStore
+
+URL = "https://example.com/news"
+NOW = datetime(2026, 3, 18, 12, 0, 0)
+
+
+class FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return NOW
+
+
+@pytest.fixture
+def retention(sapp):
+    # retention imports the app, which must first be set up by the sapp fixture
+    import retention
+    return retention
+
+
+@pytest.fixture
+def store(tmp_path):
+    (tmp_path / 'store').mkdir()
+    store = SnapshotStore(tmp_path / 'store')
+    # Nothing else uses this store, so unused files may go at once
+    store.gc_grace_seconds = 0
+    return store
+
+
+def page(n):
+    return "".join(f"<p>Paragraph {i}: {i * n % 97}</p>\n" for i in range(200))
+
+
+def save_at(store, url, content, when):
+    timestamp = when.strftime("%Y%m%d_%H%M%S")
+    return store.save(url, content, timestamp, when.strftime("%Y-%m-%d %H:%M:%S"))
+
+
+def save_history(store, url=URL, hours=24 * 60, every=8):
+    """A version every `every` hours for the past `hours` hours, oldest first"""
+    times = [NOW - timedelta(hours=hour) for hour in range(hours, -1, -every)]
+    return [save_at(store, url, page(n), when) for n, when in enumerate(times)]
+
+
+def read_all(store, versions):
+    reader = SnapshotStore(store.save_dir)
+    return {metadata['version']: reader.read(metadata) for metadata in versions}
+
+
+def test_expired_versions_thin_by_bucket(retention):
+    versions = [{'version': n + 1, 'timestamp': (NOW - timedelta(hours=hour)).strftime("%Y%m%d_%H%M%S")}
+                for n, hour in enumerate(range(24 * 60, -1, -8))]
+    policy = retention.RetentionPolicy(keep_last=5, daily_after=7, weekly_after=30)
+
+    expired = retention.expired_versions(versions, policy, now=NOW)
+
+    # The newest version of each day older than a week, and of each ISO week
+    # older than 30 days, is kept, with everything newer and the last five
+    newest = {}
+    kept = {metadata['version'] for metadata in versions[-5:]}
+    for metadata in versions:
+        saved = datetime.strptime(metadata['timestamp'], "%Y%m%d_%H%M%S")
+        if NOW - saved < timedelta(days=7):
+            kept.add(metadata['version'])
+        elif NOW - saved < timedelta(days=30):
+            newest[saved.date()] = metadata['version']
+        else:
+            newest[saved.isocalendar()[:2]] = metadata['version']
+    kept |= set(newest.values())
+    assert sorted(expired) == sorted({metadata['version'] for metadata in versions} - kept)
+    assert len(kept) < len(versions) - 100
+
+
+def test_latest_version_is_always_kept(retention, store):
+    versions = save_history(store, hours=24 * 90, every=24)
+    # Old enough that every version falls in an older week's bucket
+    later = NOW + timedelta(days=365)
+    policy = retention.RetentionPolicy(keep_last=0, daily_after=0, weekly_after=0)
+
+    expired = retention.expired_versions(versions, policy, now=later)
+
+    assert versions[-1]['version'] not in expired
+    assert store.catalog.delete_versions(URL, [versions[-1]['version']]) == []
+    assert store.catalog.latest(URL)['version'] == versions[-1]['version']
+
+
+def test_compact_store(retention, store, monkeypatch):
+    monkeypatch.setattr(retention, 'datetime', FrozenDatetime)
+    versions = save_history(store)
+    save_history(store, url="https://example.org/other", hours=48)
+    policy = retention.RetentionPolicy(keep_last=5, daily_after=7, weekly_after=30)
+    expected = set(retention.expired_versions(versions, policy, now=NOW))
+    contents = read_all(store, versions)
+
+    summary = retention.compact_store(store, policy)
+
+    remaining = store.catalog.versions(URL)
+    assert summary['expired'] == len(expected) > 0
+    assert {metadata['version'] for metadata in remaining} == {
+        metadata['version'] for metadata in versions} - expected
+    assert summary['objects_freed'] > 0
+    # Every remaining version reads back byte for byte, from one pack per URL
+    assert read_all(store, remaining) == {version: contents[version]
+                                          for version in (metadata['version'] for metadata in remaining)}
+    assert not list(store.objects_dir.glob('*/*'))
+    assert len(list(store.packs_dir.iterdir())) == 2
+
+
+def test_compact_reads_back_every_version(store):
+    versions = save_history(store, hours=24 * 10)
+    contents = read_all(store, versions)
+
+    packed = store.compact(URL)
+
+    assert packed == len(store.catalog.url_objects(URL))
+    assert not list(store.objects_dir.glob('*/*'))
+    [pack] = store.packs_dir.iterdir()
+    assert store.catalog.packs_in_use() == {pack.name}
+    assert read_all(store, versions) == contents
+
+
+def test_compact_deletes_superseded_packs(store):
+    versions = save_history(store, hours=24 * 10)
+    store.compact(URL)
+    [first] = store.packs_dir.iterdir()
+    versions.append(save_at(store, URL, page(1000), NOW + timedelta(hours=1)))
+    contents = read_all(store, versions)
+    # The grace period only protects packs this store did not supersede itself
+    store.gc_grace_seconds = 3600
+
+    store.compact(URL)
+
+    [second] = store.packs_dir.iterdir()
+    assert second.name != first.name
+    assert not list(store.objects_dir.glob('*/*'))
+    assert read_all(store, versions) == contents
+
+
+def test_collect_garbage_removes_unreferenced_objects(store):
+    versions = save_history(store, hours=24 * 10)
+    dropped = [metadata['version'] for metadata in versions[:-3]]
+    kept = versions[-3:]
+    contents = read_all(store, kept)
+    store.catalog.delete_versions(URL, dropped)
+
+    freed, freed_bytes = store.collect_garbage()
+
+    needed = {record['hash'] for record in store.catalog.url_objects(URL)}
+    assert freed == len(versions) - len(needed) and freed_bytes > 0
+    assert {path.name for path in store.objects_dir.glob('*/*')} == needed
+    for metadata in versions[:-3]:
+        if metadata['content_hash'] not in needed:
+            assert store.catalog.get_object(metadata['content_hash']) is None
+    assert read_all(store, kept) == contents
+    assert store.collect_garbage() == (0, 0)
@@ -0,0 +1,55 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from screenshot_diff import diff_screenshots
+
+WIDTH = 1920
+HEIGHT = 20000
+
+
+def page(change=None):
+    pixels = np.full((HEIGHT, WIDTH, 3), 255, dtype=np.uint8)
+    if change:
+        top, bottom = change
+        pixels[top:bottom, 100:500] = 0
+    return Image.fromarray(pixels)
+
+
+def test_identical():
+    diff = diff_screenshots(page(), page(), overlay=False)
+
+    assert diff.changed_tiles == 0
+    assert diff.boxes == []
+    assert diff.changed_percentage == 0
+
+
+def test_overlay_box_covers_the_change_on_a_tall_page():
+    diff = diff_screenshots(page(), page((19000, 19200)))
+
+    [box] = diff.boxes
+    assert box.y <= 19000 and box.y + box.height >= 19200
+    overlay = np.asarray(Image.open(io.BytesIO(diff.overlay_png)).convert('RGB')).astype(int)
+    scale = overlay.shape[1] / WIDTH
+    assert overlay.shape[0] == round(HEIGHT * scale)
+    # The changed pixels: black under the box's translucent red fill, up to
+    # the box's 2-pixel outline
+    dark = np.flatnonzero((overlay[:, :, :3].sum(axis=2) < 200).any(axis=1))
+    outline = np.flatnonzero(((overlay[:, :, 0] == 255) & (overlay[:, :, 1] == 0)).any(axis=1))
+    outline = outline[outline > 100]  # not the label
+    assert abs(dark[0] - 19000 * scale) <= 3
+    assert abs(dark[-1] - 19200 * scale) <= 3
+    assert outline[0] <= dark[0] and outline[-1] >= dark[-1]
+    assert abs(outline[0] - box.y * scale) <= 1
+    assert abs(outline[-1] - (box.y + box.height) * scale) <= 2
+
+
+def test_strips_match_single_image():
+    new = page((5000, 5100))
+    strips = [new.crop((0, top, WIDTH, min(top + 3000, HEIGHT))) for top in range(0, HEIGHT, 3000)]
+
+    whole = diff_screenshots(page(), new, overlay=False)
+    split = diff_screenshots(page(), strips, overlay=False)
+
+    assert split == whole
@@ -0,0 +1,154 @@
+import multiprocessing
+import random
+
+import pytest
+
+import snapshot_store
+from snapshot_store import KEYFRAME_INTERVAL, SnapshotStore, apply_delta, content_hash, make_delta
+
+URL = "https://example.com/news"
+
+
+def page_versions(count, seed=0):
+    """Successive versions of a page, each with a line edited, one inserted and one removed"""
+    rng = random.Random(seed)
+    lines = [f"<p>Paragraph {i}: {rng.random()}</p>\n" for i in range(300)]
+    for n in range(count):
+        lines[rng.randrange(len(lines))] = f"<p>Edited {n}: {rng.random()}</p>\n"
+        lines.insert(rng.randrange(len(lines)), f"<p>Inserted {n}</p>\n")
+        del lines[rng.randrange(len(lines))]
+        yield ''.join(lines)
+
+
+def save(store, url, content, n):
+    timestamp = f"20260101_{n // 3600:02d}{n // 60 % 60:02d}{n % 60:02d}"
+    return store.save(url, content, timestamp, snapshot_store.format_display_time(timestamp))
+
+
+def object_files(store):
+    return sorted(path.name for path in store.objects_dir.glob('*/*'))
+
+
+@pytest.fixture(params=['zlib', 'zstd'])
+def codec(request, monkeypatch):
+    if request.param == 'zstd':
+        pytest.importorskip('zstandard')
+    else:
+        monkeypatch.setattr(snapshot_store, 'zstandard', None)
+    return request.param
+
+
+@pytest.mark.parametrize("base, new", [
+    ("", ""),
+    ("", "a\nb\n"),
+    ("a\nb\n", ""),
+    ("a\nb\nc\n", "a\nb\nc\n"),
+    ("a\nb\nc\n", "c\nb\na\n"),
+    ("a\na\na\nb\n", "b\na\na\nx\na\n"),
+    ("a\nb", "a\nb\nc"),
+])
+def test_delta_round_trip(base, new):
+    base_lines = base.splitlines(keepends=True)
+
+    ops = make_delta(base_lines, new.splitlines(keepends=True))
+
+    assert apply_delta(base_lines, ops) == new
+
+
+def test_delta_round_trip_random():
+    rng = random.Random(1)
+    for _ in range(200):
+        base = [rng.choice("abcdefgh") + "\n" for _ in range(rng.randrange(40))]
+        new = [rng.choice("abcdefghij") + "\n" for _ in range(rng.randrange(40))]
+
+        assert apply_delta(base, make_delta(base, new)) == ''.join(new)
+
+
+def test_versions_round_trip(tmp_path, codec):
+    store = SnapshotStore(tmp_path)
+    contents = list(page_versions(2 * (KEYFRAME_INTERVAL + 1) + 3))
+
+    saved = [save(store, URL, content, n) for n, content in enumerate(contents)]
+
+    assert [metadata['version'] for metadata in saved] == list(range(1, len(contents) + 1))
+    records = [store.catalog.get_object(metadata['content_hash']) for metadata in saved]
+    assert {record['codec'] for record in records} == {codec}
+    # A keyframe, then KEYFRAME_INTERVAL deltas against it, then the next keyframe
+    kinds = [record['kind'] for record in records]
+    assert kinds == (['full'] + ['delta'] * KEYFRAME_INTERVAL) * 2 + ['full'] + ['delta'] * 2
+    for record in records:
+        if record['kind'] == 'delta':
+            assert store.catalog.get_object(record['base_hash'])['kind'] == 'full'
+    # Read back by a store with nothing cached
+    reader = SnapshotStore(tmp_path)
+    assert [reader.read(metadata) for metadata in saved] == contents
+    assert [reader.read(metadata) for metadata in reversed(saved)] == contents[::-1]
+
+
+def test_unrelated_content_is_stored_in_full(tmp_path, codec):
+    store = SnapshotStore(tmp_path)
+    first, _ = page_versions(2)
+    other = ''.join(f"<li>Item {i * 7919 % 1000}</li>\n" for i in range(300))
+
+    save(store, URL, first, 0)
+    metadata = save(store, URL, other, 1)
+
+    assert store.catalog.get_object(metadata['content_hash'])['kind'] == 'full'
+    assert SnapshotStore(tmp_path).read(metadata) == other
+
+
+def test_mixed_codecs(tmp_path, monkeypatch):
+    pytest.importorskip('zstandard')
+    store = SnapshotStore(tmp_path)
+    contents = list(page_versions(6))
+    with monkeypatch.context() as patch:
+        patch.setattr(snapshot_store, 'zstandard', None)
+        saved = [save(store, URL, content, n) for n, content in enumerate(contents[:3])]
+
+    saved += [save(store, URL, content, n) for n, content in enumerate(contents[3:], start=3)]
+
+    codecs = [store.catalog.get_object(metadata['content_hash'])['codec'] for metadata in saved]
+    assert codecs == ['zlib'] * 3 + ['zstd'] * 3
+    assert [SnapshotStore(tmp_path).read(metadata) for metadata in saved] == contents
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    store = SnapshotStore(tmp_path)
+    first, second = page_versions(2)
+
+    versions = [save(store, URL, first, 0), save(store, URL, second, 1), save(store, URL, first, 2),
+                save(store, "https://example.org/mirror", first, 3)]
+
+    assert [metadata['version'] for metadata in versions] == [1, 2, 3, 1]
+    assert versions[0]['content_hash'] == versions[2]['content_hash'] == versions[3]['content_hash']
+    assert versions[0]['content_hash'] == content_hash(first)
+    assert object_files(store) == sorted({content_hash(first), content_hash(second)})
+    assert [store.read(metadata) for metadata in versions] == [first, second, first, first]
+
+
+def save_many(save_dir, worker, count, start):
+    store = SnapshotStore(save_dir)
+    start.wait()
+    for n in range(count):
+        save(store, URL, f"<p>Worker {worker}, save {n}</p>\n" * 50, n)
+
+
+def test_concurrent_saves_get_unique_contiguous_versions(tmp_path):
+    workers, count = 6, 30
+    context = multiprocessing.get_context('spawn')
+    # All of them start saving at once
+    start = context.Barrier(workers)
+    processes = [context.Process(target=save_many, args=(tmp_path, worker, count, start))
+                 for worker in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(120)
+    assert [process.exitcode for process in processes] == [0] * workers
+
+    store = SnapshotStore(tmp_path)
+    versions = store.catalog.versions(URL)
+    assert sorted(metadata['version'] for metadata in versions) == list(range(1, workers * count + 1))
+    assert store.catalog.latest(URL)['version'] == workers * count
+    expected = {f"<p>Worker {worker}, save {n}</p>\n" * 50 for worker in range(workers) for n in range(count)}
+    assert {store.read(metadata) for metadata in versions} == expected
@@ -0,0 +1,112 @@
+import random
+
+import pytest
+
+import text_index
+from snapshot_store import SnapshotStore
+
+URL = "https://example.com/news"
+
+VOCABULARY = ["apple", "banana", "cherry", "delta", "echo", "fox", "golf", "hotel"]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SnapshotStore(tmp_path)
+
+
+def save(store, html, n):
+    timestamp = f"20260101_00{n // 60:02d}{n % 60:02d}"
+    return store.save(URL, html, timestamp, timestamp)
+
+
+def random_page(rng):
+    paragraphs = [" ".join(rng.choice(VOCABULARY) for _ in range(rng.randrange(1, 5)))
+                  for _ in range(rng.randrange(1, 4))]
+    return "<html><body>" + "".join(f"<p>{paragraph}</p>" for paragraph in paragraphs) + "</body></html>"
+
+
+def brute_force(store, phrase):
+    """Version numbers whose text holds every term the phrase is looked up by"""
+    wanted = set(text_index.query_terms(phrase))
+    return [metadata['version'] for metadata in store.catalog.versions(URL)
+            if wanted <= text_index.terms(text_index.page_text(store.read(metadata)))]
+
+
+def runs(numbers):
+    """(first, last) of each run of consecutive numbers"""
+    spans = []
+    for number in numbers:
+        if spans and number == spans[-1][1] + 1:
+            spans[-1][1] = number
+        else:
+            spans.append([number, number])
+    return spans
+
+
+def check_searches(store, matches):
+    """Compare search() with the versions each phrase matched when all were saved.
+
+    Runs are those of the saved history, and versions deleted since are
+    dropped from them.
+    """
+    remaining = [metadata['version'] for metadata in store.catalog.versions(URL)]
+    for phrase, matched in matches.items():
+        spans = []
+        for first, last in runs(matched):
+            kept = [number for number in remaining if first <= number <= last]
+            if kept:
+                spans.append((kept[0], kept[-1]))
+        expected = [number for number in matched if number in remaining]
+
+        found = text_index.search(store.catalog, URL, phrase)
+
+        if not expected:
+            assert found is None, phrase
+            continue
+        assert found.spans == spans, phrase
+        assert found.versions == len(expected)
+        assert found.first['version'] == expected[0]
+        assert found.last['version'] == expected[-1]
+        after = remaining.index(expected[-1]) + 1
+        assert (found.gone and found.gone['version']) == (remaining[after] if after < len(remaining) else None)
+
+
+def test_search_matches_brute_force(store):
+    rng = random.Random(0)
+    phrases = VOCABULARY + ["zulu", "Apple Banana", "cherry delta echo", "fox fox", "hotel apple zulu"]
+    phrases += [f"{rng.choice(VOCABULARY)} {rng.choice(VOCABULARY)}" for _ in range(30)]
+    saved = 0
+    for batch in range(4):
+        for _ in range(rng.randrange(5, 15)):
+            # Some versions repeat the one before
+            html = random_page(rng) if saved == 0 or rng.random() < 0.8 else store.read(store.catalog.latest(URL))
+            save(store, html, saved)
+            saved += 1
+        assert text_index.index_url(store, URL) > 0
+        assert text_index.index_url(store, URL) == 0
+        matches = {phrase: brute_force(store, phrase) for phrase in phrases}
+        check_searches(store, matches)
+
+    # Retention deletes versions the postings still cover
+    versions = [metadata['version'] for metadata in store.catalog.versions(URL)]
+    store.catalog.delete_versions(URL, rng.sample(versions[:-1], len(versions) // 3))
+    check_searches(store, matches)
+
+
+def test_unindexed_versions_are_not_searched(store):
+    save(store, "<p>apple</p>", 0)
+    text_index.index_url(store, URL)
+    save(store, "<p>banana</p>", 1)
+
+    assert text_index.search(store.catalog, URL, "banana") is None
+    found = text_index.search(store.catalog, URL, "apple")
+    assert (found.spans, found.gone) == ([(1, 1)], None)
+
+
+def test_blocks_are_not_run_together(store):
+    save(store, "<div>apple</div><div>banana</div><p>cherry<br>delta</p>", 0)
+    text_index.index_url(store, URL)
+
+    assert text_index.search(store.catalog, URL, "apple banana") is not None
+    assert text_index.search(store.catalog, URL, "applebanana") is None
@@ -0,0 +1,99 @@
+from bs4 import BeautifulSoup
+
+import noise_filter
+from tree_diff import TreeHashes, diff_trees
+
+LIST = "".join(f"<li id='item-{i}'><a href='/{i}'>Story {i}</a> <span>{i} points</span></li>" for i in range(50))
+PAGE = f"<html><body><h1 class='title'>News</h1><ul>{LIST}</ul><p>Footer</p></body></html>"
+
+
+def parse(html):
+    return BeautifulSoup(html, 'html.parser')
+
+
+def describe(node):
+    return None if node is None else str(node)
+
+
+def changes(old_html, new_html, noise_rules=None):
+    return [(change.kind, describe(change.old), describe(change.new))
+            for change in diff_trees(parse(old_html), parse(new_html), noise_rules)]
+
+
+def test_identical_pages():
+    assert changes(PAGE, PAGE) == []
+
+
+def test_comments_and_whitespace_are_not_changes():
+    new = PAGE.replace("<ul>", "<ul>\n  <!-- list -->\n  ").replace("</h1>", "</h1>\n\n")
+
+    assert changes(PAGE, new) == []
+
+
+def test_equal_subtrees_hash_equal():
+    soup = parse("<div><p>Same <b>text</b></p><p>Same <b>text</b></p><p>Other</p></div>")
+    hashes = TreeHashes(soup)
+
+    first, second, third = [hashes.digest(p) for p in soup.find_all('p')]
+
+    assert first == second != third
+
+
+def test_changed_text_deep_in_the_tree():
+    new = PAGE.replace("Story 17<", "Story seventeen<")
+
+    assert changes(PAGE, new) == [('text', 'Story 17', 'Story seventeen')]
+
+
+def test_changed_attributes():
+    new = PAGE.replace("class='title'", "class='title big'")
+
+    assert changes(PAGE, new) == [('attributes', '<h1 class="title">News</h1>', '<h1 class="title big">News</h1>')]
+
+
+def test_inserted_subtree():
+    item = "<li id='item-new'><a href='/new'>Fresh story</a></li>"
+    new = PAGE.replace("<li id='item-10'>", item + "<li id='item-10'>")
+
+    assert changes(PAGE, new) == [('inserted', None, str(parse(item).li))]
+
+
+def test_removed_subtree():
+    item = "<li id='item-30'><a href='/30'>Story 30</a> <span>30 points</span></li>"
+    new = PAGE.replace(item, "")
+
+    assert changes(PAGE, new) == [('removed', str(parse(item).li), None)]
+
+
+def test_reordered_siblings():
+    item = "<li id='item-3'><a href='/3'>Story 3</a> <span>3 points</span></li>"
+    new = PAGE.replace(item, "").replace("</ul>", item + "</ul>")
+
+    assert changes(PAGE, new) == [('moved', str(parse(item).li), str(parse(item).li))]
+
+
+def test_subtree_moved_to_another_parent():
+    old = "<body><div id='a'><p>One</p><p>Two</p></div><div id='b'><p>Three</p></div></body>"
+    new = "<body><div id='a'><p>One</p></div><div id='b'><p>Three</p><p>Two</p></div></body>"
+
+    assert changes(old, new) == [('moved', '<p>Two</p>', '<p>Two</p>')]
+
+
+def test_several_changes():
+    new = (PAGE.replace("Story 5<", "Story five<")
+           .replace("<li id='item-40'><a href='/40'>Story 40</a> <span>40 points</span></li>", "")
+           .replace("</ul>", "<li id='item-50'><a href='/50'>Story 50</a></li></ul>"))
+
+    assert sorted(changes(PAGE, new)) == sorted([
+        ('text', 'Story 5', 'Story five'),
+        ('removed', str(parse(LIST).find(id='item-40')), None),
+        ('inserted', None, '<li id="item-50"><a href="/50">Story 50</a></li>'),
+    ])
+
+
+def test_masked_noise_is_not_a_change():
+    old = PAGE.replace("<p>Footer</p>", "<p>Updated 2026-03-18 12:00:00</p><input name='csrf' value='abc'>")
+    new = PAGE.replace("<p>Footer</p>", "<p>Updated 2026-03-19 08:30:00</p><input name='csrf' value='xyz'>")
+
+    assert changes(old, new, noise_filter.DEFAULT_COMPILED_RULES) == []
+    assert len(changes(old, new)) == 2
@@ -0,0 +1,132 @@
+import re
+from bisect import bisect_left
+from collections import namedtuple
+
+import dom
+
+WORD_RE = re.compile(r'\w+')
+
+# Longer "words" are mostly encoded data and are not indexed
+MAX_TERM_LENGTH = 64
+
+# Where a word or phrase occurs among the saved versions of a URL. first,
+# last and gone are catalog metadata: the first and last versions containing
+# it, and the first version after last without it (None if last is the
+# newest indexed version). spans lists the (first, last) version numbers of
+# each run of consecutive versions containing it.
+Occurrence = namedtuple('Occurrence', 'first last gone versions spans')
+
+
+def words(text):
+    """Normalized words of a text, in order"""
+    return [word for word in WORD_RE.findall(text.casefold()) if len(word) <= MAX_TERM_LENGTH]
+
+
+def terms(text):
+    """Indexed terms of a text: its words and every pair of adjacent words"""
+    found = words(text)
+    indexed = set(found)
+    indexed.update(f"{first} {second}" for first, second in zip(found, found[1:]))
+    return indexed
+
+
+def page_text(html):
+    """Visible text of a page with block elements on lines of their own, so they are not run together"""
+    page = dom.ParsedPage(html)
+    text = dom.stream_text(page.html, page.parser, block_breaks=True)
+    return page.text if text is None else text
+
+
+def query_terms(phrase):
+    """Terms a version must contain to match a phrase.
+
+    A single word is looked up as it is. Longer phrases are looked up by
+    their adjacent word pairs, so a match is exact for two words and for
+    longer phrases only requires every pair to occur somewhere in the text.
+    """
+    found = words(phrase)
+    if len(found) < 2:
+        return found
+    return list(dict.fromkeys(f"{first} {second}" for first, second in zip(found, found[1:])))
+
+
+def index_url(store, url, progress=None):
+    """Add the versions of a URL saved since the last call to the text index.
+
+    Each version is diffed against the terms of the one indexed before it,
+    which the open postings already hold, so only the terms that appeared
+    or disappeared are written. progress, if given, is called with a message
+    and the fraction done. Returns the number of versions indexed.
+    """
+    catalog = store.catalog
+    indexed = catalog.indexed_version(url)
+    pending = [metadata for metadata in catalog.versions(url) if metadata['version'] > indexed]
+    if not pending:
+        return 0
+
+    present = catalog.open_terms(url)
+    previous = catalog.version(url, indexed) if indexed else None
+    previous_hash = previous['content_hash'] if previous else None
+    for count, metadata in enumerate(pending):
+        if progress:
+            progress(f"Indexing version {metadata['version']}", count / len(pending))
+        if metadata['content_hash'] and metadata['content_hash'] == previous_hash:
+            current = present
+        else:
+            current = terms(page_text(store.read(metadata)))
+        if not catalog.index_version(url, metadata['version'], indexed, current - present, present - current):
+            # Another indexer is working through the same versions
+            return count
+        indexed = metadata['version']
+        present = current
+        previous_hash = metadata['content_hash']
+    return len(pending)
+
+
+def _intersect(spans, others):
+    """Overlaps of two sorted lists of disjoint [start, end) ranges"""
+    overlaps = []
+    i = j = 0
+    while i < len(spans) and j < len(others):
+        start = max(spans[i][0], others[j][0])
+        end = min(spans[i][1], others[j][1])
+        if start < end:
+            overlaps.append((start, end))
+        if spans[i][1] < others[j][1]:
+            i += 1
+        else:
+            j += 1
+    return overlaps
+
+
+def search(catalog, url, phrase):
+    """Occurrence of a word or phrase in the indexed versions of a URL, or None if it has none"""
+    wanted = query_terms(phrase)
+    if not wanted:
+        return None
+    indexed = catalog.indexed_version(url)
+    ranges = None
+    for term, postings in catalog.postings(url, wanted).items():
+        term_ranges = [(first, end or indexed + 1) for first, end in postings]
+        ranges = term_ranges if ranges is None else _intersect(ranges, term_ranges)
+        if not ranges:
+            return None
+
+    # Ranges may cover versions that retention has since deleted
+    numbers = catalog.version_numbers(url)
+    spans = []
+    count = 0
+    for start, end in ranges:
+        low, high = bisect_left(numbers, start), bisect_left(numbers, end)
+        if low < high:
+            spans.append((numbers[low], numbers[high - 1]))
+            count += high - low
+    if not spans:
+        return None
+
+    after = bisect_left(numbers, spans[-1][1]) + 1
+    gone = None
+    if after < len(numbers) and numbers[after] <= indexed:
+        gone = catalog.version(url, numbers[after])
+    return Occurrence(catalog.version(url, spans[0][0]), catalog.version(url, spans[-1][1]),
+                      gone, count, spans)
@@ -0,0 +1,170 @@
+import hashlib
+from collections import namedtuple
+
+from bs4.element import PreformattedString, Tag
+
+import line_diff
+import noise_filter
+
+# kind is 'inserted', 'removed', 'moved', 'attributes' or 'text'; old and new
+# are the nodes involved on each side (None for the side that has no node)
+Change = namedtuple('Change', 'kind old new')
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _start_tag(tag):
+    parts = [f'<{tag.name}']
+    for name, value in sorted(tag.attrs.items()):
+        if isinstance(value, (list, tuple)):
+            value = ' '.join(value)
+        parts.append(f' {name}="{value}"')
+    parts.append('>')
+    return ''.join(parts)
+
+
+class TreeHashes:
+    """Merkle hash of every element and text node below a root.
+
+    An element's hash covers its name, its attributes and the hashes of its
+    children, so two subtrees with the same hash are identical and need not
+    be looked into. Comments, doctypes and whitespace-only strings are not
+    part of any hash. With noise rules, start tags and text are normalized
+    before hashing, so masked tokens never register as changes.
+    """
+
+    def __init__(self, root, noise_rules=None):
+        self.digests = {}    # id(node) -> digest
+        self.start_tags = {}  # id(tag) -> normalized start tag
+        self.children = {}   # id(tag) -> children that are part of the hash
+
+        # Reverse document order visits every child before its parent
+        nodes = list(root.descendants)
+        nodes.reverse()
+        nodes.append(root)
+
+        # Start tags and texts to hash; noise is masked for all of them at once
+        keyed = []
+        strings = []
+        for node in nodes:
+            if isinstance(node, Tag):
+                keyed.append(node)
+                strings.append(_start_tag(node) if node is not root else '')
+            elif not isinstance(node, PreformattedString):
+                text = node.strip()
+                if text:
+                    keyed.append(node)
+                    strings.append(text)
+        if noise_rules:
+            strings = noise_filter.normalize_many(strings, noise_rules)
+
+        digests = self.digests
+        for node, string in zip(keyed, strings):
+            if isinstance(node, Tag):
+                children = [child for child in node.contents if id(child) in digests]
+                self.children[id(node)] = children
+                self.start_tags[id(node)] = string
+                digests[id(node)] = _digest(string.encode('utf-8', 'surrogatepass')
+                                            + b''.join(digests[id(child)] for child in children))
+            else:
+                digests[id(node)] = _digest(b'#' + string.encode('utf-8', 'surrogatepass'))
+
+    def digest(self, node):
+        return self.digests[id(node)]
+
+
+def _pairing_key(node):
+    """Children with equal keys are diffed against each other rather than replaced"""
+    if isinstance(node, Tag):
+        return (node.name, node.get('id'))
+    return '#text'
+
+
+def diff_trees(old_root, new_root, noise_rules=None):
+    """Element-level changes between two parsed trees, as a list of Change.
+
+    Only branches whose hashes differ are walked. Their children are
+    aligned by hash, and the children left over on both sides are paired
+    up by kind and diffed further. Whatever is left unpaired was removed or
+    inserted, unless an identical subtree turns up on the other side, in
+    which case it moved.
+    """
+    old = TreeHashes(old_root, noise_rules)
+    new = TreeHashes(new_root, noise_rules)
+    changes = []
+    removed = []
+    inserted = []
+
+    stack = [(old_root, new_root)]
+    while stack:
+        old_node, new_node = stack.pop()
+        if old.digest(old_node) == new.digest(new_node):
+            continue
+        if not isinstance(old_node, Tag):
+            changes.append(Change('text', old_node, new_node))
+            continue
+        if old.start_tags[id(old_node)] != new.start_tags[id(new_node)]:
+            changes.append(Change('attributes', old_node, new_node))
+
+        old_children = old.children[id(old_node)]
+        new_children = new.children[id(new_node)]
+        # Children without an identical counterpart, in order
+        old_rest = []
+        new_rest = []
+        opcodes = line_diff.iter_opcodes([old.digest(child) for child in old_children],
+                                         [new.digest(child) for child in new_children])
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag != 'equal':
+                old_rest.extend(old_children[i1:i2])
+                new_rest.extend(new_children[j1:j2])
+
+        # Identical subtrees out of order among siblings have moved
+        if old_rest and new_rest:
+            old_by_digest = {}
+            for child in old_rest:
+                old_by_digest.setdefault(old.digest(child), []).append(child)
+            moved_here = set()
+            unmoved = []
+            for child in new_rest:
+                candidates = old_by_digest.get(new.digest(child))
+                if candidates:
+                    old_child = candidates.pop(0)
+                    moved_here.add(id(old_child))
+                    changes.append(Change('moved', old_child, child))
+                else:
+                    unmoved.append(child)
+            if moved_here:
+                old_rest = [child for child in old_rest if id(child) not in moved_here]
+                new_rest = unmoved
+
+        pairs = []
+        key_opcodes = line_diff.iter_opcodes([_pairing_key(child) for child in old_rest],
+                                             [_pairing_key(child) for child in new_rest])
+        for tag, i1, i2, j1, j2 in key_opcodes:
+            if tag == 'equal':
+                pairs.extend(zip(old_rest[i1:i2], new_rest[j1:j2]))
+            else:
+                removed.extend(old_rest[i1:i2])
+                inserted.extend(new_rest[j1:j2])
+        # Reversed so that the walk proceeds in document order
+        stack.extend(reversed(pairs))
+
+    # A removed subtree that reappears unchanged elsewhere has moved
+    removed_by_digest = {}
+    for node in removed:
+        removed_by_digest.setdefault(old.digest(node), []).append(node)
+    moved = set()
+    for node in inserted:
+        candidates = removed_by_digest.get(new.digest(node))
+        if candidates:
+            old_node = candidates.pop(0)
+            moved.add(id(old_node))
+            changes.append(Change('moved', old_node, node))
+        else:
+            changes.append(Change('inserted', None, node))
+    for node in removed:
+        if id(node) not in moved:
+            changes.append(Change('removed', node, None))
+    return changes